@@ -0,0 +1,93 @@
+# benchmarks/api_load.py
+#
+# load test of the threaded handlers against RETIC_ASYNC_API=1, each one
+# served by uvicorn in a subprocess and hit with concurrent clients doing
+# a mix of reads and writes
+#   uv run python -m benchmarks.api_load --clients 10 100 400 --seconds 5
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+parser = argparse.ArgumentParser(prog="api_load")
+parser.add_argument("--clients", help="concurrent clients", type=int, nargs="+", default=[10, 100, 400])
+parser.add_argument("--seconds", help="duration of each run", type=float, default=5.0)
+parser.add_argument("--writes", help="share of requests that are writes", type=float, default=0.2)
+parser.add_argument("--port", type=int, default=8765)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def serve(directory: str, port: int, asynchronous: bool) -> subprocess.Popen:
+    os.makedirs(os.path.join(directory, "front_end", "dist"), exist_ok=True)
+    env = os.environ | {
+        "PYTHONPATH": ROOT,
+        "RETIC_ASYNC_API": "1" if asynchronous else "0",
+        "RETIC_STORAGE": "yaml",
+        "RETIC_CONFIG_PATH": os.path.join(directory, "config.yaml"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=directory, env=env
+    )
+
+async def wait_up(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/status/active_stations")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise Exception("server didn't start")
+
+async def run(client: httpx.AsyncClient, clients: int, seconds: float, writes: float) -> list[float]:
+    latencies = []
+    stop = time.perf_counter() + seconds
+    every = max(int(1 / writes), 1) if writes > 0 else 0
+
+    async def worker(n: int):
+        i = 0
+        while time.perf_counter() < stop:
+            station_id = (n + i) % 6 + 1
+            t = time.perf_counter()
+            if every and i % every == 0:
+                r = await client.put(f"/config/station/{station_id}/program/1/name", params={"name": f"c{n}-{i}"})
+            elif i % 2:
+                r = await client.get(f"/config/station/{station_id}")
+            else:
+                r = await client.get("/status/station")
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - t)
+            i += 1
+
+    await asyncio.gather(*(worker(x) for x in range(clients)))
+    return latencies
+
+async def main(args):
+    print(f"{'handlers':>9} {'clients':>8} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for asynchronous in (False, True):
+        with tempfile.TemporaryDirectory() as d:
+            server = serve(d, args.port, asynchronous)
+            try:
+                limits = httpx.Limits(max_connections=max(args.clients))
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+                    await wait_up(client)
+                    for clients in args.clients:
+                        latencies = sorted(await run(client, clients, args.seconds, args.writes))
+                        print(
+                            f"{'async' if asynchronous else 'threaded':>9} {clients:>8} "
+                            f"{len(latencies) / args.seconds:>10.0f} "
+                            f"{latencies[len(latencies) // 2] * 1000:>9.2f} "
+                            f"{latencies[int(len(latencies) * 0.99)] * 1000:>9.2f}"
+                        )
+            finally:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
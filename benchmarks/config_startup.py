@@ -0,0 +1,72 @@
+# benchmarks/config_startup.py
+#
+# time Config startup (storage load) for each snapshot format
+#   uv run python -m benchmarks.config_startup --sizes 10 1000 100000
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from models import Config, Station, Program, Trigger, DayOfWeek
+from models.storage import YamlStorage, BinaryStorage, JournalStorage
+
+parser = argparse.ArgumentParser(prog="config_startup")
+parser.add_argument("--sizes", help="total number of programs", type=int, nargs="+", default=[10, 1_000, 100_000])
+parser.add_argument("--per-station", help="programs per station", type=int, default=10)
+parser.add_argument("--repeat", help="best of n loads", type=int, default=3)
+
+def build(n_programs: int, per_station: int) -> dict[int, Station]:
+    stations = {}
+    triggers = list(Trigger)
+    days = list(DayOfWeek)
+    for i in range(n_programs):
+        station_id = i // per_station + 1
+        if station_id not in stations:
+            stations[station_id] = Station(station_id, programs={}, override=None, description=f"zone {station_id}", enabled=True)
+        p = Program(
+            trigger=triggers[i % len(triggers)],
+            start_time=datetime(1970, 1, 1, i % 24, i % 60),
+            duration=timedelta(minutes=5 + i % 30),
+            program_id=i % per_station + 1,
+            name=f"program {i}",
+            description="",
+            week_day=days[i % 7],
+            enabled=bool(i % 2),
+            last_triggered=datetime(2025, 4, 1, 6, 0) if i % 3 else None
+        )
+        stations[station_id]._adopt(p)
+    return stations
+
+def best_of(repeat: int, f) -> float:
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    print(f"{'programs':>10} {'format':>8} {'bytes':>12} {'save s':>10} {'load s':>10}")
+    for n in args.sizes:
+        config = Config(stations=build(n, args.per_station))
+        with tempfile.TemporaryDirectory() as d:
+            formats = {
+                "yaml": lambda: YamlStorage(os.path.join(d, "config.yaml")),
+                "binary": lambda: BinaryStorage(os.path.join(d, "config.bin")),
+                "journal": lambda: JournalStorage(os.path.join(d, "journal"), fsync=False),
+            }
+            for name, storage in formats.items():
+                s = storage()
+                if isinstance(s, JournalStorage):
+                    s.load()
+                save = best_of(1, lambda: s.save(config))
+                s.close()
+                load = best_of(args.repeat, lambda: Config(storage=storage()))
+
+                size = os.path.getsize(s.snapshot_path if name == "journal" else s.path)
+                print(f"{n:>10} {name:>8} {size:>12} {save:>10.4f} {load:>10.4f}")
@@ -0,0 +1,45 @@
+# benchmarks/fleet_eval.py
+#
+# per tick cost of the vectorized fleet evaluator against the per object
+# Station.status loop, needs numpy
+#   uv run python -m benchmarks.fleet_eval --sizes 1000 10000 50000
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from models import Config
+from models.fleet import FleetEvaluator
+from benchmarks.config_startup import build
+
+parser = argparse.ArgumentParser(prog="fleet_eval")
+parser.add_argument("--sizes", help="total number of programs", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+parser.add_argument("--per-station", help="programs per station", type=int, default=10)
+parser.add_argument("--ticks", help="timestamps to evaluate, one every --step minutes", type=int, default=96)
+parser.add_argument("--step", help="minutes between ticks", type=int, default=15)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    start = datetime(2025, 4, 4)
+    ticks = [start + timedelta(minutes=args.step * x) for x in range(args.ticks)]
+
+    print(f"{'programs':>10} {'pack s':>10} {'loop ms/tick':>14} {'numpy ms/tick':>14} {'speedup':>8}")
+    for n in args.sizes:
+        config = Config(stations=build(n, args.per_station))
+
+        t = time.perf_counter()
+        fleet = FleetEvaluator.from_config(config)
+        pack = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for dt in ticks:
+            for s in config.stations.values():
+                s.status(dt)
+        loop = (time.perf_counter() - t) / len(ticks)
+
+        t = time.perf_counter()
+        for dt in ticks:
+            fleet.evaluate(dt)
+        vec = (time.perf_counter() - t) / len(ticks)
+
+        print(f"{n:>10} {pack:>10.4f} {loop * 1000:>14.3f} {vec * 1000:>14.3f} {loop / vec:>8.1f}")
@@ -0,0 +1,85 @@
+# benchmarks/read_path.py
+#
+# the read endpoints served from SerializedConfig against returning the
+# snapshot for FastAPI to validate and serialize, through a TestClient
+#   uv run python -m benchmarks.read_path --stations 1000 --requests 200
+
+import argparse
+import time
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from models import Config, ConfigModel, StationModel, ProgramModel
+from models.serialized import SerializedConfig
+from lib.fastapi_helper import json_response
+from benchmarks.config_startup import build
+
+parser = argparse.ArgumentParser(prog="read_path")
+parser.add_argument("--stations", type=int, nargs="+", default=[1000])
+parser.add_argument("--per-station", help="programs per station", type=int, default=4)
+parser.add_argument("--requests", help="requests per endpoint", type=int, default=200)
+
+def app_for(config: Config) -> FastAPI:
+    app = FastAPI()
+    serialized = SerializedConfig()
+
+    @app.get("/model/config", response_model=ConfigModel)
+    def model_config():
+        return config.snapshot
+
+    @app.get("/model/station/{station_id}", response_model=StationModel)
+    def model_station(station_id: int):
+        return config.snapshot.stations[station_id]
+
+    @app.get("/model/station/{station_id}/program", response_model=list[ProgramModel])
+    def model_programs(station_id: int):
+        return list(config.snapshot.stations[station_id].programs.values())
+
+    @app.get("/bytes/config", response_model=ConfigModel)
+    def bytes_config():
+        return json_response(serialized.config(config.published(), datetime.now()))
+
+    @app.get("/bytes/station/{station_id}", response_model=StationModel)
+    def bytes_station(station_id: int):
+        return json_response(serialized.station(config.published(), station_id, datetime.now()))
+
+    @app.get("/bytes/station/{station_id}/program", response_model=list[ProgramModel])
+    def bytes_programs(station_id: int):
+        return json_response(serialized.programs(config.published(), station_id))
+
+    return app
+
+def per_request(client: TestClient, url: str, n: int, commit=None) -> float:
+    t = time.perf_counter()
+    for i in range(n):
+        if commit is not None:
+            commit(i)
+        client.get(url(i)).raise_for_status()
+    return (time.perf_counter() - t) / n
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    print(f"{'stations':>9} {'endpoint':>16} {'model ms':>10} {'bytes ms':>10} {'speedup':>8}")
+    for n in args.stations:
+        config = Config(stations=build(n * args.per_station, args.per_station))
+
+        def commit(i):
+            # one program changes between requests, as if it was being edited
+            with config.update_config():
+                config.get_station(i % n + 1).get_program(1).set_name(f"p{i}")
+
+        cases = {
+            "config": (lambda i: "config", max(args.requests // 20, 5), None),
+            "config+commit": (lambda i: "config", max(args.requests // 20, 5), commit),
+            "station": (lambda i: f"station/{i % n + 1}", args.requests, None),
+            "programs": (lambda i: f"station/{i % n + 1}/program", args.requests, None),
+        }
+        with TestClient(app_for(config)) as client:
+            for name, (path, requests, change) in cases.items():
+                assert client.get(f"/model/{path(0)}").json() == client.get(f"/bytes/{path(0)}").json()
+                model = per_request(client, lambda i: f"/model/{path(i)}", requests, change)
+                raw = per_request(client, lambda i: f"/bytes/{path(i)}", requests, change)
+                print(f"{n:>9} {name:>16} {model * 1000:>10.3f} {raw * 1000:>10.3f} {model / raw:>8.1f}")
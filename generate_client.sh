@@ -26,3 +26,12 @@ npm run build
 
 echo "returning to start directory $start_dir"
 cd $start_dir 
+
+echo "precompressing the build (.gz, and .br if brotli is installed)"
+find "$fe_dir/dist" -type f \( -name '*.js' -o -name '*.css' -o -name '*.html' \
+-o -name '*.svg' -o -name '*.json' -o -name '*.map' -o -name '*.txt' \) | while read -r f; do
+    gzip -k -f -9 "$f"
+    if command -v brotli > /dev/null; then
+        brotli -k -f -q 11 "$f"
+    fi
+done
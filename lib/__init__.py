@@ -1,7 +1,13 @@
 from lib import dt_helpers
 from lib import pydantic_helper
+from lib import interval_index
+from lib import fastapi_helper
+from lib import registry
 
 __all__ = [
     dt_helpers.__name__,
-    pydantic_helper.__name__
+    pydantic_helper.__name__,
+    interval_index.__name__,
+    fastapi_helper.__name__,
+    registry.__name__
 ]
\ No newline at end of file
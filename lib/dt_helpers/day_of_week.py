@@ -9,6 +9,13 @@ class DayOfWeek(StrEnum):
     saturday = auto()
     sunday = auto()
 
+    @classmethod
+    def _missing_(cls, value):
+        # allow DayOfWeek(datetime.weekday())
+        if type(value) is int:
+            return cls.from_dt(value)
+        return None
+
     @classmethod
     def from_dt(cls, day:int):
         match day:
@@ -0,0 +1,11 @@
+from .fastapi_helper import async_router, etag_matches, not_modified, json_response, ResponseCache
+from .static_files import PrecompressedStaticFiles
+
+__all__ = [
+    async_router.__name__,
+    etag_matches.__name__,
+    not_modified.__name__,
+    json_response.__name__,
+    ResponseCache.__name__,
+    PrecompressedStaticFiles.__name__
+]
@@ -0,0 +1,98 @@
+import asyncio
+import inspect
+from functools import wraps
+from typing import Any, Hashable
+
+from fastapi import APIRouter, Request, Response
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+# Turns a router of plain def handlers into one of async def handlers.
+# FastAPI runs plain handlers in its thread pool, so throughput is capped
+# by the pool size and every request pays for a thread hop. Handlers that
+# never block (no I/O, just work on in-memory state) can run straight on
+# the event loop instead. Anything that modifies state (not GET/HEAD) is
+# serialized through `lock`.
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# what add_api_route takes, APIRoute keeps each under the same name
+ROUTE_OPTIONS = [
+    x for x in inspect.signature(APIRouter.add_api_route).parameters
+    if x not in ("self", "path", "endpoint", "route_class_override")
+]
+
+def _on_loop(fn, lock: asyncio.Lock | None):
+    @wraps(fn) # FastAPI reads the parameters off the wrapped handler
+    async def handler(*args, **kwargs):
+        if lock is None:
+            return fn(*args, **kwargs)
+        async with lock:
+            return fn(*args, **kwargs)
+    return handler
+
+def async_router(router: APIRouter, lock: asyncio.Lock) -> APIRouter:
+    out = APIRouter()
+    for route in router.routes:
+        if not isinstance(route, APIRoute) or asyncio.iscoroutinefunction(route.endpoint):
+            out.routes.append(route)
+            continue
+        # every option the route was declared with, only the endpoint changes
+        options = {x: getattr(route, x) for x in ROUTE_OPTIONS if hasattr(route, x)}
+        out.add_api_route(
+            route.path,
+            _on_loop(route.endpoint, None if route.methods <= READ_METHODS else lock),
+            route_class_override=type(route),
+            **options
+        )
+    return out
+
+def json_response(body: bytes, etag: str | None = None) -> Response:
+    # for JSON that is already serialized
+    return Response(body, media_type="application/json", headers={"ETag": etag} if etag else None)
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match compares weakly: W/"x" matches "x", * matches anything
+    if not if_none_match:
+        return False
+    tags = [x.strip() for x in if_none_match.split(",")]
+    return any(x == "*" or x.removeprefix("W/") == etag for x in tags)
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    # a 304 to send instead when the client already has etag
+    if etag_matches(request.headers.get("if-none-match", None), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+class ResponseCache():
+    # JSON response bodies, each kept for as long as the object it was
+    # built from is still the current one. Meant for state that is swapped
+    # rather than mutated, so a new object means a new answer and the same
+    # object the same answer, no expiry times or invalidation needed.
+    def __init__(self):
+        self._entries : dict[Hashable, tuple[Any, bytes]] = {}
+        self._adapters : dict[Any, TypeAdapter] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def response(self, key: Hashable, source: Any, response_type: Any, value: Any = None) -> Response:
+        # the cached body for key if it was built from source, otherwise
+        # value (source when not given) serialized as response_type
+        entry = self._entries.get(key, None)
+        if entry is not None and entry[0] is source:
+            self.hits += 1
+            return Response(entry[1], media_type="application/json")
+
+        adapter = self._adapters.get(response_type, None)
+        if adapter is None:
+            adapter = self._adapters[response_type] = TypeAdapter(response_type)
+        body = adapter.dump_json(source if value is None else value)
+        self._entries[key] = (source, body)
+        self.misses += 1
+        return Response(body, media_type="application/json")
+
+    def discard(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
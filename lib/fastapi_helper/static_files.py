@@ -0,0 +1,83 @@
+import os
+import re
+import stat
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+
+# StaticFiles for a built front end (vite): serves the .br/.gz files the
+# build left next to a file to clients that accept them, lets hashed
+# assets be cached for good and has everything else revalidated. Starlette
+# already answers conditional (If-None-Match, If-Modified-Since) and range
+# requests, each variant has its own ETag.
+
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")] # preferred first
+
+# vite puts its output in assets/ as name-<hash>.ext, a new build means a
+# new name. Files from public/ keep theirs
+HASHED = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+def accepted_encodings(accept_encoding: str | None) -> set[str]:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    if "*" in accepted:
+        accepted |= {x[0] for x in ENCODINGS}
+    return accepted
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (path, mtime) -> [(encoding, path, stat)], the build doesn't
+        # change under a running server often so only stat them once
+        self._variants : dict[tuple[str, float], list[tuple[str, str, os.stat_result]]] = {}
+
+    def variants(self, full_path: str, stat_result: os.stat_result) -> list[tuple[str, str, os.stat_result]]:
+        key = (full_path, stat_result.st_mtime)
+        if key not in self._variants:
+            found = []
+            for encoding, suffix in ENCODINGS:
+                try:
+                    s = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # a variant older than the file is left over from a previous build
+                if stat.S_ISREG(s.st_mode) and s.st_mtime >= stat_result.st_mtime:
+                    found.append((encoding, full_path + suffix, s))
+            self._variants[key] = found
+        return self._variants[key]
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        relative = os.path.relpath(full_path, os.path.realpath(self.directory)).replace(os.sep, "/") if self.directory else ""
+        headers = {"Cache-Control": IMMUTABLE if HASHED.match(relative) else REVALIDATE}
+
+        variants = self.variants(full_path, stat_result)
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+        accepted = accepted_encodings(request_headers.get("accept-encoding", None))
+        for encoding, path, s in variants:
+            if encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                media_type = guess_type(full_path)[0] or "text/plain"
+                response = FileResponse(path, status_code=status_code, stat_result=s, headers=headers, media_type=media_type)
+                break
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
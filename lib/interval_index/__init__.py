@@ -0,0 +1,3 @@
+from .interval_index import IntervalIndex
+
+__all__ = [IntervalIndex.__name__]
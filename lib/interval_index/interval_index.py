@@ -0,0 +1,130 @@
+import heapq
+from bisect import bisect_right
+from itertools import count
+from typing import Any, Iterator
+
+# Half open intervals [start, end) with a value each, indexed for point
+# lookups. Where intervals overlap the one with the highest priority
+# wins (by default the latest start, then the latest added).
+#
+# The index is a flat list of boundaries with the winner of each segment
+# between them, so at() and next_boundary() are a bisect, O(log n). It is
+# rebuilt in O(n log n) on the first query after a change, adding many
+# intervals in one go only costs one rebuild.
+
+class IntervalIndex():
+    def __init__(self):
+        self._items : dict[Any, tuple[Any, Any, Any, Any]] = {} # id -> (start, end, priority, value)
+        self._seq = count()
+        self._segments : tuple[list, list] = ([], []) # (boundaries, (id, value) or None after each)
+        self._stale = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def items(self) -> Iterator[tuple[Any, Any, Any, Any]]:
+        # (id, start, end, value) ordered by start
+        for item_id, (start, end, _, value) in sorted(self._items.items(), key=lambda x: (x[1][0], x[1][2])):
+            yield item_id, start, end, value
+
+    def add(self, item_id, start, end, value, priority=None):
+        if priority is None:
+            priority = (start, next(self._seq))
+        self._items[item_id] = (start, end, priority, value)
+        self._stale = True
+
+    def remove(self, item_id) -> bool:
+        if self._items.pop(item_id, None) is None:
+            return False
+        self._stale = True
+        return True
+
+    def clear(self):
+        self._items.clear()
+        self._stale = True
+
+    def expire(self, before) -> list:
+        # drop everything that ended at or before `before`, returns the ids
+        gone = [x[0] for x in self._items.items() if x[1][1] <= before]
+        for item_id in gone:
+            del self._items[item_id]
+        if gone:
+            self._stale = True
+        return gone
+
+    def _rebuild(self):
+        # cleared first, a change made while this runs marks it stale again
+        self._stale = False
+        items = sorted(self._items.items(), key=lambda x: x[1][0])
+        bounds = sorted({x[1][0] for x in items} | {x[1][1] for x in items})
+
+        winners = []
+        active = [] # max heap on priority, entries past their end are dropped lazily
+        n = 0
+        for b in bounds:
+            while n < len(items) and items[n][1][0] <= b:
+                item_id, (start, end, priority, value) = items[n]
+                heapq.heappush(active, (_Neg(priority), item_id, end, value))
+                n += 1
+            while active and active[0][2] <= b:
+                heapq.heappop(active)
+            winners.append((active[0][1], active[0][3]) if active else None)
+
+        # merge neighbouring segments with the same winner
+        merged_bounds, merged_winners = [], []
+        for b, w in zip(bounds, winners):
+            if merged_winners and merged_winners[-1] == w:
+                continue
+            merged_bounds.append(b)
+            merged_winners.append(w)
+
+        # swapped in one go, a reader on another thread sees either the
+        # old segments or the new ones
+        self._segments = (merged_bounds, merged_winners)
+
+    def _lookup(self, t) -> tuple[list, list, int]:
+        if self._stale:
+            self._rebuild()
+        bounds, winners = self._segments
+        return bounds, winners, bisect_right(bounds, t) - 1
+
+    def at_id(self, t):
+        _, winners, i = self._lookup(t)
+        w = winners[i] if i >= 0 else None
+        return w[0] if w is not None else None
+
+    def at(self, t):
+        _, winners, i = self._lookup(t)
+        w = winners[i] if i >= 0 else None
+        return w[1] if w is not None else None
+
+    def next_boundary(self, t):
+        # the first time after t where the winner can change
+        bounds, _, i = self._lookup(t)
+        return bounds[i + 1] if i + 1 < len(bounds) else None
+
+    def segments(self, start, end) -> Iterator[tuple[Any, Any, Any]]:
+        # (start, end, value) of the winning interval over [start, end)
+        bounds, winners, i = self._lookup(start)
+        i = max(i, 0)
+        while i < len(bounds) and bounds[i] < end:
+            w = winners[i]
+            if w is not None:
+                yield max(bounds[i], start), min(bounds[i + 1], end), w[1]
+            i += 1
+
+class _Neg():
+    # inverts the ordering so heapq gives the highest priority first
+    __slots__ = ("v",)
+
+    def __init__(self, v):
+        self.v = v
+
+    def __lt__(self, other):
+        return self.v > other.v
+
+    def __eq__(self, other):
+        return self.v == other.v
@@ -14,6 +14,9 @@ class FromPydantic:
 
         if isinstance(pyd, Enum):
             return cls(pyd)
+
+        if isinstance(pyd, str) and issubclass(cls, Enum):
+            return cls(pyd)
         
         if isinstance(pyd, BaseModel):
             return cls(**pyd.model_dump())
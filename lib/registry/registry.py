@@ -0,0 +1,79 @@
+import heapq
+from typing import Any, Callable
+
+# A dict of items by integer id that also hands out the lowest id not in
+# use.
+#
+# Free ids are a min-heap of [start, end) gaps below the highest id seen.
+# A deleted id goes back on as a gap of one, an id inserted inside a gap
+# is skipped over the next time that gap comes to the top, so allocate()
+# is O(log n) amortized instead of sorting every id.
+#
+# It has no secondary indexes. Lookups by enabled, trigger and start time
+# are kept with the published snapshot instead, by models.listing's
+# StationIndex and models.upcoming's StartIndex. Readers use those without
+# the config lock, and nothing has to update them as live objects change.
+
+class Registry(dict):
+    def __init__(self, items: dict[int, Any] | None = None):
+        super().__init__()
+        self._free : list[tuple[int, int]] = []
+        self._next = 1 # above every id seen
+        for k, v in (items or {}).items():
+            self[k] = v
+
+    def __setitem__(self, key: int, value: Any):
+        super().__setitem__(key, value)
+        if key >= self._next:
+            if key > self._next:
+                heapq.heappush(self._free, (self._next, key))
+            self._next = key + 1
+
+    def __delitem__(self, key: int):
+        super().__delitem__(key)
+        if 0 < key:
+            heapq.heappush(self._free, (key, key + 1))
+
+    def pop(self, key: int, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().__getitem__(key)
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key: int, default: Any = None):
+        if key not in self:
+            self[key] = default
+        return super().__getitem__(key)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self):
+        super().clear()
+        self._free = []
+        self._next = 1
+
+    def allocate(self) -> int:
+        # the lowest free id from 1, it is only taken once an item is put in
+        while self._free:
+            start, end = self._free[0]
+            if start not in self:
+                return start
+            if start + 1 < end:
+                heapq.heapreplace(self._free, (start + 1, end))
+            else:
+                heapq.heappop(self._free)
+        return self._next
+
+    def sort(self, key: Callable[[int], Any] | None = None):
+        # reorders the items, by id unless given a key for the ids
+        items = sorted(super().items(), key=(lambda x: x[0]) if key is None else (lambda x: key(x[0])))
+        super().clear()
+        for k, v in items:
+            super().__setitem__(k, v)
@@ -1,39 +1,77 @@
-from typing import Union
+from typing import Annotated, Union
 from contextlib import asynccontextmanager
 from models import (
     Config, 
     ConfigModel, 
+    ConfigChangesModel,
     StationModel, 
     Station, 
     StationSummaryModel, 
     ProgramModel, 
+    ProgramPatchModel,
+    StationPatchModel,
+    OverrideModel,
     OverrideType,
     Trigger,
-    DayOfWeek
+    DayOfWeek,
+    Scheduler
 )
+from models.storage import ConfigWriter, ConfigWatcher
+from models.forecast import forecast, station_intervals
+from models.events import EventStream
+from models.serialized import SerializedConfig
+from models.listing import ListingQueryModel, Listings, parse_fields, select, station_filters
+from models.programs import State
+from models.upcoming import UpcomingRunModel, upcoming
+from models.batch import Operation, BatchResultModel, BatchError, apply_batch
 from copy import deepcopy
 
 from datetime import datetime, timedelta, time
 
 import os, sys 
 
-from fastapi import FastAPI, HTTPException, status, Request, Response 
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, status, Request, Response 
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from pydantic import TypeAdapter
+
+from lib.fastapi_helper import async_router, not_modified, json_response, ResponseCache, PrecompressedStaticFiles
+import asyncio
+import json
 
 import logging 
 logging.basicConfig()
 logger = logging.getLogger()
 
 config = Config()
+config_writer = ConfigWriter(
+    config, 
+    debounce=float(os.environ.get("RETIC_WRITE_DEBOUNCE", 0.5)),
+    max_delay=float(os.environ.get("RETIC_WRITE_MAX_DELAY", 5.0))
+)
+scheduler = Scheduler(config)
+event_stream = EventStream(scheduler)
+# with RETIC_SHARED=1 the workers share a sqlite config and pick up each other's changes
+config_watcher = ConfigWatcher(
+    config, 
+    interval=float(os.environ.get("RETIC_SHARED_POLL", 0.25))
+) if config.shared else None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    pass 
+    await config_writer.start()
+    if config_watcher is not None:
+        await config_watcher.start()
+    await scheduler.start()
+    event_stream.start()
     yield
-    pass 
+    event_stream.stop()
+    await scheduler.stop()
+    if config_watcher is not None:
+        await config_watcher.stop()
+    await config_writer.stop()
+    config.close()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -44,75 +82,259 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/config", response_model = ConfigModel  )
-def get_full_config() -> Config :
-    return ConfigModel.from_orm(config)
-
-@app.get("/config/station/{station_no}", response_model=StationModel )
-def get_station(station_no:int ) -> Station:
-    s = config.get_station(station_id=station_no)
-    if s is None:
-        raise HTTPException(status_code=404, detail="Not Found")
-    return StationModel.from_orm(s)
-
-@app.get("/status/station", response_model=list[StationSummaryModel])
-def get_station_statuses():
-    return [x.status(datetime.now()) for x in config.stations.values()]
-
-@app.get("/status/active_stations", response_model=dict[int, bool])
+# The handlers are written as plain functions. By default FastAPI runs
+# them in its thread pool. With RETIC_ASYNC_API=1 they run on the event
+# loop instead, with the writes serialized by config_alock. A commit only
+# marks the config dirty, the config writer saves from its own executor
+# and only holds config.lock while it copies the changed stations, so a
+# slow disk doesn't hold up the handlers that take the lock.
+api = APIRouter()
+config_alock = asyncio.Lock()
+
+# Readers use the snapshot of the last commit, no locking. Its ETag and
+# the snapshot are read together so they always agree, a client sending
+# it back in If-None-Match gets a 304 when nothing has changed. The JSON
+# is kept serialized until a commit changes it, see SerializedConfig
+serialized = SerializedConfig()
+
+# The listings take filters, a cursor and limit and a fields= projection
+# (ListingQueryModel). The link to the next page is in the Link header so
+# the body is the same shape with or without them
+listings = Listings()
+
+def fields_of(query: ListingQueryModel, model) -> set[str] | None:
+    try:
+        return parse_fields(query.fields, model)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def projected(body) -> bytes:
+    return json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode()
+
+def page_response(request: Request, body: bytes, next_cursor: int | None, etag: str | None = None) -> Response:
+    response = json_response(body, etag)
+    if next_cursor is not None:
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return response
+
+@api.get("/config", response_model = ConfigModel  )
+def get_full_config(request: Request, query: Annotated[ListingQueryModel, Query()]) -> Config :
+    published, now = config.published(), datetime.now()
+    # being active isn't part of the config, it changes without a commit
+    etag = published.etag(config.epoch, None, now) if query.active is None else None
+    unchanged = not_modified(request, etag) if etag is not None else None
+    if unchanged is not None or query.is_everything():
+        return unchanged or json_response(serialized.config(published, now), etag)
+
+    fields = fields_of(query, StationModel)
+    index = listings.stations(published.snapshot)
+    include, exclude = station_filters(
+        index, listings.active(scheduler.active), query.enabled, query.trigger, query.active
+    )
+    page, next_cursor = select(index.ids, include, exclude, query.min_id, query.max_id, query.cursor, query.limit)
+    if fields is None:
+        body = serialized.stations(published, page, now)
+    else:
+        stations = published.snapshot.stations
+        body = projected({"stations": {x: stations[x].model_dump(mode="json", include=fields) for x in page}})
+    return page_response(request, body, next_cursor, etag)
+
+@api.get("/config/changes", response_model=ConfigChangesModel)
+def get_config_changes(since: int = Query(ge=0), epoch: str | None = None):
+    # what changed after version `since`, a reset with everything when the
+    # versions are from another process (epoch) or too far back
+    return config.changes_since(since if epoch in (None, config.epoch) else -1)
+
+def published_station(request: Request, station_id: int):
+    # (the snapshot, when, the station's etag, a 304 to send instead)
+    published, now = config.published(), datetime.now()
+    etag = published.etag(config.epoch, station_id, now)
+    if etag is None:
+        raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+    return published, now, etag, not_modified(request, etag)
+
+@api.get("/config/station/{station_no}", response_model=StationModel )
+def get_station(station_no:int, request: Request) -> Station:
+    published, now, etag, unchanged = published_station(request, station_no)
+    return unchanged or json_response(serialized.station(published, station_no, now), etag)
+
+# The scheduler keeps these up to date, the handlers only read them. What
+# it publishes is swapped, never mutated, at every transition and after
+# every commit, so the serialized responses are cached against the objects
+# they came from and only rebuilt once the scheduler has published new ones
+status_cache = ResponseCache()
+summaries_json = TypeAdapter(list[StationSummaryModel])
+
+@api.get("/status/station", response_model=list[StationSummaryModel])
+def get_station_statuses(request: Request, query: Annotated[ListingQueryModel, Query()]):
+    statuses = scheduler.statuses
+    if query.is_everything():
+        return status_cache.response("statuses", statuses, list[StationSummaryModel], list(statuses.values()))
+
+    fields = fields_of(query, StationSummaryModel)
+    include, exclude = station_filters(
+        listings.stations(config.snapshot), listings.active(scheduler.active), 
+        query.enabled, query.trigger, query.active
+    )
+    page, next_cursor = select(
+        listings.keys(statuses), include, exclude, query.min_id, query.max_id, query.cursor, query.limit
+    )
+    if fields is None:
+        body = summaries_json.dump_json([statuses[x] for x in page])
+    else:
+        body = projected([statuses[x].model_dump(mode="json", include=fields) for x in page])
+    return page_response(request, body, next_cursor)
+
+@api.get("/status/active_stations", response_model=dict[int, bool])
 def get_active_stations():
-    return {x.station_id : x.is_active() for x in config.stations.values()}
+    return status_cache.response("active", scheduler.active, dict[int, bool])
 
-@app.get("/status/station/{station_id}", response_model=StationSummaryModel)
+@api.get("/status/station/{station_id}", response_model=StationSummaryModel)
 def get_station_status(station_id: int):
-    r = [x.status(datetime.now()) for x in config.stations.values() if x.station_id == station_id]
-    if r == []:
+    r = scheduler.statuses.get(station_id, None)
+    if r is None:
         raise HTTPException(status_code=404)
-    return r[0]
+    return status_cache.response(("status", station_id), r, StationSummaryModel)
 
-@app.get("/status/station/{station_id}/is_active", response_model=bool)
+@api.get("/status/station/{station_id}/is_active", response_model=bool)
 def get_station_is_active(station_id: int):
-    s = config.get_station(station_id)
+    r = scheduler.statuses.get(station_id, None)
+    if r is None:
+        raise HTTPException(status_code=404, detail=f"station {station_id} does not exist")
+    return status_cache.response(("is_active", station_id), r, bool, r.is_active())
+
+@api.get("/events")
+async def get_events(request: Request, since: str | None = None):
+    # Server-Sent Events of the state changes, a reconnecting client
+    # sends Last-Event-ID (or ?since=) and only gets what it missed
+    last_seq = event_stream.parse_token(request.headers.get("last-event-id", since))
+
+    async def stream():
+        async for event in event_stream.events(last_seq):
+            if await request.is_disconnected():
+                break
+            yield event_stream.format(event)
+
+    return StreamingResponse(
+        stream(), 
+        media_type="text/event-stream", 
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api.get("/status/upcoming", response_model=list[UpcomingRunModel])
+def get_upcoming(window: int = Query(60, ge=1, le=7 * 24 * 60)):
+    # the programs starting in the next `window` minutes, from the start
+    # time index kept with the snapshot
+    published, now = config.published(), datetime.now()
+    return upcoming(published.starts, published.snapshot.stations, now, now + timedelta(minutes=window))
+
+@api.get("/forecast", response_model=dict[int, list[tuple[datetime, datetime]]])
+def get_forecast(start: datetime, end: datetime, station_id: int | None = None):
+    if end <= start:
+        raise HTTPException(status_code=422, detail="end must be after start")
+    if end - start > timedelta(days=366):
+        raise HTTPException(status_code=422, detail="forecasts are limited to a year")
+
+    stations = config.snapshot.stations
+    if station_id is None:
+        return forecast(stations, start, end)
+
+    s = stations.get(station_id, None)
     if s is None:
         raise HTTPException(status_code=404, detail=f"station {station_id} does not exist")
-    return s.is_active()
+    return {station_id: station_intervals(s, start, end)}
+
+@api.get("/status/config_writer", response_model=dict[str, int])
+def get_config_writer_stats():
+    return config_writer.stats()
+
+@api.get("/status/response_cache", response_model=dict[str, int])
+def get_response_cache_stats():
+    return status_cache.stats()
 
+@api.get("/status/config_watcher", response_model=dict[str, int])
+def get_config_watcher_stats():
+    if config_watcher is None:
+        raise HTTPException(status_code=404, detail="the config isn't shared, see RETIC_SHARED")
+    return config_watcher.stats()
 
 
-@app.post("/config/station")
+@api.post("/config/station")
 def get_new_station():
     s = config.add_station()
     return RedirectResponse(f"/status/station/{s.station_id}", 201)
 
-@app.delete("/config/station/{station_id}")
+@api.delete("/config/station/{station_id}")
 def delete_station(station_id: int):
     with config.update_config():
         config.delete_station(station_no=station_id)
 
-@app.get("/config/station/{station_id}/program", response_model=list[ProgramModel])
-def get_station_programs(station_id:int):
-    return [
-        ProgramModel.from_orm(x) 
-        for x 
-        in config.get_station(station_id=station_id).programs.values()
-    ]
-
-@app.put("/config/station/{station_id}/description")
+@api.get("/config/station/{station_id}/program", response_model=list[ProgramModel])
+def get_station_programs(station_id:int, request: Request, query: Annotated[ListingQueryModel, Query()]):
+    published, _, etag, unchanged = published_station(request, station_id)
+    if query.active is not None:
+        etag, unchanged = None, None
+    if unchanged is not None or query.is_everything():
+        return unchanged or json_response(serialized.programs(published, station_id), etag)
+
+    # a station's programs are few, they're filtered as they are
+    fields = fields_of(query, ProgramModel)
+    programs = published.snapshot.stations[station_id].programs
+    status = scheduler.statuses.get(station_id, None)
+    active = {x[0] for x in status.program_states.items() if x[1] == State.activated} if status else set()
+    include, exclude = [], []
+    if query.enabled is not None:
+        (include if query.enabled else exclude).append({x.program_id for x in programs.values() if x.enabled})
+    if query.trigger is not None:
+        include.append({x.program_id for x in programs.values() if x.trigger == query.trigger})
+    if query.active is not None:
+        (include if query.active else exclude).append(active)
+    page, next_cursor = select(sorted(programs), include, exclude, query.min_id, query.max_id, query.cursor, query.limit)
+    if fields is None:
+        body = serialized.programs(published, station_id, page)
+    else:
+        body = projected([programs[x].model_dump(mode="json", include=fields) for x in page])
+    return page_response(request, body, next_cursor, etag)
+
+@api.put("/config/station/{station_id}/description")
 def set_station_description(station_id:int, desc:str):
     with config.update_config():
         config.get_station(station_id).update_description(desc)
 
-@app.put("/config/station/{station_id}/enable")
+@api.put("/config/station/{station_id}/enable")
 def set_station_enabled(station_id:int):
     with config.update_config():
         config.get_station(station_id).set_enabled()
 
-@app.put("/config/station/{station_id}/disable")
+@api.put("/config/station/{station_id}/disable")
 def set_station_disabled(station_id:int):
     with config.update_config():
         config.get_station(station_id).set_disabled()
 
-@app.put("/config/station/{station_id}/override")
+@api.patch("/config/station/{station_id}", response_model=StationModel)
+def patch_station(station_id: int, patch: StationPatchModel):
+    # any number of fields and programs, one commit
+    with config.update_config():
+        s = config.get_station(station_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+        try:
+            s.patch(patch)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=e.args[0])
+        return StationModel.from_orm(s)
+
+@api.post("/batch", response_model=list[BatchResultModel], response_model_exclude_none=True)
+def run_batch(ops: list[Operation]):
+    # applied in order, all or nothing, written once
+    if len(ops) > 10_000:
+        raise HTTPException(status_code=422, detail="a batch is limited to 10000 operations")
+    try:
+        return apply_batch(config, ops)
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail={"index": e.index, "detail": e.detail})
+
+@api.put("/config/station/{station_id}/override")
 def set_station_override(
     station_id: int, 
     start_time: datetime, 
@@ -128,31 +350,62 @@ def set_station_override(
             enabled
         )
 
-@app.post("/config/station/{station_id}/program")
+@api.get("/config/station/{station_id}/override", response_model=list[OverrideModel])
+def get_station_overrides(station_id: int, request: Request, response: Response):
+    published, _, etag, unchanged = published_station(request, station_id)
+    response.headers["ETag"] = etag
+    return unchanged or published.snapshot.stations[station_id].overrides
+
+@api.post("/config/station/{station_id}/override", response_model=list[OverrideModel])
+def add_station_overrides(station_id: int, overrides: list[OverrideModel]):
+    with config.update_config():
+        s = config.get_station(station_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+        return [OverrideModel.from_orm(x) for x in s.add_overrides(overrides)]
+
+@api.delete("/config/station/{station_id}/override", response_model=list[int])
+def expire_station_overrides(station_id: int, before: datetime | None = None):
+    with config.update_config():
+        s = config.get_station(station_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+        return s.expire_overrides(before or datetime.now())
+
+@api.delete("/config/station/{station_id}/override/{override_id}")
+def delete_station_override(station_id: int, override_id: int):
+    with config.update_config():
+        s = config.get_station(station_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+        if not s.delete_override(override_id):
+            raise HTTPException(
+                status_code=404, 
+                detail=f"station {station_id}, override {override_id} doesn't exist"
+            )
+
+@api.post("/config/station/{station_id}/program")
 def get_new_program(station_id: int):
     with config.update_config():
         p = config.get_station(station_id).add_program()
         
         return RedirectResponse(f"/config/station/{station_id}/program/{p.program_id}", 201)
 
-@app.get("/config/station/{station_id}/program/{program_id}", response_model=ProgramModel)
-def get_station_program(station_id:int, program_id:int, response: Response):
-    s = config.get_station(station_id)
-    if s is None:
-        raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+@api.get("/config/station/{station_id}/program/{program_id}", response_model=ProgramModel)
+def get_station_program(station_id:int, program_id:int, request: Request):
+    published, _, etag, unchanged = published_station(request, station_id)
         
-    p = s.get_program(program_id) 
+    p = serialized.program(published, station_id, program_id)
     if p is None:
         raise HTTPException(
             status_code=404, 
             detail=f"station {station_id}, program {program_id} doesn't exist"
         )
 
-    #response.headers.append("test", "hello")
-    return ProgramModel.from_orm(p)
+    return unchanged or json_response(p, etag)
 
 
-@app.delete("/config/station/{station_id}/program/{program_id}")
+@api.delete("/config/station/{station_id}/program/{program_id}")
 def delete_station_program(station_id: int, program_id: int):
     with config.update_config():
         s = config.get_station(station_id)
@@ -169,7 +422,7 @@ def delete_station_program(station_id: int, program_id: int):
         
         s.delete_program(p.program_id)
 
-@app.put("/config/station/{station_id}/program/{program_id}/name")
+@api.put("/config/station/{station_id}/program/{program_id}/name")
 def set_program_name(station_id: int, program_id: int, name:str) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -187,7 +440,7 @@ def set_program_name(station_id: int, program_id: int, name:str) -> ProgramModel
         p.set_name(name)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/description")
+@api.put("/config/station/{station_id}/program/{program_id}/description")
 def set_program_description(station_id: int, program_id: int, descr:str) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -205,7 +458,7 @@ def set_program_description(station_id: int, program_id: int, descr:str) -> Prog
         p.set_description(desc=descr)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/trigger")
+@api.put("/config/station/{station_id}/program/{program_id}/trigger")
 def set_program_trigger(station_id: int, program_id: int, trigger:Trigger) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -223,7 +476,7 @@ def set_program_trigger(station_id: int, program_id: int, trigger:Trigger) -> Pr
         p.set_trigger(trigger)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/day")
+@api.put("/config/station/{station_id}/program/{program_id}/day")
 def set_program_day(station_id: int, program_id: int, day:DayOfWeek) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -241,7 +494,7 @@ def set_program_day(station_id: int, program_id: int, day:DayOfWeek) -> ProgramM
         p.set_week_day(day)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/duration")
+@api.put("/config/station/{station_id}/program/{program_id}/duration")
 def set_program_duration(station_id: int, program_id: int, duration:timedelta) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -259,7 +512,7 @@ def set_program_duration(station_id: int, program_id: int, duration:timedelta) -
         p.set_duration(duration)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/enabled")
+@api.put("/config/station/{station_id}/program/{program_id}/enabled")
 def set_program_enabled(station_id: int, program_id: int) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -277,7 +530,7 @@ def set_program_enabled(station_id: int, program_id: int) -> ProgramModel:
         p.set_enabled()
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/disabled")
+@api.put("/config/station/{station_id}/program/{program_id}/disabled")
 def set_program_disabled(station_id: int, program_id: int) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -295,7 +548,7 @@ def set_program_disabled(station_id: int, program_id: int) -> ProgramModel:
         p.set_disabled()
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/start_time")
+@api.put("/config/station/{station_id}/program/{program_id}/start_time")
 def set_program_start_time(station_id: int, program_id: int, start_time:time) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -313,7 +566,7 @@ def set_program_start_time(station_id: int, program_id: int, start_time:time) ->
         p.set_start_time(start_time)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/enabled_after")
+@api.put("/config/station/{station_id}/program/{program_id}/enabled_after")
 def set_program_enabled_after(station_id: int, program_id: int, enabled_after:datetime|None ) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -331,7 +584,7 @@ def set_program_enabled_after(station_id: int, program_id: int, enabled_after:da
         p.set_enabled_after(enabled_after)
         return ProgramModel.from_orm(p)
 
-@app.put("/config/station/{station_id}/program/{program_id}/enabled_before")
+@api.put("/config/station/{station_id}/program/{program_id}/enabled_before")
 def set_program_enabled_before(station_id: int, program_id: int, enabled_before:datetime|None) -> ProgramModel:
     with config.update_config():
         s = config.get_station(station_id)
@@ -349,5 +602,30 @@ def set_program_enabled_before(station_id: int, program_id: int, enabled_before:
         p.set_enabled_before(enabled_before)
         return ProgramModel.from_orm(p)
 
-app.mount("/", StaticFiles(directory="./front_end/dist", html=True))
+@api.patch("/config/station/{station_id}/program/{program_id}", response_model=ProgramModel)
+def patch_station_program(station_id: int, program_id: int, patch: ProgramPatchModel):
+    # any number of fields, one commit
+    with config.update_config():
+        s = config.get_station(station_id)
+
+        if s is None:
+            raise HTTPException(status_code=404, detail=f"station {station_id} doesn't exist")
+            
+        p = s.get_program(program_id) 
+        if p is None:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"station {station_id}, program {program_id} doesn't exist"
+            )
+        
+        p.patch(patch)
+        return ProgramModel.from_orm(p)
+
+if os.environ.get("RETIC_ASYNC_API", "0") not in ("", "0"):
+    app.include_router(async_router(api, config_alock))
+else:
+    app.include_router(api)
 
+# the front end, with the .br/.gz files generate_client.sh makes served to
+# clients that take them
+app.mount("/", PrecompressedStaticFiles(directory="./front_end/dist", html=True))
@@ -1,7 +1,8 @@
-from .programs import Program, Trigger, DayOfWeek, ProgramModel
+from .programs import Program, Trigger, DayOfWeek, ProgramModel, ProgramPatchModel
 from .overrides import Override, OverrideType, OverrideModel
-from .stations import Station, StationModel, StationSummaryModel
-from .config import Config, ConfigModel
+from .stations import Station, StationModel, StationPatchModel, StationSummaryModel
+from .config import Config, ConfigModel, ConfigChangesModel
+from .scheduler import Scheduler
 
 __all__ = [
     OverrideType.__name__,
@@ -9,11 +10,15 @@ __all__ = [
     OverrideModel.__name__,
     Station.__name__,
     StationModel.__name__,
+    StationPatchModel.__name__,
     StationSummaryModel.__name__,
     Program.__name__,
     ProgramModel.__name__,
+    ProgramPatchModel.__name__,
     Trigger.__name__,
     DayOfWeek.__name__,
     Config.__name__,
-    ConfigModel.__name__
+    ConfigModel.__name__,
+    ConfigChangesModel.__name__,
+    Scheduler.__name__
 ]
\ No newline at end of file
@@ -0,0 +1,131 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, Literal, Optional, Union
+
+from .config import Config
+from .programs import ProgramPatchModel
+from .stations import StationPatchModel
+from .overrides import OverrideModel
+
+# A list of operations applied in order inside one Config.transaction, so
+# they are written out once and either all of them happen or none do.
+
+class AddStation(BaseModel):
+    # with programs, they replace the default program, ids from 1
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["add_station"]
+    station: Optional[StationPatchModel] = None
+    programs: Optional[list[ProgramPatchModel]] = None
+
+class PatchStation(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["patch_station"]
+    station_id: int
+    patch: StationPatchModel
+
+class DeleteStation(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["delete_station"]
+    station_id: int
+
+class AddProgram(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["add_program"]
+    station_id: int
+    program: Optional[ProgramPatchModel] = None
+
+class PatchProgram(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["patch_program"]
+    station_id: int
+    program_id: int
+    patch: ProgramPatchModel
+
+class DeleteProgram(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["delete_program"]
+    station_id: int
+    program_id: int
+
+class AddOverrides(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["add_overrides"]
+    station_id: int
+    overrides: list[OverrideModel]
+
+Operation = Annotated[
+    Union[AddStation, PatchStation, DeleteStation, AddProgram, PatchProgram, DeleteProgram, AddOverrides],
+    Field(discriminator="op")
+]
+
+class BatchResultModel(BaseModel):
+    # the ids each operation produced or worked on
+    station_id: Optional[int] = None
+    program_id: Optional[int] = None
+    program_ids: Optional[list[int]] = None
+    override_ids: Optional[list[int]] = None
+
+class BatchError(Exception):
+    def __init__(self, index: int, detail: str, status_code: int = 404):
+        super().__init__(f"operation {index}: {detail}")
+        self.index = index
+        self.detail = detail
+        self.status_code = status_code
+
+def _station(config: Config, i: int, station_id: int):
+    s = config.get_station(station_id)
+    if s is None:
+        raise BatchError(i, f"station {station_id} doesn't exist")
+    return s
+
+def _program(config: Config, i: int, station_id: int, program_id: int):
+    p = _station(config, i, station_id).get_program(program_id)
+    if p is None:
+        raise BatchError(i, f"station {station_id}, program {program_id} doesn't exist")
+    return p
+
+def _apply(config: Config, i: int, op) -> BatchResultModel:
+    match op:
+        case AddStation():
+            s = config.add_station()
+            if op.station is not None:
+                try:
+                    s.patch(op.station)
+                except KeyError as e:
+                    raise BatchError(i, e.args[0])
+            if op.programs is not None:
+                for program_id in list(s.programs):
+                    s.delete_program(program_id)
+                for patch in op.programs:
+                    s.add_program().patch(patch)
+            return BatchResultModel(station_id=s.station_id, program_ids=list(s.programs))
+        case PatchStation():
+            s = _station(config, i, op.station_id)
+            try:
+                s.patch(op.patch)
+            except KeyError as e:
+                raise BatchError(i, e.args[0])
+            return BatchResultModel(station_id=s.station_id)
+        case DeleteStation():
+            _station(config, i, op.station_id)
+            config.delete_station(op.station_id)
+            return BatchResultModel(station_id=op.station_id)
+        case AddProgram():
+            p = _station(config, i, op.station_id).add_program()
+            if op.program is not None:
+                p.patch(op.program)
+            return BatchResultModel(station_id=op.station_id, program_id=p.program_id)
+        case PatchProgram():
+            _program(config, i, op.station_id, op.program_id).patch(op.patch)
+            return BatchResultModel(station_id=op.station_id, program_id=op.program_id)
+        case DeleteProgram():
+            _program(config, i, op.station_id, op.program_id)
+            config.get_station(op.station_id).delete_program(op.program_id)
+            return BatchResultModel(station_id=op.station_id, program_id=op.program_id)
+        case AddOverrides():
+            added = _station(config, i, op.station_id).add_overrides(op.overrides)
+            return BatchResultModel(station_id=op.station_id, override_ids=[x.override_id for x in added])
+    raise BatchError(i, f"unknown operation {op}", 422)
+
+def apply_batch(config: Config, ops: list) -> list[BatchResultModel]:
+    with config.transaction():
+        return [_apply(config, i, op) for i, op in enumerate(ops)]
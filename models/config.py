@@ -1,75 +1,486 @@
 from .stations import Station, StationModel
-from copy import deepcopy
-import yaml
+from .programs import ProgramModel
+from .storage import Storage, Change, storage_from_env
+from .storage.codec import station_to_dict, station_from_dict
+from .upcoming import StartIndex
+from lib.registry import Registry
 
 from pydantic import BaseModel, ConfigDict
 from typing import Optional, Union 
 
+from bisect import bisect_right
+from collections import deque
 from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple
+import heapq
+import threading
+import uuid
 
 from logging import getLogger
 logger = getLogger()
 
-yaml.Dumper.ignore_aliases = lambda x,y: True 
+class Published(NamedTuple):
+    # what readers see, swapped as one
+    version: int
+    snapshot: "ConfigModel | None"
+    station_versions: dict[int, int] # the version each station last changed in
+    boundaries: dict[int, list[datetime]] # when each station's current override can change
+    all_boundaries: list[datetime]
+    starts: StartIndex | None = None # the programs by start time, see upcoming.py
+
+    def etag(self, epoch: str, station_id: int | None = None, now: datetime | None = None) -> str | None:
+        # Changes with every commit (to the station), and every time an
+        # override starts or ends since that changes the models' override.
+        # None for a station that doesn't exist
+        now = now or datetime.now()
+        if station_id is None:
+            return f'"{epoch}-{self.version}-{self.passed(None, now)}"'
+        if station_id not in self.station_versions:
+            return None
+        return f'"{epoch}-{station_id}-{self.station_versions[station_id]}-{self.passed(station_id, now)}"'
+
+    def passed(self, station_id: int | None, now: datetime) -> int:
+        # how many of the override boundaries (of all stations for None)
+        # are behind now
+        return bisect_right(self.all_boundaries if station_id is None else self.boundaries[station_id], now)
 
 class Config():
-    def __init__(self, stations = None ):
+    def __init__(self, stations = None, storage: Storage | None = None ):
+        self._storage = storage
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock() # one save at a time, in commit order
+        self._depth = 0
+        self._changes : set[Change] = set()
+        self._unsaved : set[Change] | None = set() # committed but not yet written, None for everything
+        self._saving : set[Change] | None = set() # being written by flush()
+        self.conflicts = 0 # changes of ours that another process's write won over, see sync()
+        self._writer = None 
+        self._copies : dict[int, Station] = {} # what the last save was given, see flush()
+        self._before : dict[int, dict | None] | None = None # see transaction()
+        self._listeners = []
+        self.stations = Registry()
+
+        # versions only go up within a process, epoch tells processes (and
+        # restarts) apart
+        self.epoch = uuid.uuid4().hex[:8]
+        self._published = Published(0, None, {}, {}, [])
+        self._history : deque[tuple[int, set[Change] | None]] = deque(maxlen=1000)
+
         if stations:
-            self.stations = stations
+            for s in stations.values():
+                self._adopt(s)
+            self._publish()
             return 
         
+        if self._storage is None:
+            self._storage = storage_from_env()
+
         try:
-            with open("config.yaml", "r") as conf:
-                c = yaml.unsafe_load(conf)
-                self.stations = deepcopy(c.stations)
-                if self is None:
-                    raise Exception("config is none")
-        except:
+            loaded = self._storage.load()
+            if loaded is None:
+                raise Exception("config is none")
+            for s in loaded.values():
+                self._adopt(s)
+        except Exception as e:
+            logger.warning(f"unable to load config ({e}), using defaults")
             self.set_default()
-        self._write_config()
+            self._write_config()
+            self.flush()
+        self._publish()
+
+    def _adopt(self, s: Station):
+        s._owner = self
+        self.stations[s.station_id] = s
+
+    def _touch(self, station_id: int):
+        # Told before a station or one of its programs changes. In a
+        # transaction the station is kept as it was the first time, None
+        # when it doesn't exist yet.
+        if self._before is not None and station_id not in self._before:
+            s = self.stations.get(station_id, None)
+            self._before[station_id] = station_to_dict(s) if s is not None else None
+
+    def _mark(self, station_id: int, program_id: int | None = None):
+        self._changes.add((station_id, program_id))
+
+    def _publish(self, changes: set[Change] | None = None):
+        # Rebuild the snapshot for the stations that changed, the others
+        # are shared with the previous one, and swap it in under the next
+        # version. Only called with the lock held so there is one writer
+        # at a time.
+        version, snapshot, station_versions, boundaries, _, starts = self._published
+        version += 1
+        previous = snapshot.stations if snapshot is not None and changes is not None else {}
+        changed = {x[0] for x in changes} if changes is not None else set(self.stations)
+
+        snapshot = ConfigModel.model_construct(stations={
+            x[0]: previous[x[0]] if x[0] in previous and x[0] not in changed else StationModel.model_validate(x[1])
+            for x in self.stations.items()
+        })
+        station_versions = {
+            x: version if x in changed else station_versions.get(x, version)
+            for x in snapshot.stations
+        }
+        boundaries = {
+            x[0]: sorted({b for o in x[1].overrides if o.override_enabled for b in o.boundaries()})
+            if x[0] in changed or x[0] not in boundaries else boundaries[x[0]]
+            for x in self.stations.items()
+        }
+        starts = (
+            starts.updated(snapshot.stations, changes) if starts is not None and changes is not None
+            else StartIndex.build(snapshot.stations)
+        )
+        self._history.append((version, changes))
+        self._published = Published(
+            version, snapshot, station_versions, boundaries, list(heapq.merge(*boundaries.values())), starts
+        )
+
+    @property
+    def snapshot(self) -> "ConfigModel":
+        # The config as of the last commit, immutable. Readers take the
+        # reference without locking and get a consistent view however
+        # many commits happen while they use it.
+        return self._published[1]
+
+    @property
+    def version(self) -> int:
+        # bumped by every commit
+        return self._published[0]
+
+    def published(self) -> Published:
+        return self._published
+
+    def changes_since(self, since: int) -> "ConfigChangesModel":
+        # What was committed after version `since`, from the snapshot. A
+        # reset (everything) when that's too far back to say.
+        version, snapshot = self._published[:2]
+        history = [x for x in list(self._history) if since < x[0] <= version]
+        changes = set()
+        reset = since > version or len(history) != version - since
+        for (_, x) in history:
+            if x is None:
+                reset = True
+                break
+            changes |= x
+
+        if reset:
+            return ConfigChangesModel(
+                epoch=self.epoch, version=version, reset=True, stations=list(snapshot.stations.values())
+            )
+
+        station_ids = {x[0] for x in changes if x[1] is None}
+        programs = {x for x in changes if x[1] is not None and x[0] not in station_ids}
+        return ConfigChangesModel(
+            epoch=self.epoch,
+            version=version,
+            reset=False,
+            stations=[snapshot.stations[x] for x in sorted(station_ids) if x in snapshot.stations],
+            deleted_stations=sorted(x for x in station_ids if x not in snapshot.stations),
+            programs=[
+                ProgramChangeModel(station_id=x[0], program=snapshot.stations[x[0]].programs[x[1]])
+                for x in sorted(programs)
+                if x[0] in snapshot.stations and x[1] in snapshot.stations[x[0]].programs
+            ],
+            deleted_programs=[
+                x for x in sorted(programs)
+                if x[0] in snapshot.stations and x[1] not in snapshot.stations[x[0]].programs
+            ]
+        )
 
     def set_default(self):
-        self.stations = {}
+        self.stations.clear()
         for i in range(1,7):
             s = Station.default()
             s.station_id = i
-            self.stations[i] = s
+            self._adopt(s)
+
+    def _write_config(self, changes: set[Change] | None = None) -> bool:
+        # Marks changes unsaved. With a writer it decides when to flush,
+        # otherwise returns True and the caller flushes once it has let go
+        # of the lock.
+        with self._lock:
+            if changes is None or self._unsaved is None:
+                self._unsaved = None
+            else:
+                self._unsaved |= changes
+
+            if self._writer is not None:
+                self._writer.mark_dirty()
+                return False
+            return True
+
+    def flush(self):
+        # The stations are copied with the config locked and the storage
+        # writes the copies after it's unlocked, so commits and readers
+        # holding the lock never wait on the disk. Only the stations that
+        # changed are copied again, the rest are shared with the last save.
+        with self._save_lock:
+            with self._lock:
+                if self._unsaved == set():
+                    return 
+                changes, self._unsaved = self._unsaved, set()
+                if self._storage is None:
+                    return 
+                saving = self._copy(changes)
+                self._saving = changes
+            try:
+                self._storage.save(saving, changes)
+            except Exception:
+                # keep them for the next attempt
+                with self._lock:
+                    self._unsaved = None if changes is None or self._unsaved is None else self._unsaved | changes
+                raise
+            finally:
+                with self._lock:
+                    self._saving = set()
+
+    def _copy(self, changes: set[Change] | None) -> "Saving":
+        changed = set(self.stations) if changes is None else {x[0] for x in changes}
+        copies = {}
+        for station_id, s in self.stations.items():
+            c = self._copies.get(station_id, None) if station_id not in changed else None
+            copies[station_id] = c if c is not None else station_from_dict(station_to_dict(s))
+        self._copies = copies
+        return Saving(copies)
+
+    @property
+    def shared(self) -> bool:
+        # whether other processes write to the same storage, see sync()
+        return getattr(self._storage, "shared", False)
+
+    def sync(self) -> set[Change]:
+        # Pull in what other processes have committed to a shared storage,
+        # only reloading the stations/programs they changed. Returns what
+        # was reloaded.
+        #
+        # A station/program changed both here and by another process is a
+        # conflict. The write that reaches the database last wins: when
+        # ours is already being written it will, otherwise theirs is kept
+        # and our change to it is dropped. Either way it's logged and
+        # counted in conflicts.
+        if not self.shared:
+            return set()
+
+        with self._lock:
+            changes = self._storage.poll()
+            if changes == set() or self._unsaved is None or self._saving is None:
+                return set()
 
-    def _write_config(self):
-        with open("config.yaml", "w") as conf:
-            yaml.dump(self, conf, sort_keys=False, indent=2, Dumper=yaml.Dumper)
-            logger.info("updated config")
+            if changes is None:
+                changes = {(x, None) for x in set(self.stations) | set(self._storage.station_ids())}
+            overwritten = changes & self._saving
+            dropped = (changes & (self._unsaved | self._changes)) - overwritten
+            if overwritten or dropped:
+                self.conflicts += len(overwritten) + len(dropped)
+                logger.warning(
+                    f"config changed by another process as well: {sorted(overwritten, key=str)} "
+                    f"will be overwritten by ours, {sorted(dropped, key=str)} replaced ours"
+                )
+                self._unsaved -= dropped
+                self._changes -= dropped
+            pending = self._unsaved | self._changes | self._saving
+            changes = {x for x in changes if x not in pending}
+
+            for station_id in sorted({x[0] for x in changes}):
+                if (station_id, None) in changes:
+                    self._reload_station(station_id, pending)
+                else:
+                    for (_, program_id) in [x for x in changes if x[0] == station_id]:
+                        self._reload_program(station_id, program_id)
+            self.stations.sort()
+
+            if changes:
+                self._publish(changes)
+                for fn in self._listeners:
+                    fn(changes)
+            return changes
+
+    @staticmethod
+    def _carry(old, new):
+        # keep the runtime state, only the scheduler moves it on
+        if old is not None:
+            new._state = old._state
+            new._input_dt = old._input_dt
+
+    def _reload_station(self, station_id: int, pending: set[Change]):
+        old = self.stations.pop(station_id, None)
+        if old is not None:
+            old._owner = None
+        new = self._storage.load_station(station_id)
+        if new is None:
+            return
+
+        for p in new.programs.values():
+            self._carry(old.get_program(p.program_id) if old is not None else None, p)
+        if old is not None:
+            # programs changed here and not written yet, deletes included
+            for (_, program_id) in [x for x in pending if x[0] == station_id and x[1] is not None]:
+                new.programs.pop(program_id, None)
+                local = old.get_program(program_id)
+                if local is not None:
+                    new._adopt(local)
+            new.programs.sort()
+        self._adopt(new)
+
+    def _reload_program(self, station_id: int, program_id: int):
+        s = self.stations.get(station_id, None)
+        if s is None:
+            return # the station comes with a change of its own
+        old = s.programs.pop(program_id, None)
+        if old is not None:
+            old._owner = None
+        p = self._storage.load_program(station_id, program_id)
+        if p is not None:
+            self._carry(old, p)
+            s._adopt(p)
+            s.programs.sort()
+
+    def set_writer(self, writer):
+        # with a writer set, commits only mark the config dirty and the
+        # writer decides when to flush
+        self._writer = writer
 
     def get_station(self, station_id: int) -> Station | None :
         return self.stations.get(station_id, None )
 
+    def _allocate(self, station_id: int | None, at_least: int) -> int:
+        # a new station id (program id of station_id), from the storage
+        # when it's shared so other processes can't take the same one
+        if not self.shared:
+            return at_least
+        return self._storage.allocate(station_id, at_least)
+
     def add_station(self) -> Station:
         with self.update_config():
-            ids = [x for x in self.stations.keys()]
-            ids.sort()
-            new_id = 1
-            for i in ids:
-                if new_id < i:
-                    break
-                new_id += 1
+            new_id = self._allocate(None, self.stations.allocate())
+            self._touch(new_id)
             
             s = Station.default()
             s.station_id = new_id 
-            self.stations[new_id] = s
+            self._adopt(s)
+            self._mark(new_id)
+            for p in s.programs:
+                self._mark(new_id, p)
             return s
 
     def delete_station(self, station_no):
         with self.update_config():
             if station_no in self.stations.keys():
+                self._touch(station_no)
+                self.stations[station_no]._owner = None
                 del self.stations[station_no]
+                self._mark(station_no)
 
     @contextmanager
     def update_config(self):
-        yield 
-        self._write_config()            
+        # blocks can nest, changes are written out once the outermost exits
+        flush = False
+        with self._lock:
+            if self._depth == 0:
+                self.sync() # start from what the other processes have written
+            self._depth += 1
+            try:
+                yield 
+            finally:
+                self._depth -= 1
+
+            if self._depth == 0 and self._changes:
+                changes, self._changes = self._changes, set()
+                self._publish(changes)
+                flush = self._write_config(changes)
+                for fn in self._listeners:
+                    fn(changes)
+        if flush:
+            self.flush()
+
+    def commit_runtime(self, changes: set[Change]):
+        # The scheduler moves last_triggered on as programs run, outside
+        # of any update. It commits what it moved here so it's saved and
+        # published like any other change.
+        with self.update_config():
+            self._changes |= {x for x in changes if x[0] in self.stations}
+
+    @contextmanager
+    def transaction(self):
+        # Like update_config, but all or nothing: if the block raises, the
+        # stations it touched are put back as they were and nothing is
+        # written. Can't be nested inside update_config. Only the stations
+        # it touches are copied, see _touch()
+        with self.update_config():
+            if self._depth > 1:
+                raise Exception("a transaction can't be nested in another update")
+            self._before = {}
+            marked = set(self._changes)
+            try:
+                yield
+            except BaseException:
+                self._rollback(self._before, self._changes - marked)
+                raise
+            finally:
+                self._before = None
+
+    def _rollback(self, before: dict[int, dict | None], changes: set[Change]):
+        for station_id in {x[0] for x in changes}:
+            if station_id not in before:
+                continue # nothing changes without being touched first
+            current = self.stations.pop(station_id, None)
+            if current is not None:
+                current._owner = None
+            if before[station_id] is None:
+                continue # added in the transaction
+            s = station_from_dict(before[station_id])
+            if current is not None:
+                for p in s.programs.values():
+                    old = current.get_program(p.program_id)
+                    if old is not None:
+                        self._carry(old, p)
+            self._adopt(s)
+        # back in the order they were in, as of the last commit
+        order = {}
+        for x in [*self.snapshot.stations, *self.stations]:
+            order.setdefault(x, len(order))
+        self.stations.sort(key=order.__getitem__)
+        self._changes -= changes
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    def subscribe(self, fn):
+        # fn(changes) is called after every commit, from the committing
+        # thread and with the config still locked
+        self._listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        self._listeners.remove(fn)
+
+    def close(self):
+        self.flush()
+        if self._storage is not None:
+            self._storage.close()
     
 
+class Saving(NamedTuple):
+    # what flush() hands the storage in place of the config, copies of
+    # the stations it can read without the lock
+    stations: dict[int, Station]
+
 class ConfigModel(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True)
     stations: dict[int, StationModel]
-        
\ No newline at end of file
+
+class ProgramChangeModel(BaseModel):
+    station_id: int
+    program: ProgramModel
+
+class ConfigChangesModel(BaseModel):
+    # what changed between two versions: whole stations for changes to a
+    # station, just the program otherwise. With reset, stations is everything
+    epoch: str
+    version: int
+    reset: bool
+    stations: list[StationModel] = []
+    deleted_stations: list[int] = []
+    programs: list[ProgramChangeModel] = []
+    deleted_programs: list[tuple[int, int]] = []
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import uuid
+from collections import deque
+from datetime import datetime
+
+from .scheduler import Scheduler
+from .stations import StationSummaryModel
+
+# Turns what the scheduler publishes into a stream of deltas for
+# Server-Sent Events: a program changing state, an override starting or
+# ending, a station being enabled/disabled, turning on/off or removed.
+#
+# Every event gets the next sequence number, its SSE id is that and the
+# stream's epoch (so ids from before a restart aren't mistaken for new
+# ones), and the last `history` of them are kept so a client reconnecting
+# with Last-Event-ID gets just what it missed. A client further behind than
+# that (or new) starts with a reset event holding every station's status.
+#
+# Each connection has its own bounded queue. Publishing never waits on a
+# slow client: when its queue is full it is emptied and the connection
+# catches up from the history instead, or is sent a reset.
+
+Event = tuple[int, str, dict] # (seq, type, data)
+
+class _Connection():
+    def __init__(self, last_seq: int, size: int):
+        self.last_seq = last_seq
+        self.queue : asyncio.Queue[Event] = asyncio.Queue(size)
+        self.lagged = False
+
+class EventStream():
+    def __init__(self, scheduler: Scheduler, history: int = 1000, queue_size: int = 100):
+        self.scheduler = scheduler
+        self.queue_size = queue_size
+        self.seq = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self._history : deque[Event] = deque(maxlen=history)
+        self._known : dict[int, StationSummaryModel] = {}
+        self._connections : set[_Connection] = set()
+
+    def start(self):
+        self._known = dict(self.scheduler.statuses)
+        self.scheduler.subscribe(self._on_publish)
+
+    def stop(self):
+        self.scheduler.unsubscribe(self._on_publish)
+
+    def _on_publish(self, summaries: list[StationSummaryModel], now: datetime):
+        # called from the scheduler task
+        for summary in summaries:
+            self._diff(self._known.get(summary.station_id, None), summary)
+            self._known[summary.station_id] = summary
+        for station_id in [x for x in self._known if x not in self.scheduler.statuses]:
+            del self._known[station_id]
+            self._emit("station", {"station_id": station_id, "removed": True})
+
+    def _diff(self, old: StationSummaryModel | None, new: StationSummaryModel):
+        station_id = new.station_id
+        for program_id, state in new.program_states.items():
+            if old is None or old.program_states.get(program_id, None) != state:
+                self._emit("program", {"station_id": station_id, "program_id": program_id, "state": state})
+        for program_id in old.program_states if old is not None else []:
+            if program_id not in new.program_states:
+                self._emit("program", {"station_id": station_id, "program_id": program_id, "state": None})
+
+        if old is None or (old.override_active, old.override_type) != (new.override_active, new.override_type):
+            self._emit("override", {
+                "station_id": station_id,
+                "override_active": new.override_active,
+                "override_type": new.override_type
+            })
+        if old is None or (old.enabled, old.is_active()) != (new.enabled, new.is_active()):
+            self._emit("station", {"station_id": station_id, "enabled": new.enabled, "active": new.is_active()})
+
+    def _emit(self, kind: str, data: dict):
+        self.seq += 1
+        event = (self.seq, kind, data)
+        self._history.append(event)
+        for c in self._connections:
+            if c.lagged:
+                continue
+            try:
+                c.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # let it catch up from the history rather than wait for it
+                c.lagged = True
+                while not c.queue.empty():
+                    c.queue.get_nowait()
+
+    def _reset(self) -> Event:
+        return (self.seq, "reset", {
+            "stations": [x.model_dump(mode="json") for x in self._known.values()]
+        })
+
+    def _since(self, last_seq: int) -> list[Event] | None:
+        # the events after last_seq, None when they're no longer all kept
+        if last_seq == self.seq:
+            return []
+        if last_seq > self.seq or not self._history or self._history[0][0] > last_seq + 1:
+            return None
+        return [x for x in self._history if x[0] > last_seq]
+
+    async def events(self, last_seq: int | None = None, heartbeat: float = 15.0):
+        # the events for one connection, None for a heartbeat
+        backlog = self._since(last_seq) if last_seq is not None else None
+        c = _Connection(last_seq if backlog is not None else self.seq, self.queue_size)
+        self._connections.add(c)
+        try:
+            pending = backlog if backlog is not None else [self._reset()]
+            while True:
+                for event in pending:
+                    if event[0] > c.last_seq or event[1] == "reset":
+                        c.last_seq = event[0]
+                        yield event
+                pending = []
+
+                if c.lagged:
+                    backlog = self._since(c.last_seq)
+                    pending = backlog if backlog is not None else [self._reset()]
+                    c.lagged = False
+                    continue
+
+                try:
+                    pending = [await asyncio.wait_for(c.queue.get(), heartbeat)]
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self._connections.discard(c)
+
+    def token(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def parse_token(self, token: str | None) -> int | None:
+        # the seq in a token from this stream, None for anything else
+        if token is None:
+            return None
+        epoch, _, seq = token.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def format(self, event: Event | None) -> str:
+        # as a server sent event
+        if event is None:
+            return ": keep-alive\n\n"
+        seq, kind, data = event
+        return f"id: {self.token(seq)}\nevent: {kind}\ndata: {json.dumps(data, default=str)}\n\n"
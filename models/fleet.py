@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+from .programs import Program, State
+from .config import Config
+from . import trigger_calendar
+
+try:
+    import numpy as np
+except ImportError: # optional, pip install fast-retic[fleet]
+    np = None
+
+# Evaluates every program of a fleet for a timestamp in one vectorized
+# pass. The programs are packed into columns once, evaluation only does
+# a few array comparisons regardless of how many programs there are.
+#
+# This works out the state from the schedule alone: a program is
+# activated inside [start, start + duration) of a day its trigger fires
+# (the day before too, for windows running over midnight), finished after
+# that window on the same day, initial otherwise, and disabled by the
+# same rules as programs.disabled_condition. Program.run agrees with it
+# as long as it is run through the start time rather than first enabled
+# or first called after it.
+
+US = timedelta(microseconds=1)
+DAY_US = timedelta(days=1) // US
+EPOCH = datetime(1970, 1, 1)
+NO_AFTER = 2 ** 63 - 1
+NO_BEFORE = -(2 ** 63)
+
+STATES = list(State)
+
+_DISABLED = STATES.index(State.disabled)
+_ACTIVATED = STATES.index(State.activated)
+_FINISHED = STATES.index(State.finished)
+_INITIAL = STATES.index(State.initial)
+
+def _us(d: datetime) -> int:
+    return (d - EPOCH) // US
+
+class FleetEvaluator():
+    def __init__(self, programs: list[tuple[int, Program]]):
+        if np is None:
+            raise Exception("FleetEvaluator needs numpy, install fast-retic[fleet]")
+
+        self.keys = [(x[0], x[1].program_id) for x in programs]
+        ps = [x[1] for x in programs]
+        n = len(ps)
+
+        # each program's bit in the trigger calendar
+        self.trigger_bit = np.fromiter((p._trigger_bit for p in ps), np.int32, n)
+        self.start = np.fromiter(
+            ((p.start_time - datetime.combine(p.start_time.date(), datetime.min.time())) // US for p in ps),
+            np.int64, n
+        )
+        self.duration = np.fromiter((p.duration // US for p in ps), np.int64, n)
+        self.enabled = np.fromiter((bool(p.enabled) for p in ps), np.bool_, n)
+        self.enabled_after = np.fromiter(
+            (_us(p.enabled_after) if p.enabled_after is not None else NO_AFTER for p in ps), np.int64, n
+        )
+        self.enabled_before = np.fromiter(
+            (_us(p.enabled_before) if p.enabled_before is not None else NO_BEFORE for p in ps), np.int64, n
+        )
+
+        # parts of the rules that don't depend on the time
+        self._too_short = np.fromiter((p.duration.seconds < 30 for p in ps), np.bool_, n)
+        self._end = self.start + self.duration
+
+    @classmethod
+    def from_config(cls, config: Config):
+        return cls([
+            (s.station_id, p)
+            for s in config.stations.values()
+            for p in s.programs.values()
+        ])
+
+    def _fires(self, d: datetime):
+        return (self.trigger_bit & trigger_calendar.calendar.mask(d.date())) != 0
+
+    def evaluate(self, dt: datetime):
+        # State indices (into STATES) for every program, in self.keys order
+        t = _us(dt)
+        day_start = datetime.combine(dt.date(), datetime.min.time())
+        tod = (dt - day_start) // US
+
+        disabled = (
+            ~self.enabled
+            | (self.enabled_after < t)
+            | (self.enabled_before > t)
+            | self._too_short
+        )
+
+        today = self._fires(dt)
+        yesterday = self._fires(dt - timedelta(days=1))
+
+        active = (
+            (today & (self.start <= tod) & (tod < self._end))
+            | (yesterday & (tod < self._end - DAY_US))
+        )
+        finished = today & (tod >= self._end)
+
+        states = np.full(len(self.keys), _INITIAL, np.int8)
+        states[finished] = _FINISHED
+        states[active] = _ACTIVATED
+        states[disabled] = _DISABLED
+        return states
+
+    def active(self, dt: datetime):
+        return self.evaluate(dt) == _ACTIVATED
+
+    def states(self, dt: datetime) -> dict[tuple[int, int], State]:
+        return {x[0]: STATES[x[1]] for x in zip(self.keys, self.evaluate(dt).tolist())}
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, date, time
+
+from .programs import ProgramModel, Trigger
+from .overrides import Override, OverrideType, OverrideSchedule
+from .stations import StationModel
+from . import trigger_calendar
+from lib.dt_helpers import DayOfWeek
+
+# Works out when programs/stations will be active over a date range
+# straight from their schedule, one window per day the trigger fires,
+# no stepping through time. Uses the same rules as models.fleet: a run
+# covers [start, start + duration) of each firing day, clipped to the
+# time the program isn't disabled.
+#
+# Works on the published snapshot, never the live objects, so it needs no
+# lock however long the range is.
+
+Interval = tuple[datetime, datetime]
+
+US = timedelta(microseconds=1)
+DAY = timedelta(days=1)
+
+def fires(trigger: Trigger, week_day: DayOfWeek | None, d: date) -> bool:
+    return trigger_calendar.calendar.fires(d, trigger_calendar.trigger_bit(trigger, week_day))
+
+def merge(intervals: list[Interval]) -> list[Interval]:
+    out = []
+    for s, e in sorted(intervals):
+        if out and s <= out[-1][1]:
+            if e > out[-1][1]:
+                out[-1] = (out[-1][0], e)
+        else:
+            out.append((s, e))
+    return out
+
+def subtract(intervals: list[Interval], cut: Interval) -> list[Interval]:
+    out = []
+    for s, e in intervals:
+        if e <= cut[0] or s >= cut[1]:
+            out.append((s, e))
+            continue
+        if s < cut[0]:
+            out.append((s, cut[0]))
+        if e > cut[1]:
+            out.append((cut[1], e))
+    return out
+
+def clip(intervals: list[Interval], start: datetime, end: datetime) -> list[Interval]:
+    return [
+        (max(s, start), min(e, end))
+        for s, e in intervals
+        if s < end and e > start
+    ]
+
+def enabled_range(p: ProgramModel) -> Interval | None:
+    # when the program isn't disabled, see programs.disabled_condition
+    if p.enabled == False or p.duration.seconds < 30:
+        return None
+    lo = p.enabled_before if p.enabled_before is not None else datetime.min
+    hi = p.enabled_after + US if p.enabled_after is not None else datetime.max
+    if lo >= hi:
+        return None
+    return lo, hi
+
+def program_intervals(p: ProgramModel, start: datetime, end: datetime) -> list[Interval]:
+    window = enabled_range(p)
+    if window is None:
+        return []
+    start, end = max(start, window[0]), min(end, window[1])
+    if start >= end:
+        return []
+
+    offset = p.start_time - datetime.combine(p.start_time.date(), time.min)
+    # a window running over midnight can reach back a few days
+    d = (start - p.duration - offset).date()
+    bit = trigger_calendar.trigger_bit(p.trigger, p.week_day)
+    out = []
+    while d <= end.date():
+        if trigger_calendar.calendar.fires(d, bit):
+            s = datetime.combine(d, time.min) + offset
+            out.append((s, s + p.duration))
+        d += DAY
+    return merge(clip(out, start, end))
+
+def station_intervals(s: StationModel, start: datetime, end: datetime) -> list[Interval]:
+    if s.enabled is not True:
+        return []
+
+    out = []
+    for p in s.programs.values():
+        out.extend(program_intervals(p, start, end))
+    out = merge(out)
+
+    overrides = OverrideSchedule([Override.from_pydantic(x) for x in s.overrides])
+    for window_start, window_end, o in overrides.segments(start, end):
+        out = subtract(out, (window_start, window_end))
+        if o.override_type == OverrideType.On:
+            out = merge(out + [(window_start, window_end)])
+    return out
+
+def forecast(stations: dict[int, StationModel], start: datetime, end: datetime) -> dict[int, list[Interval]]:
+    return {
+        x.station_id: station_intervals(x, start, end)
+        for x in stations.values()
+    }
@@ -0,0 +1,142 @@
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple
+
+from pydantic import BaseModel, Field
+from typing import Optional
+
+from .config import ConfigModel
+from .programs import Trigger
+
+# Filtering, cursor pagination and field projection for the listings.
+#
+# The filters are sets of station ids, built once per snapshot (enabled,
+# by trigger) or per scheduler publish (active) rather than by going
+# through every station on each request. A query intersects the sets it
+# needs and walks the sorted ids from the cursor until the page is full.
+# The cursor is the last id of the previous page, so a page doesn't shift
+# when stations are added or deleted in between.
+
+class ListingQueryModel(BaseModel):
+    # the query parameters the listings take, all optional
+    enabled: Optional[bool] = None
+    trigger: Optional[Trigger] = None
+    active: Optional[bool] = None # active now
+    min_id: Optional[int] = None
+    max_id: Optional[int] = None
+    cursor: Optional[int] = None # the last id of the previous page
+    limit: Optional[int] = Field(None, ge=1)
+    fields: Optional[str] = None # comma separated
+
+    def is_everything(self) -> bool:
+        return not self.model_fields_set
+
+class StationIndex(NamedTuple):
+    ids: list[int] # sorted
+    enabled: set[int]
+    triggers: dict[Trigger, set[int]] # stations with a program of that trigger
+
+    @classmethod
+    def build(cls, snapshot: ConfigModel) -> "StationIndex":
+        enabled, triggers = set(), {}
+        for s in snapshot.stations.values():
+            if s.enabled:
+                enabled.add(s.station_id)
+            for p in s.programs.values():
+                triggers.setdefault(p.trigger, set()).add(s.station_id)
+        return cls(sorted(snapshot.stations), enabled, triggers)
+
+class Listings():
+    # the indexes, each kept for as long as what it was built from is current
+    def __init__(self):
+        self._stations : tuple[ConfigModel | None, StationIndex | None] = (None, None)
+        self._active : tuple[dict | None, set[int]] = (None, set())
+        self._keys : tuple[dict | None, list[int]] = (None, [])
+
+    def stations(self, snapshot: ConfigModel) -> StationIndex:
+        source, index = self._stations
+        if source is not snapshot:
+            index = StationIndex.build(snapshot)
+            self._stations = (snapshot, index)
+        return index
+
+    def active(self, active: dict[int, bool]) -> set[int]:
+        source, ids = self._active
+        if source is not active:
+            ids = {x[0] for x in active.items() if x[1]}
+            self._active = (active, ids)
+        return ids
+
+    def keys(self, d: dict[int, object]) -> list[int]:
+        # sorted, for the scheduler's statuses
+        source, ids = self._keys
+        if source is not d:
+            ids = sorted(d)
+            self._keys = (d, ids)
+        return ids
+
+def station_filters(
+    index: StationIndex,
+    active_ids: set[int] | None = None,
+    enabled: bool | None = None,
+    trigger: Trigger | None = None,
+    active: bool | None = None
+) -> tuple[list[set[int]], list[set[int]]]:
+    # (sets an id has to be in, sets it can't be in)
+    include, exclude = [], []
+    if enabled is not None:
+        (include if enabled else exclude).append(index.enabled)
+    if trigger is not None:
+        include.append(index.triggers.get(trigger, set()))
+    if active is not None and active_ids is not None:
+        (include if active else exclude).append(active_ids)
+    return include, exclude
+
+def select(
+    ids: list[int],
+    include: list[set[int]] | None = None,
+    exclude: list[set[int]] | None = None,
+    min_id: int | None = None,
+    max_id: int | None = None,
+    after: int | None = None,
+    limit: int | None = None
+) -> tuple[list[int], int | None]:
+    # A page of the sorted ids: from min_id to max_id, after the cursor,
+    # in all of include and none of exclude. Returns it with the cursor
+    # for the next page, None on the last one.
+    lo = 0 if min_id is None else bisect_left(ids, min_id)
+    if after is not None:
+        lo = max(lo, bisect_right(ids, after))
+    hi = len(ids) if max_id is None else bisect_right(ids, max_id)
+    if lo >= hi:
+        return [], None
+    include, exclude = include or [], exclude or []
+
+    candidates = ids[lo:hi]
+    if include:
+        # walk the smallest set instead when it's smaller than the range
+        smallest = min(include, key=len)
+        if len(smallest) < hi - lo:
+            first, last = ids[lo], ids[hi - 1]
+            candidates = sorted(x for x in smallest if first <= x <= last and _contains(ids, x))
+
+    page = []
+    for x in candidates:
+        if all(x in s for s in include) and not any(x in s for s in exclude):
+            if limit is not None and len(page) == limit:
+                return page, page[-1]
+            page.append(x)
+    return page, None
+
+def _contains(ids: list[int], x: int) -> bool:
+    i = bisect_left(ids, x)
+    return i < len(ids) and ids[i] == x
+
+def parse_fields(fields: str | None, model: type[BaseModel]) -> set[str] | None:
+    # the fields= projection, None for all of them
+    if fields is None:
+        return None
+    names = {x.strip() for x in fields.split(",") if x.strip()}
+    unknown = names - set(model.model_fields) - set(model.model_computed_fields)
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(sorted(unknown))}")
+    return names
@@ -5,6 +5,7 @@ from pydantic import BaseModel, ConfigDict
 from typing import Optional, Union 
 
 from lib.pydantic_helper import FromPydantic
+from lib.interval_index import IntervalIndex
 
 class OverrideType(FromPydantic, StrEnum):
     On = auto()
@@ -17,8 +18,10 @@ class Override(FromPydantic):
         start_time: datetime,
         duration: timedelta,
         override_enabled: bool,
-        override_type: OverrideType
+        override_type: OverrideType,
+        override_id: int | None = None
     ):
+        self.override_id = override_id # given by the station's OverrideSchedule
         self.start_time = start_time
         self.duration = duration
         self.override_enabled = override_enabled
@@ -31,11 +34,89 @@ class Override(FromPydantic):
         if self.start_time <= ref_time < (self.start_time + self.duration):
             return True, self.override_type
         
-        return False 
+        return False, None 
+
+    def boundaries(self) -> tuple[datetime, datetime]:
+        return self.start_time, self.start_time + self.duration
+
+
+class OverrideSchedule():
+    # All of a station's overrides. The enabled ones are kept in an
+    # interval index, where several overlap the latest to start wins
+    def __init__(self, overrides: list[Override] | None = None):
+        self._overrides : dict[int, Override] = {}
+        self._index = IntervalIndex()
+        self._next_id = 1
+        self.extend(overrides or [])
+
+    def __iter__(self):
+        return iter(sorted(self._overrides.values(), key=lambda x: (x.start_time, x.override_id)))
+
+    def __len__(self):
+        return len(self._overrides)
+
+    def get(self, override_id: int) -> Override | None:
+        return self._overrides.get(override_id, None)
+
+    def add(self, o: Override) -> Override:
+        if o.override_id is None or o.override_id in self._overrides:
+            o.override_id = self._next_id
+        self._next_id = max(self._next_id, o.override_id + 1)
+
+        self._overrides[o.override_id] = o
+        if o.override_enabled:
+            start, end = o.boundaries()
+            self._index.add(o.override_id, start, end, o, priority=(start, o.override_id))
+        return o
+
+    def extend(self, overrides: list[Override]) -> list[Override]:
+        return [self.add(x) for x in overrides]
+
+    def remove(self, override_id: int) -> bool:
+        if self._overrides.pop(override_id, None) is None:
+            return False
+        self._index.remove(override_id)
+        return True
+
+    def clear(self):
+        self._overrides.clear()
+        self._index.clear()
+
+    def expire(self, before: datetime) -> list[int]:
+        # drop the overrides that finished at or before `before`
+        gone = [x.override_id for x in self._overrides.values() if x.boundaries()[1] <= before]
+        for override_id in gone:
+            self.remove(override_id)
+        return gone
+
+    def at(self, ref_time: datetime) -> Override | None:
+        return self._index.at(ref_time)
+
+    def applies(self, ref_time: datetime):
+        o = self.at(ref_time)
+        if o is None:
+            return False, None
+        return True, o.override_type
+
+    def current(self, ref_time: datetime) -> Override | None:
+        # the one in effect, otherwise the next one to start
+        o = self.at(ref_time)
+        if o is not None:
+            return o
+        return next((x for x in self if x.override_enabled and x.start_time > ref_time), None)
+
+    def next_boundary(self, ref_time: datetime) -> datetime | None:
+        return self._index.next_boundary(ref_time)
+
+    def segments(self, start: datetime, end: datetime):
+        # (start, end, override) for the override in effect over [start, end)
+        return self._index.segments(start, end)
+
 
 class OverrideModel(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True)
     
+    override_id : Optional[int] = None
     start_time : datetime
     duration: timedelta
     override_enabled : bool 
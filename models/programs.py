@@ -2,11 +2,12 @@ from enum import Enum, auto as enum_auto, StrEnum
 
 from datetime import datetime, timedelta, timezone, time 
 
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, Union 
+from pydantic import BaseModel, ConfigDict, model_validator
+from typing import Optional, Union, NamedTuple
 
 from lib.dt_helpers import DayOfWeek
 from lib.pydantic_helper import FromPydantic
+from . import trigger_calendar
 
 
 class Trigger(FromPydantic, StrEnum):
@@ -30,21 +31,36 @@ class Transition(FromPydantic, StrEnum):
     disable = enum_auto()       # sets us to the disabled state
     enable = enum_auto()        # sets us to initial state (before_trigger)
 
+class ProgramSnapshot(NamedTuple):
+    # everything evaluating a program needs, its schedule and its runtime
+    # state, frozen. See step/evaluate below
+    trigger_bit: int
+    start_time: datetime
+    duration: timedelta
+    enabled: bool
+    enabled_after: datetime | None
+    enabled_before: datetime | None
+    state: State
+    input_dt: datetime | None
+    last_triggered: datetime | None
+
 class Program(FromPydantic) :
     def __init__(
         self, 
         trigger: Trigger | str , 
         start_time: datetime,
         duration: timedelta,
-        program_id: int,
-        name: str | None,
-        description: str | None, 
-        week_day: DayOfWeek | None | str ,
+        program_id: int = 1,
+        name: str | None = "",
+        description: str | None = "", 
+        week_day: DayOfWeek | None | str = None,
         enabled: bool = False  ,
         enabled_after: datetime | None = None,
         enabled_before: datetime | None = None,
         last_triggered: datetime | None = None 
     ):
+        self._owner = None # the station holding this program, told about changes
+        self._trigger_bit = 0 # this program's bit in the trigger calendar
         self.start_time = start_time
         self.set_trigger(trigger)
         self.set_week_day(week_day)
@@ -64,47 +80,79 @@ class Program(FromPydantic) :
         self._input_dt : datetime | None = None 
         # don't like defining here, but feel it'll be neater than passing variables
 
+        # the earliest time the state can change, run() before then just
+        # returns the state. None when it has to be worked out again
+        self._next_change : datetime | None = None 
+
+    def _changing(self):
+        # before any change, _changed() after it
+        if self._owner is not None:
+            self._owner._program_changing(self)
+
+    def _changed(self):
+        self._next_change = None
+        self._trigger_bit = trigger_calendar.trigger_bit(self.trigger, getattr(self, "week_day", None))
+        if self._owner is not None:
+            self._owner._program_changed(self)
+
     def set_trigger(self, trigger: Trigger|str):
+        self._changing()
         self.trigger = Trigger.from_pydantic(trigger)
+        self._changed()
 
     def set_start_time(self, t: time ):
-        d = datetime(1970, 1, 1)
-        d.hour = t.hour
-        d.minute = t.minute 
-        self.start_time = d
+        self._changing()
+        self.start_time = datetime(1970, 1, 1, t.hour, t.minute, t.second)
+        self._changed()
 
     def set_duration(self, dur: int | timedelta):
+        self._changing()
         match dur:
             case x if type(x) is int:
-                self.duration = timedelta(minutes=minutes)
+                self.duration = timedelta(minutes=x)
             case x if type(x) is timedelta:
                 self.duration = dur 
             case _:
                 raise Exception("unexpected type")        
+        self._changed()
 
     def set_name(self, name: str):
+        self._changing()
         self.name = name 
+        self._changed()
 
     def set_description(self, desc: str):
+        self._changing()
         self.description = desc
+        self._changed()
 
     def set_enabled(self):
+        self._changing()
         self.enabled = True 
+        self._changed()
 
     def set_disabled(self):
+        self._changing()
         self.enabled = False
+        self._changed()
 
     def set_enabled_after(self, d:datetime):
+        self._changing()
         self.enabled_after = d
+        self._changed()
     
     def set_enabled_before(self, d:datetime):
+        self._changing()
         self.enabled_before = d
+        self._changed()
     
     def set_week_day(self, week_day: DayOfWeek | str):
+        self._changing()
         if week_day is not None:
             self.week_day = week_day if type(week_day) is DayOfWeek else DayOfWeek(week_day)
         else: 
-            week_day is None
+            self.week_day = None
+        self._changed()
 
     @property 
     def input_dt(self) -> datetime | None :
@@ -128,94 +176,67 @@ class Program(FromPydantic) :
 
         raise Exception(f"{type(s)} is not State")
 
-    def _disabled_condition(self):
-        if (
-            self.enabled == False
-            or (self.enabled_after is not None and (self.enabled_after < self.input_dt ))
-            or (self.enabled_before is not None and (self.enabled_before > self.input_dt ))
-            or (self.duration).seconds < 30  
-        ):
-            return True
-
-    def _transitions_all(self):
-        if self._disabled_condition():
-            self._state = State.disabled
-            return
-
-    def _transitions_disabled(self):
-        if not self._disabled_condition():
-            self._state = State.initial
-            return 
-
-    def _transitions_reset(self): 
-        
-        start_dt = self.start_time
-        start_time = start_dt.time()
-
-        input_dt = self.input_dt
-        input_time = input_dt.time() 
+    def snapshot(self) -> "ProgramSnapshot":
+        return ProgramSnapshot(
+            trigger_bit = self._trigger_bit,
+            start_time = self.start_time,
+            duration = self.duration,
+            enabled = self.enabled,
+            enabled_after = self.enabled_after,
+            enabled_before = self.enabled_before,
+            state = self._state,
+            input_dt = self._input_dt,
+            last_triggered = self.last_triggered
+        )
 
-        if input_time < start_time:
-            # no transition change so return
-            return 
+    def _state_machine(self):
+        s = step(self.snapshot())
+        self._state = s.state
+        self.last_triggered = s.last_triggered
 
-        day_of_week = DayOfWeek.from_dt(input_dt.weekday())
-        match self.trigger:
-            case Trigger.even_days:
-                if input_dt.date().day % 2 == 1:
-                    return
-            case Trigger.odd_days:
-                if input_dt.date().day % 2 == 0:
-                    return
-            case Trigger.week_days:
-                if day_of_week in (DayOfWeek.saturday, DayOfWeek.sunday):
-                    return
-            case Trigger.week_ends:
-                if day_of_week not in (DayOfWeek.saturday, DayOfWeek.sunday):
-                    return
-            case Trigger.day_of_week:
-                if self.week_day != day_of_week:
-                    return
-            case _: # daily
-                pass 
-
-        self.last_triggered = self.input_dt
-        self._state = State.activated
-         
-
-    def _transitions_active(self):
-        if self.input_dt >= self.last_triggered + self.duration:
-            self._state = State.finished
-
-    def _transitions_finished(self):
-        # The job has finished 
-        # and it's a new day
-        # last_triggered will be set by this time
-        if self.last_triggered.date() != self.input_dt.date(): 
-            self._state = State.initial
+    def _next_transition(self) -> datetime:
+        return next_transition(self.snapshot())
 
-    def _state_machine(self):
-        self._transitions_all()
-
-        match self.get_state():
-            case State.activated:
-                self._transitions_active()
-            case State.finished:
-                self._transitions_finished()
-            case State.initial:
-                self._transitions_reset()
-            case State.disabled:
-                self._transitions_disabled()
+    @property
+    def next_change(self) -> datetime | None:
+        return self._next_change
 
     def run(self, dt_input : datetime=None) -> State :
         
         if dt_input is None:
-            dt_input = datetime.now().time()
+            dt_input = datetime.now()
+
+        if (
+            self._next_change is not None 
+            and self._input_dt <= dt_input < self._next_change
+        ):
+            return self._state
 
         self._input_dt = dt_input
+        before = self._state
         self._state_machine()
+
+        # a transition can lead straight into another one on the next run
+        self._next_change = dt_input if self._state != before else self._next_transition()
         return self.get_state()
 
+    def patch(self, patch: "ProgramPatchModel"):
+        # applies the fields that were sent, pydantic has already checked
+        # all of them so it doesn't stop half way
+        setters = {
+            "trigger": self.set_trigger,
+            "start_time": self.set_start_time,
+            "week_day": self.set_week_day,
+            "duration": self.set_duration,
+            "name": self.set_name,
+            "description": self.set_description,
+            "enabled": lambda x: self.set_enabled() if x else self.set_disabled(),
+            "enabled_after": self.set_enabled_after,
+            "enabled_before": self.set_enabled_before,
+        }
+        for k in patch.model_fields_set:
+            setters[k](getattr(patch, k))
+
     def is_active(self, dt_input: datetime=None) -> State:
         return self.run(dt_input=dt_input) == State.activated
     
@@ -232,8 +253,94 @@ class Program(FromPydantic) :
             description=""
         )
 
+# The state machine, as pure functions of a snapshot. Program.run applies
+# step() to the program itself, which only the scheduler does for the
+# live config; anything else can evaluate() a snapshot without touching
+# the program, from any thread.
+
+def disabled_condition(s: ProgramSnapshot) -> bool:
+    return (
+        s.enabled == False
+        or (s.enabled_after is not None and (s.enabled_after < s.input_dt ))
+        or (s.enabled_before is not None and (s.enabled_before > s.input_dt ))
+        or (s.duration).seconds < 30  
+    )
+
+def _transitions_reset(s: ProgramSnapshot) -> ProgramSnapshot:
+    if s.input_dt.time() < s.start_time.time():
+        # no transition change so return
+        return s
+
+    if not trigger_calendar.calendar.fires(s.input_dt.date(), s.trigger_bit):
+        return s
+
+    return s._replace(state=State.activated, last_triggered=s.input_dt)
+
+def step(s: ProgramSnapshot) -> ProgramSnapshot:
+    # one run of the state machine at s.input_dt
+    if disabled_condition(s):
+        s = s._replace(state=State.disabled)
+
+    match s.state:
+        case State.activated:
+            if s.input_dt >= s.last_triggered + s.duration:
+                return s._replace(state=State.finished)
+        case State.finished:
+            # The job has finished 
+            # and it's a new day
+            # last_triggered will be set by this time
+            if s.last_triggered.date() != s.input_dt.date(): 
+                return s._replace(state=State.initial)
+        case State.initial:
+            return _transitions_reset(s)
+        case State.disabled:
+            if not disabled_condition(s):
+                return s._replace(state=State.initial)
+    return s
+
+def evaluate(s: ProgramSnapshot, dt: datetime, settle: int = 8) -> ProgramSnapshot:
+    # the snapshot run at dt, until a run doesn't change the state
+    s = s._replace(input_dt=dt)
+    for _ in range(settle):
+        nxt = step(s)
+        if nxt.state == s.state:
+            return nxt
+        s = nxt
+    return s
+
+def next_transition(s: ProgramSnapshot) -> datetime:
+    # the earliest input at which step could do something, given the
+    # state it has just settled in
+    never = datetime.max
+    input_dt = s.input_dt
+
+    if s.state == State.disabled:
+        if (
+            s.enabled == False
+            or (s.duration).seconds < 30
+            or (s.enabled_after is not None and s.enabled_after < input_dt)
+        ):
+            return never
+        return s.enabled_before if s.enabled_before is not None else never
+
+    # enabled_after < input_dt disables it
+    disable_at = never
+    if s.enabled_after is not None and s.enabled_after >= input_dt:
+        disable_at = s.enabled_after + timedelta(microseconds=1)
+
+    match s.state:
+        case State.activated:
+            nxt = s.last_triggered + s.duration
+        case State.finished:
+            nxt = datetime.combine(s.last_triggered.date() + timedelta(days=1), time.min)
+        case _: # initial
+            start = datetime.combine(input_dt.date(), s.start_time.time())
+            nxt = start if input_dt < start else start + timedelta(days=1)
+
+    return min(nxt, disable_at)
+
 class ProgramModel(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
     #_input_dt : datetime 
     #_state : State
@@ -248,4 +355,27 @@ class ProgramModel(BaseModel):
     description: str 
     name: str 
 
-    last_triggered : Optional[datetime]
\ No newline at end of file
+    last_triggered : Optional[datetime]
+
+class ProgramPatchModel(BaseModel):
+    # the fields to change, anything left out stays as it is. Only
+    # week_day, enabled_after and enabled_before can be set to null
+    model_config = ConfigDict(extra="forbid")
+
+    trigger: Optional[Trigger] = None
+    start_time: Optional[time] = None
+    week_day: Optional[DayOfWeek] = None
+    duration: Optional[timedelta] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    enabled: Optional[bool] = None
+    enabled_after: Optional[datetime] = None
+    enabled_before: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def _not_null(self):
+        nullable = {"week_day", "enabled_after", "enabled_before"}
+        for k in self.model_fields_set - nullable:
+            if getattr(self, k) is None:
+                raise ValueError(f"{k} can't be null")
+        return self
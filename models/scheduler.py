@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+from datetime import datetime
+
+from .config import Config
+from .stations import Station, StationSummaryModel
+from .storage import Change
+
+from logging import getLogger
+logger = getLogger()
+
+# Drives every program's state machine from one background task. Each
+# program (and each station's overrides) sits in a min-heap keyed on the
+# next time its state can change, the task sleeps until the earliest one
+# and only advances what is due. Commits to the config wake it up so the
+# changed programs get rescheduled straight away.
+#
+# The results are published as whole dicts that are swapped, never
+# mutated, so readers on other threads just take the current reference.
+# When a program triggers, its last_triggered is committed to the config
+# so the saved and published config keep up with it.
+
+Key = tuple[int, int | None] # (station_id, program_id), None for the override
+
+class Scheduler():
+    def __init__(self, config: Config, max_sleep: float = 60.0):
+        self.config = config
+        self.max_sleep = max_sleep # re-check at least this often, in case the clock jumps
+
+        self.statuses : dict[int, StationSummaryModel] = {}
+        self.active : dict[int, bool] = {}
+
+        self._heap : list[tuple[datetime, Key]] = []
+        self._due : dict[Key, datetime] = {}
+        self._changed : set[Change] = set()
+        self._triggered : set[Change] = set() # last_triggered moved, not committed yet
+        self._listeners = []
+
+        self._loop : asyncio.AbstractEventLoop | None = None
+        self._wake : asyncio.Event | None = None
+        self._task : asyncio.Task | None = None
+
+    def subscribe(self, fn):
+        # fn(summaries, dt) is called from the scheduler task with the
+        # station summaries it has just published
+        self._listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        self._listeners.remove(fn)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.config.subscribe(self._on_commit)
+        self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.config.unsubscribe(self._on_commit)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _on_commit(self, changes: set[Change]):
+        # called from the committing thread
+        self._loop.call_soon_threadsafe(self._on_changes, changes)
+
+    def _on_changes(self, changes: set[Change]):
+        self._changed |= changes
+        self._wake.set()
+
+    def _schedule(self, key: Key, when: datetime | None):
+        if when is None or when == datetime.max:
+            self._due.pop(key, None)
+            return
+        if self._due.get(key) == when:
+            return
+        self._due[key] = when
+        heapq.heappush(self._heap, (when, key))
+
+    def _advance_program(self, station: Station, program_id: int, now: datetime):
+        p = station.get_program(program_id)
+        if p is None:
+            self._due.pop((station.station_id, program_id), None)
+            return
+
+        # a transition can lead straight into another, settle it
+        last_triggered = p.last_triggered
+        for _ in range(8):
+            p.run(now)
+            if p.next_change is None or p.next_change > now:
+                break
+        if p.last_triggered != last_triggered:
+            self._triggered.add((station.station_id, program_id))
+        self._schedule((station.station_id, program_id), p.next_change)
+
+    def _advance_override(self, station: Station, now: datetime):
+        self._schedule((station.station_id, None), station.overrides.next_boundary(now))
+
+    def _advance(self, key: Key, now: datetime) -> bool:
+        station_id, program_id = key
+        station = self.config.get_station(station_id)
+        if station is None:
+            return False
+        if program_id is None:
+            self._advance_override(station, now)
+        else:
+            self._advance_program(station, program_id, now)
+        return True
+
+    def _advance_changed(self, key: Change, now: datetime) -> bool:
+        station_id, program_id = key
+        station = self.config.get_station(station_id)
+        if station is None:
+            return False
+        if program_id is None:
+            # the override or the station itself, programs may have gone with it
+            self._advance_override(station, now)
+            for x in station.programs:
+                if (station_id, x) not in self._due:
+                    self._advance_program(station, x, now)
+        else:
+            self._advance_program(station, program_id, now)
+        return True
+
+    def _try(self, key: Key, now: datetime, fn) -> bool:
+        # one bad program mustn't lose the others, it goes back in
+        # _changed and is retried on the next tick
+        try:
+            return fn(key, now)
+        except Exception as e:
+            logger.exception(f"scheduler failed to advance {key}: {e}")
+            self._changed.add(key)
+            return False
+
+    def refresh(self, now: datetime | None = None):
+        # (re)build everything, used at startup
+        now = now or datetime.now()
+        with self.config.lock:
+            self._heap, self._due = [], {}
+            for s in self.config.stations.values():
+                self._advance_override(s, now)
+                for program_id in s.programs:
+                    self._advance_program(s, program_id, now)
+            self._publish(set(self.config.stations), now, replace=True)
+        self._commit()
+
+    def tick(self, now: datetime | None = None):
+        # advance whatever has changed or is due by now, and publish it
+        now = now or datetime.now()
+        touched = set()
+        with self.config.lock:
+            changed, self._changed = self._changed, set()
+            for key in changed:
+                touched.add(key[0])
+                self._try(key, now, self._advance_changed)
+
+            while self._heap and self._heap[0][0] <= now:
+                when, key = heapq.heappop(self._heap)
+                if self._due.get(key) != when:
+                    continue # rescheduled since, stale entry
+                del self._due[key]
+                if self._try(key, now, self._advance):
+                    touched.add(key[0])
+
+            if touched:
+                self._publish(touched, now)
+        self._commit()
+
+    def _commit(self):
+        # after letting go of the lock, the commit may write the config
+        triggered, self._triggered = self._triggered, set()
+        if triggered:
+            try:
+                self.config.commit_runtime(triggered)
+            except Exception:
+                self._triggered |= triggered
+                raise
+
+    def _publish(self, station_ids: set[int], now: datetime, replace: bool = False):
+        statuses = {} if replace else dict(self.statuses)
+        summaries = []
+        for station_id in station_ids:
+            station = self.config.get_station(station_id)
+            if station is None:
+                statuses.pop(station_id, None)
+                continue
+            summary = station.summary(now)
+            statuses[station_id] = summary
+            summaries.append(summary)
+
+        self.statuses = dict(sorted(statuses.items()))
+        self.active = {x[0]: x[1].is_active() for x in self.statuses.items()}
+        for fn in self._listeners:
+            fn(summaries, now)
+
+    def next_wake(self) -> datetime | None:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception(f"scheduler tick failed: {e}")
+
+            timeout = self.max_sleep
+            nxt = self.next_wake()
+            if nxt is not None:
+                timeout = min(timeout, max((nxt - datetime.now()).total_seconds(), 0))
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+from .config import Published
+from .programs import ProgramModel
+from .stations import StationModel
+
+# The read endpoints' JSON, built from the published snapshot and kept per
+# station and per program until a commit replaces that model. A read is
+# then a couple of lookups (and a join for the whole config) rather than
+# pydantic validating and serializing the object graph again.
+#
+# A station's JSON also has the override current when it was built (the
+# computed `override`), so it is kept per override boundary as well.
+#
+# Requests on several threads share the caches without a lock. Every
+# entry is replaced whole, stale ones are dropped with pop() over a copy
+# of the keys, so at worst two threads build the same JSON or one drops
+# an entry the other just added, which only costs a rebuild.
+
+class SerializedConfig():
+    def __init__(self):
+        self._stations : dict[int, tuple[StationModel, int, bytes]] = {}
+        self._programs : dict[int, dict[int, tuple[ProgramModel, bytes]]] = {}
+        self._config : tuple[int, int, bytes] | None = None
+
+    def station(self, published: Published, station_id: int, now: datetime) -> bytes | None:
+        s = published.snapshot.stations.get(station_id, None)
+        if s is None:
+            return None
+        passed = published.passed(station_id, now)
+        entry = self._stations.get(station_id, None)
+        if entry is not None and entry[0] is s and entry[1] == passed:
+            return entry[2]
+
+        body = s.model_dump_json().encode()
+        programs = self._programs.get(station_id, {})
+        for program_id in [x for x in list(programs) if x not in s.programs]:
+            programs.pop(program_id, None)
+        if published.passed(station_id, datetime.now()) == passed:
+            # not if an override started or ended while it was being built
+            self._stations[station_id] = (s, passed, body)
+        return body
+
+    def program(self, published: Published, station_id: int, program_id: int) -> bytes | None:
+        s = published.snapshot.stations.get(station_id, None)
+        p = s.programs.get(program_id, None) if s is not None else None
+        if p is None:
+            return None
+        programs = self._programs.setdefault(station_id, {})
+        entry = programs.get(program_id, None)
+        if entry is not None and entry[0] is p:
+            return entry[1]
+        body = p.model_dump_json().encode()
+        programs[program_id] = (p, body)
+        return body
+
+    def programs(self, published: Published, station_id: int, program_ids = None) -> bytes | None:
+        # all of the station's programs, or those
+        s = published.snapshot.stations.get(station_id, None)
+        if s is None:
+            return None
+        program_ids = s.programs if program_ids is None else program_ids
+        return b"[" + b",".join(self.program(published, station_id, x) for x in program_ids) + b"]"
+
+    def stations(self, published: Published, station_ids, now: datetime) -> bytes:
+        # a config holding just those stations
+        return b'{"stations":{' + b",".join(
+            b'"%d":%s' % (x, self.station(published, x, now)) for x in station_ids
+        ) + b"}}"
+
+    def config(self, published: Published, now: datetime) -> bytes:
+        passed = published.passed(None, now)
+        entry = self._config
+        if entry is not None and entry[0] == published.version and entry[1] == passed:
+            return entry[2]
+
+        stations = published.snapshot.stations
+        for station_id in [x for x in list(self._stations) if x not in stations]:
+            self._stations.pop(station_id, None)
+            self._programs.pop(station_id, None)
+        body = self.stations(published, stations, now)
+        if published.passed(None, datetime.now()) == passed:
+            self._config = (published.version, passed, body)
+        return body
@@ -1,13 +1,14 @@
 
-from .programs import Program, ProgramModel, State 
-from .overrides import Override, OverrideModel, OverrideType
+from .programs import Program, ProgramModel, ProgramPatchModel, State, evaluate
+from .overrides import Override, OverrideModel, OverrideType, OverrideSchedule
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, computed_field, model_validator
 from typing import Optional, Union 
 
 from datetime import datetime , timedelta
 
 from lib.pydantic_helper import FromPydantic
+from lib.registry import Registry
 
 class Station(FromPydantic):
 
@@ -21,14 +22,42 @@ class Station(FromPydantic):
         programs: dict[int, Program] | dict[int, BaseModel] | dict[int, dict],
         override: Override | None | dict | list[BaseModel],
         description: str = "",
-        enabled: bool = False 
+        enabled: bool = False,
+        overrides: list[Override] | list[BaseModel] | list[dict] | None = None
     ):
+        self._owner = None # the config holding this station, told about changes
         self.station_id = station_id 
-        self.programs = {x[0] : Program.from_pydantic(x[1]) for x in programs.items()}
-        self.override = Override.from_pydantic(override) if override else None 
+        self.programs = Registry()
+        for p in programs.values():
+            self._adopt(Program.from_pydantic(p))
+        self.overrides = OverrideSchedule()
+        if overrides is not None:
+            self.overrides.extend([Override.from_pydantic(x) for x in overrides])
+        elif override:
+            self.overrides.add(Override.from_pydantic(override))
         self.description = description
         self.enabled = enabled
 
+    def _adopt(self, p: Program):
+        p._owner = self
+        self.programs[p.program_id] = p
+
+    def _changing(self):
+        # before the station or one of its programs changes, _changed() after
+        if self._owner is not None:
+            self._owner._touch(self.station_id)
+
+    def _program_changing(self, p: Program):
+        if self.programs.get(p.program_id, None) is p:
+            self._changing()
+
+    def _changed(self, program_id: int | None = None):
+        if self._owner is not None:
+            self._owner._mark(self.station_id, program_id)
+
+    def _program_changed(self, p: Program):
+        self._changed(p.program_id)
+
     @classmethod
     def default(cls):
         p = Program.default()
@@ -40,13 +69,24 @@ class Station(FromPydantic):
         )
     
     def update_description(self, desc: str):
+        self._changing()
         self.description = desc 
+        self._changed()
 
     def set_enabled(self):
+        self._changing()
         self.enabled = True
+        self._changed()
 
     def set_disabled(self):
+        self._changing()
         self.enabled = False 
+        self._changed()
+
+    @property
+    def override(self) -> Override | None:
+        # the override in effect, otherwise the next one coming up
+        return self.overrides.current(datetime.now())
 
     def set_override(
         self, 
@@ -56,81 +96,152 @@ class Station(FromPydantic):
         enabled: bool
 
     ):
-        self.override = Override(
+        # replaces all of the station's overrides with this one
+        self._changing()
+        self.overrides.clear()
+        self.overrides.add(Override(
             start_time=start_time, 
             duration=duration, 
             override_enabled=enabled, 
             override_type= OverrideType.from_pydantic(override_type)
-        )
+        ))
+        self._changed()
+
+    def add_overrides(self, overrides: list[Override] | list[BaseModel] | list[dict]) -> list[Override]:
+        self._changing()
+        added = self.overrides.extend([Override.from_pydantic(x) for x in overrides])
+        self._changed()
+        return added
+
+    def delete_override(self, override_id: int) -> bool:
+        self._changing()
+        if not self.overrides.remove(override_id):
+            return False
+        self._changed()
+        return True
+
+    def expire_overrides(self, before: datetime) -> list[int]:
+        self._changing()
+        gone = self.overrides.expire(before)
+        if gone:
+            self._changed()
+        return gone
+
+    def patch(self, patch: "StationPatchModel"):
+        # all of the programs have to exist before anything is changed
+        missing = [x for x in patch.programs or {} if x not in self.programs]
+        if missing:
+            raise KeyError(f"station {self.station_id}, program(s) {missing} don't exist")
+
+        if "description" in patch.model_fields_set:
+            self.update_description(patch.description)
+        if "enabled" in patch.model_fields_set:
+            self.set_enabled() if patch.enabled else self.set_disabled()
+        for program_id, p in (patch.programs or {}).items():
+            self.programs[program_id].patch(p)
 
     def get_program(self, program_id: int) -> Program | None :
         return self.programs.get(program_id, None )
 
     def add_program(self) -> Program:
-        ids = [x for x in self.programs.keys()]
-        ids.sort()
-        new_id = 1
-        for i in ids:
-            if new_id < i:
-                break
-            new_id += 1
+        self._changing()
+        new_id = self.programs.allocate()
+        if self._owner is not None:
+            new_id = self._owner._allocate(self.station_id, new_id)
         
         p = Program.default()
         p.program_id = new_id
-        self.programs[new_id] = p
+        self._adopt(p)
+        self._changed(new_id)
         return p
 
     def delete_program(self, program_id):
         if program_id in self.programs.keys():
+            self._changing()
+            self.programs[program_id]._owner = None
             del self.programs[program_id]
+            self._changed(program_id)
 
     def status(self, dt : Optional[datetime] = None):
+        # what the programs would be at dt, worked out from snapshots so
+        # nothing is changed, safe to call from any thread
         if dt is None:
             dt = datetime.now()
 
-        (override_active, override_type) = (False, None) if self.override is None else self.override.applies(dt)
+        return self.summary(dt, {
+            x[0]: evaluate(x[1].snapshot(), dt).state for x in list(self.programs.items())
+        })
+
+    def summary(self, dt : Optional[datetime] = None, program_states: dict[int, State] | None = None):
+        # the programs' current states, without running them
+        if dt is None:
+            dt = datetime.now()
+        if program_states is None:
+            program_states = {x[0]: x[1].get_state() for x in list(self.programs.items())}
+
+        (override_active, override_type) = self.overrides.applies(dt)
 
         summary = StationSummaryModel(
             station_id = self.station_id,
             description = self.description if self.description else "",
             override_active = override_active,
             override_type = override_type,
-            program_states = {
-                x[0]: x[1].run(dt) for x in self.programs.items()
-            },
+            program_states = program_states,
             enabled = self.enabled
         )
         return summary 
     
-    def is_active(self) -> bool:
-        s = self.status()
-
-        if s.enabled is not True:
-            return False
-
-        if (
-            s.override_active
-        ):
-            return True if s.override_type is OverrideType.On else False 
-
-        if any(x.is_active() for x in self.programs.values()):
-            return True 
+    def is_active(self, dt : Optional[datetime] = None) -> bool:
+        return self.status(dt).is_active()
 
 class StationModel(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
     station_id: int 
     programs: dict[int, ProgramModel]
-    override: Optional[OverrideModel]
+    overrides: list[OverrideModel] = []
     enabled: bool 
+
+    @computed_field
+    @property
+    def override(self) -> Optional[OverrideModel]:
+        # worked out when read, a snapshot can outlive the override it was taken in
+        o = OverrideSchedule([Override.from_pydantic(x) for x in self.overrides]).current(datetime.now())
+        return OverrideModel.model_validate(o) if o is not None else None
     
     def to_orm(self) -> Station:
         return Station(**self.model_dump())
 
+class StationPatchModel(BaseModel):
+    # the fields to change, programs are patched by id
+    model_config = ConfigDict(extra="forbid")
+
+    description: Optional[str] = None
+    enabled: Optional[bool] = None
+    programs: Optional[dict[int, ProgramPatchModel]] = None
+
+    @model_validator(mode="after")
+    def _not_null(self):
+        for k in self.model_fields_set:
+            if getattr(self, k) is None:
+                raise ValueError(f"{k} can't be null")
+        return self
+
 class StationSummaryModel(BaseModel):
     station_id: int 
     description: str 
     override_active: bool
     override_type: Optional[OverrideType]
     program_states: dict[int, State ]
-    enabled: bool 
\ No newline at end of file
+    enabled: bool
+
+    def is_active(self) -> bool:
+        if self.enabled is not True:
+            return False
+
+        if (
+            self.override_active
+        ):
+            return True if self.override_type is OverrideType.On else False 
+
+        return any(x == State.activated for x in self.program_states.values()) 
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+
+from .base import Storage, Change
+from .yaml_storage import YamlStorage
+from .journal import JournalStorage
+from .binary import BinaryStorage
+from .sharded import ShardedStorage
+from .sqlite import SqliteStorage
+from .writer import ConfigWriter
+from .watcher import ConfigWatcher
+
+# RETIC_STORAGE picks the backend, RETIC_CONFIG_PATH where it keeps its
+# files (a file for yaml, binary and sqlite, a directory for journal and sharded).
+# RETIC_SHARED=1 is for running several workers on the one config, sqlite only
+def storage_from_env() -> Storage:
+    kind = os.environ.get("RETIC_STORAGE", "yaml").lower()
+    path = os.environ.get("RETIC_CONFIG_PATH", None)
+    shared = os.environ.get("RETIC_SHARED", "0") not in ("", "0")
+
+    if shared and kind != "sqlite":
+        raise Exception(f"RETIC_SHARED needs RETIC_STORAGE=sqlite, not '{kind}'")
+
+    match kind:
+        case "yaml":
+            return YamlStorage(path or "config.yaml")
+        case "journal":
+            return JournalStorage(
+                path or "config.journal", 
+                legacy=YamlStorage("config.yaml")
+            )
+        case "sharded":
+            return ShardedStorage(
+                path or "config.d", 
+                shard_size=int(os.environ.get("RETIC_SHARD_SIZE", 1)),
+                legacy=YamlStorage("config.yaml")
+            )
+        case "sqlite":
+            return SqliteStorage(
+                path or "config.db", 
+                legacy=YamlStorage("config.yaml"),
+                shared=shared
+            )
+        case "binary":
+            return BinaryStorage(
+                path or "config.bin", 
+                legacy=YamlStorage("config.yaml")
+            )
+
+    raise Exception(f"unknown storage '{kind}'")
+
+__all__ = [
+    Storage.__name__,
+    YamlStorage.__name__,
+    JournalStorage.__name__,
+    BinaryStorage.__name__,
+    ShardedStorage.__name__,
+    SqliteStorage.__name__,
+    ConfigWriter.__name__,
+    ConfigWatcher.__name__,
+    storage_from_env.__name__
+]
@@ -0,0 +1,18 @@
+from ..stations import Station
+
+# a change is (station_id, program_id), program_id is None when the
+# station's own fields changed. the keys are looked up against the
+# config when saving, a missing key means it was deleted
+Change = tuple[int, int | None]
+
+class Storage():
+
+    def load(self) -> dict[int, Station] | None:
+        raise NotImplementedError()
+
+    def save(self, config, changes: set[Change] | None = None):
+        # changes is None when the whole config needs to be written
+        raise NotImplementedError()
+
+    def close(self):
+        pass
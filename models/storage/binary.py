@@ -0,0 +1,178 @@
+import os
+import struct
+from datetime import datetime, timedelta
+
+from .base import Storage, Change
+from ..programs import Program, Trigger, DayOfWeek
+from ..overrides import Override, OverrideType
+from ..stations import Station
+
+from logging import getLogger
+logger = getLogger()
+
+# Compact snapshot of the whole config, decoded straight into the model
+# objects. Little endian, all layouts fixed per version:
+#
+# header    magic "RETC", u16 version, u32 station count
+# station   i32 id, u8 flags (enabled), u32 program count,
+#           u32 override count, str description, overrides
+# override  i32 id, i64 start, i64 duration, u8 enabled, u8 type
+# program   i32 id, u8 trigger, u8 week_day, u8 enabled, i64 start_time,
+#           i64 duration, i64 enabled_after, i64 enabled_before,
+#           i64 last_triggered, str name, str description
+#
+# str is a u32 byte length followed by utf-8, times are microseconds from
+# 1970-01-01 (naive, like the rest of the config), NONE for no value.
+
+MAGIC = b"RETC"
+VERSION = 1
+NONE = -(2 ** 63)
+EPOCH = datetime(1970, 1, 1)
+
+_header = struct.Struct("<4sHI")
+_station = struct.Struct("<iBII")
+_override = struct.Struct("<iqqBB")
+_program = struct.Struct("<iBBBqqqqq")
+_len = struct.Struct("<I")
+
+_triggers = list(Trigger)
+_trigger_codes = {x: i for i, x in enumerate(_triggers)}
+_days = list(DayOfWeek)
+_day_codes = {x: i for i, x in enumerate(_days)}
+_override_types = list(OverrideType)
+_override_codes = {x: i for i, x in enumerate(_override_types)}
+
+_STATION_ENABLED = 1
+
+def _us(d: datetime | None) -> int:
+    if d is None:
+        return NONE
+    return (d - EPOCH) // timedelta(microseconds=1)
+
+def _dt(us: int) -> datetime | None:
+    if us == NONE:
+        return None
+    return EPOCH + timedelta(microseconds=us)
+
+def _str(s: str | None) -> bytes:
+    b = (s or "").encode()
+    return _len.pack(len(b)) + b
+
+def encode(stations: dict[int, Station]) -> bytes:
+    out = [_header.pack(MAGIC, VERSION, len(stations))]
+    for s in stations.values():
+        flags = _STATION_ENABLED if s.enabled else 0
+        out.append(_station.pack(s.station_id, flags, len(s.programs), len(s.overrides)))
+        out.append(_str(s.description))
+        for o in s.overrides:
+            out.append(_override.pack(
+                o.override_id, _us(o.start_time), o.duration // timedelta(microseconds=1),
+                o.override_enabled, _override_codes[o.override_type]
+            ))
+        for p in s.programs.values():
+            out.append(_program.pack(
+                p.program_id,
+                _trigger_codes[p.trigger],
+                _day_codes[p.week_day] if p.week_day is not None else 0xFF,
+                p.enabled,
+                _us(p.start_time),
+                p.duration // timedelta(microseconds=1),
+                _us(p.enabled_after),
+                _us(p.enabled_before),
+                _us(p.last_triggered)
+            ))
+            out.append(_str(p.name))
+            out.append(_str(p.description))
+    return b"".join(out)
+
+def decode(data: bytes) -> dict[int, Station]:
+    buf = memoryview(data)
+    magic, version, count = _header.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise Exception("not a config snapshot")
+    if version != VERSION:
+        raise Exception(f"unsupported config snapshot version {version}")
+    pos = _header.size
+
+    def read_str():
+        nonlocal pos
+        (n,) = _len.unpack_from(buf, pos)
+        pos += _len.size
+        s = str(buf[pos:pos + n], "utf-8")
+        pos += n
+        return s
+
+    stations = {}
+    for _ in range(count):
+        station_id, flags, n_programs, n_overrides = _station.unpack_from(buf, pos)
+        pos += _station.size
+        s = Station(
+            station_id=station_id,
+            programs={},
+            override=None,
+            description=read_str(),
+            enabled=bool(flags & _STATION_ENABLED)
+        )
+        for _ in range(n_overrides):
+            override_id, start, duration, enabled, kind = _override.unpack_from(buf, pos)
+            pos += _override.size
+            s.overrides.add(Override(
+                start_time=_dt(start),
+                duration=timedelta(microseconds=duration),
+                override_enabled=bool(enabled),
+                override_type=_override_types[kind],
+                override_id=override_id
+            ))
+
+        for _ in range(n_programs):
+            (
+                program_id, trigger, week_day, enabled, start, duration,
+                enabled_after, enabled_before, last_triggered
+            ) = _program.unpack_from(buf, pos)
+            pos += _program.size
+            s._adopt(Program(
+                trigger=_triggers[trigger],
+                start_time=_dt(start),
+                duration=timedelta(microseconds=duration),
+                program_id=program_id,
+                name=read_str(),
+                description=read_str(),
+                week_day=_days[week_day] if week_day != 0xFF else None,
+                enabled=bool(enabled),
+                enabled_after=_dt(enabled_after),
+                enabled_before=_dt(enabled_before),
+                last_triggered=_dt(last_triggered)
+            ))
+        stations[station_id] = s
+    return stations
+
+class BinaryStorage(Storage):
+    def __init__(self, path: str = "config.bin", legacy: Storage | None = None):
+        self.path = path
+        self.legacy = legacy # where to migrate the config from on first start
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                return decode(f.read())
+        except FileNotFoundError:
+            pass 
+        if self.legacy is None:
+            return None
+        stations = self.legacy.load()
+        if stations is not None:
+            # written straight away, so the next start reads this instead
+            self._write(stations)
+        return stations
+
+    def save(self, config, changes: set[Change] | None = None):
+        self._write(config.stations)
+
+    def _write(self, stations: dict[int, Station]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(encode(stations))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        logger.info("updated config")
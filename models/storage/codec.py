@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+from ..programs import Program
+from ..overrides import Override
+from ..stations import Station
+
+# plain (json/yaml safe) representations of the config objects,
+# shared by all of the storage backends
+
+
+def _dt_out(d: datetime | None) -> str | None:
+    return d.isoformat() if d is not None else None
+
+def _dt_in(d: str | datetime | None) -> datetime | None:
+    if d is None or isinstance(d, datetime):
+        return d
+    return datetime.fromisoformat(d)
+
+def _td_out(d: timedelta) -> float:
+    return d.total_seconds()
+
+def _td_in(d: float | int | timedelta) -> timedelta:
+    if isinstance(d, timedelta):
+        return d
+    return timedelta(seconds=d)
+
+
+def program_to_dict(p: Program) -> dict:
+    return {
+        "program_id": p.program_id,
+        "name": p.name,
+        "description": p.description,
+        "trigger": str(p.trigger),
+        "week_day": str(p.week_day) if getattr(p, "week_day", None) is not None else None,
+        "start_time": _dt_out(p.start_time),
+        "duration": _td_out(p.duration),
+        "enabled": p.enabled,
+        "enabled_after": _dt_out(p.enabled_after),
+        "enabled_before": _dt_out(p.enabled_before),
+        "last_triggered": _dt_out(p.last_triggered)
+    }
+
+def program_from_dict(d: dict) -> Program:
+    return Program(
+        trigger = d["trigger"],
+        start_time = _dt_in(d["start_time"]),
+        duration = _td_in(d["duration"]),
+        program_id = d["program_id"],
+        name = d.get("name"),
+        description = d.get("description"),
+        week_day = d.get("week_day"),
+        enabled = d.get("enabled", False),
+        enabled_after = _dt_in(d.get("enabled_after")),
+        enabled_before = _dt_in(d.get("enabled_before")),
+        last_triggered = _dt_in(d.get("last_triggered"))
+    )
+
+def override_to_dict(o: Override | None) -> dict | None:
+    if o is None:
+        return None
+    return {
+        "override_id": o.override_id,
+        "start_time": _dt_out(o.start_time),
+        "duration": _td_out(o.duration),
+        "override_enabled": o.override_enabled,
+        "override_type": str(o.override_type)
+    }
+
+def override_from_dict(d: dict | None) -> Override | None:
+    if d is None:
+        return None
+    return Override(
+        start_time = _dt_in(d["start_time"]),
+        duration = _td_in(d["duration"]),
+        override_enabled = d["override_enabled"],
+        override_type = d["override_type"],
+        override_id = d.get("override_id")
+    )
+
+def overrides_from_station_dict(d: dict) -> list[Override]:
+    if "overrides" in d:
+        return [override_from_dict(x) for x in d["overrides"]]
+    # single override, as written before stations could have several
+    o = override_from_dict(d.get("override"))
+    return [o] if o is not None else []
+
+def station_to_dict(s: Station, programs: bool = True) -> dict:
+    d = {
+        "station_id": s.station_id,
+        "description": s.description,
+        "enabled": s.enabled,
+        "overrides": [override_to_dict(x) for x in s.overrides]
+    }
+    if programs:
+        d["programs"] = [program_to_dict(x) for x in s.programs.values()]
+    return d
+
+def station_from_dict(d: dict, programs: list[Program] | None = None) -> Station:
+    if programs is None:
+        programs = [program_from_dict(x) for x in d.get("programs", [])]
+
+    s = Station(
+        station_id = d["station_id"],
+        programs = {},
+        override = None,
+        description = d.get("description", ""),
+        enabled = d.get("enabled", False)
+    )
+    s.overrides.extend(overrides_from_station_dict(d))
+    for p in programs:
+        s._adopt(p)
+    return s
+
+def stations_to_list(stations: dict[int, Station]) -> list[dict]:
+    return [station_to_dict(x) for x in stations.values()]
+
+def stations_from_list(data: list[dict]) -> dict[int, Station]:
+    stations = {}
+    for d in data:
+        s = station_from_dict(d)
+        stations[s.station_id] = s
+    return stations
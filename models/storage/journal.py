@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+
+from .base import Storage, Change
+from .codec import (
+    stations_to_list, 
+    stations_from_list, 
+    station_to_dict, 
+    station_from_dict, 
+    program_to_dict, 
+    program_from_dict,
+    overrides_from_station_dict
+)
+from ..overrides import OverrideSchedule
+
+from logging import getLogger
+logger = getLogger()
+
+# Append only persistence. Every committed change is appended to the
+# current journal segment as one small json record, once enough records
+# have built up the whole config is compacted into snapshot.json on a
+# background thread and the segments it covers are removed.
+#
+# <directory>/snapshot.json             {"seq": n, "stations": [...]}
+# <directory>/journal-000001.jsonl      {"seq": n+1, "op": ..., ...}
+
+class JournalStorage(Storage):
+    def __init__(
+        self, 
+        directory: str = "config.journal", 
+        compact_after: int = 1000, 
+        fsync: bool = True,
+        legacy: Storage | None = None
+    ):
+        self.directory = directory
+        self.compact_after = compact_after
+        self.fsync = fsync
+        self.legacy = legacy # where to migrate the config from on first start
+
+        self._seq = 0
+        self._pending = 0 # records written since the last snapshot
+        self._segment = 0
+        self._journal = None 
+        self._compactor : threading.Thread | None = None 
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, "snapshot.json")
+
+    def _segment_path(self, n: int):
+        return os.path.join(self.directory, f"journal-{n:06}.jsonl")
+
+    def _segments(self) -> list[int]:
+        return sorted(
+            int(x[len("journal-"):-len(".jsonl")])
+            for x in os.listdir(self.directory)
+            if x.startswith("journal-") and x.endswith(".jsonl")
+        )
+
+    def _open_segment(self, n: int):
+        if self._journal is not None:
+            self._journal.close()
+        self._segment = n
+        self._journal = open(self._segment_path(n), "a")
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        stations = None
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snap = json.load(f)
+            stations = stations_from_list(snap["stations"])
+            self._seq = snap["seq"]
+        except FileNotFoundError:
+            pass
+
+        segments = self._segments()
+        migrated = False 
+        if stations is None and not segments and self.legacy is not None:
+            stations = self.legacy.load()
+            migrated = stations is not None
+
+        for n in segments:
+            if os.path.getsize(self._segment_path(n)) == 0:
+                os.remove(self._segment_path(n))
+                continue
+            with open(self._segment_path(n), "r") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a torn write from a crash can only be the last line
+                        logger.warning(f"skipping unreadable journal record in segment {n}")
+                        continue 
+                    if rec["seq"] <= self._seq:
+                        continue
+                    if stations is None:
+                        stations = {}
+                    self._apply(stations, rec)
+                    self._seq = rec["seq"]
+                    self._pending += 1
+
+        self._open_segment(segments[-1] + 1 if segments else 1)
+        if migrated:
+            self._write_snapshot(stations_to_list(stations), self._seq, [])
+        return stations
+
+    @staticmethod
+    def _apply(stations, rec: dict):
+        match rec["op"]:
+            case "station":
+                s = stations.get(rec["station_id"], None)
+                if s is None:
+                    stations[rec["station_id"]] = station_from_dict(rec["data"], programs=[])
+                else:
+                    s.description = rec["data"]["description"]
+                    s.enabled = rec["data"]["enabled"]
+                    s.overrides = OverrideSchedule(overrides_from_station_dict(rec["data"]))
+                    for program_id in set(s.programs) - set(rec["program_ids"]):
+                        del s.programs[program_id]
+            case "delete_station":
+                stations.pop(rec["station_id"], None)
+            case "program":
+                stations[rec["station_id"]]._adopt(program_from_dict(rec["data"]))
+            case "delete_program":
+                stations[rec["station_id"]].programs.pop(rec["program_id"], None)
+            case _:
+                raise Exception(f"unknown journal record {rec['op']}")
+
+    def _records(self, config, changes: set[Change]):
+        # station records first so that programs always have somewhere to go
+        for (station_id, program_id) in sorted(changes, key=lambda x: (x[0], x[1] is not None, x[1] or 0)):
+            s = config.stations.get(station_id, None)
+            if program_id is None:
+                if s is None:
+                    yield {"op": "delete_station", "station_id": station_id}
+                else:
+                    yield {
+                        "op": "station", 
+                        "station_id": station_id, 
+                        "data": station_to_dict(s, programs=False),
+                        "program_ids": list(s.programs)
+                    }
+                continue
+
+            if s is None:
+                continue # went with the station
+            p = s.get_program(program_id)
+            if p is None:
+                yield {"op": "delete_program", "station_id": station_id, "program_id": program_id}
+            else:
+                yield {"op": "program", "station_id": station_id, "data": program_to_dict(p)}
+
+    def save(self, config, changes: set[Change] | None = None):
+        # one at a time, config holds copies of the stations (see Config.flush)
+        if changes is None:
+            self._compact(config, background=False)
+            return 
+
+        lines = []
+        for rec in self._records(config, changes):
+            self._seq += 1
+            rec["seq"] = self._seq
+            lines.append(json.dumps(rec, separators=(",", ":")) + "\n")
+        
+        if not lines:
+            return 
+
+        self._journal.write("".join(lines))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._pending += len(lines)
+        logger.info(f"journaled {len(lines)} config change(s)")
+
+        if self._pending >= self.compact_after:
+            self._compact(config)
+
+    def _compact(self, config, background: bool = True):
+        if self._compactor is not None and self._compactor.is_alive():
+            if not background:
+                self._compactor.join()
+            else:
+                return 
+
+        # capture the state and start a fresh segment before returning,
+        # the slow part (writing the file out) happens on its own thread
+        data = stations_to_list(config.stations)
+        seq = self._seq
+        done = [x for x in self._segments() if x <= self._segment]
+        self._open_segment(self._segment + 1)
+        self._pending = 0
+
+        if background:
+            self._compactor = threading.Thread(
+                target=self._write_snapshot, 
+                args=(data, seq, done), 
+                daemon=True
+            )
+            self._compactor.start()
+        else:
+            self._write_snapshot(data, seq, done)
+
+    def _write_snapshot(self, data: list[dict], seq: int, segments: list[int]):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"seq": seq, "stations": data}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        for n in segments:
+            try:
+                os.remove(self._segment_path(n))
+            except FileNotFoundError:
+                pass 
+        logger.info(f"compacted config journal at record {seq}")
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None 
@@ -0,0 +1,88 @@
+import os
+import yaml
+
+from .base import Storage, Change
+from .codec import station_to_dict, stations_from_list
+from .yaml_storage import SafeLoader, SafeDumper
+
+from logging import getLogger
+logger = getLogger()
+
+# One yaml file per shard of stations, <directory>/stations-<n>.yaml where
+# shard n holds station ids [n * shard_size + 1, (n + 1) * shard_size].
+# Only the shards holding a changed station are rewritten.
+
+class ShardedStorage(Storage):
+    def __init__(
+        self, 
+        directory: str = "config.d", 
+        shard_size: int = 1, 
+        legacy: Storage | None = None
+    ):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.legacy = legacy # where to migrate the config from on first start
+
+    def shard_of(self, station_id: int) -> int:
+        return (station_id - 1) // self.shard_size
+
+    def _shard_path(self, shard: int):
+        return os.path.join(self.directory, f"stations-{shard:06}.yaml")
+
+    def _shards(self) -> list[str]:
+        return sorted(
+            x for x in os.listdir(self.directory)
+            if x.startswith("stations-") and x.endswith(".yaml")
+        )
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        shards = self._shards()
+        if not shards:
+            if self.legacy is None:
+                return None
+            stations = self.legacy.load()
+            if stations is not None:
+                self._write_shards(stations, {self.shard_of(x) for x in stations})
+            return stations
+
+        data = []
+        for name in shards:
+            with open(os.path.join(self.directory, name), "r") as f:
+                data.extend(yaml.load(f, Loader=SafeLoader)["stations"])
+        return stations_from_list(data)
+
+    def save(self, config, changes: set[Change] | None = None):
+        if changes is None:
+            shards = {self.shard_of(x) for x in config.stations}
+            # drop the files of shards that no longer hold anything
+            for name in self._shards():
+                shard = int(name[len("stations-"):-len(".yaml")])
+                if shard not in shards:
+                    os.remove(os.path.join(self.directory, name))
+        else:
+            shards = {self.shard_of(station_id) for (station_id, _) in changes}
+
+        self._write_shards(config.stations, shards)
+
+    def _write_shards(self, stations: dict, shards: set[int]):
+        for shard in shards:
+            first = shard * self.shard_size + 1
+            members = [
+                stations[x] for x in range(first, first + self.shard_size)
+                if x in stations
+            ]
+            path = self._shard_path(shard)
+            if not members:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                yaml.dump(
+                    {"stations": [station_to_dict(x) for x in members]},
+                    f, sort_keys=False, indent=2, Dumper=SafeDumper
+                )
+            os.replace(tmp, path)
+        logger.info(f"updated {len(shards)} config shard(s)")
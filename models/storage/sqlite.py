@@ -0,0 +1,330 @@
+import os
+import sqlite3
+import threading
+import uuid
+
+from .base import Storage, Change
+from .codec import (
+    station_to_dict,
+    station_from_dict,
+    program_to_dict,
+    program_from_dict,
+    override_to_dict
+)
+
+from logging import getLogger
+logger = getLogger()
+
+# Config kept in a sqlite database in WAL mode, a changed program or
+# station is a single row upsert/delete instead of a rewrite of everything
+#
+# With shared=True several processes (uvicorn --workers) can use the same
+# database. Every save also appends what it changed to the changes table,
+# tagged with the writer, and poll() returns what the other writers have
+# changed since, so each process only reloads those stations/programs.
+# New station and program ids are handed out by allocate(), from the
+# database, so two processes never pick the same one.
+#
+# The database is only read to load or reload stations. The read
+# endpoints are served from the config's published snapshot, which is
+# already in memory and never waits on a writer, so there are no query
+# methods here and no indexes on enabled/trigger/start_time: they would
+# cost every write and serve nothing. programs(station_id) stays for
+# load_station.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    station_id INTEGER PRIMARY KEY,
+    description TEXT NOT NULL DEFAULT '',
+    enabled INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS overrides (
+    station_id INTEGER NOT NULL REFERENCES stations(station_id) ON DELETE CASCADE,
+    override_id INTEGER NOT NULL,
+    start_time TEXT NOT NULL,
+    duration REAL NOT NULL,
+    override_enabled INTEGER NOT NULL,
+    override_type TEXT NOT NULL,
+    PRIMARY KEY (station_id, override_id)
+);
+CREATE TABLE IF NOT EXISTS programs (
+    station_id INTEGER NOT NULL REFERENCES stations(station_id) ON DELETE CASCADE,
+    program_id INTEGER NOT NULL,
+    name TEXT,
+    description TEXT,
+    trigger TEXT NOT NULL,
+    week_day TEXT,
+    start_time TEXT NOT NULL,
+    duration REAL NOT NULL,
+    enabled INTEGER NOT NULL,
+    enabled_after TEXT,
+    enabled_before TEXT,
+    last_triggered TEXT,
+    PRIMARY KEY (station_id, program_id)
+);
+CREATE TABLE IF NOT EXISTS next_ids (
+    station_id INTEGER PRIMARY KEY, -- 0 for the next station id
+    next INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    writer TEXT NOT NULL,
+    station_id INTEGER,
+    program_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS programs_station_id ON programs(station_id);
+"""
+
+PROGRAM_COLUMNS = [
+    "program_id", "name", "description", "trigger", "week_day", "start_time",
+    "duration", "enabled", "enabled_after", "enabled_before", "last_triggered"
+]
+
+_upsert_station = """
+INSERT INTO stations (station_id, description, enabled) VALUES (:station_id, :description, :enabled)
+ON CONFLICT (station_id) DO UPDATE SET description = excluded.description, enabled = excluded.enabled
+"""
+_insert_override = """
+INSERT INTO overrides (station_id, override_id, start_time, duration, override_enabled, override_type)
+VALUES (:station_id, :override_id, :start_time, :duration, :override_enabled, :override_type)
+"""
+_upsert_program = f"""
+INSERT INTO programs (station_id, {", ".join(PROGRAM_COLUMNS)})
+VALUES (:station_id, {", ".join(":" + x for x in PROGRAM_COLUMNS)})
+ON CONFLICT (station_id, program_id) DO UPDATE SET
+    {", ".join(f"{x} = excluded.{x}" for x in PROGRAM_COLUMNS[1:])}
+"""
+
+KEEP_CHANGES = 10_000 # a process further behind than this reloads everything
+
+def _program_row(row: sqlite3.Row) -> dict:
+    d = {x: row[x] for x in PROGRAM_COLUMNS}
+    d["enabled"] = bool(d["enabled"])
+    return d
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str = "config.db", legacy: Storage | None = None, shared: bool = False):
+        self.path = path
+        self.legacy = legacy # where to migrate the config from on first start
+        self.shared = shared
+        self.writer_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._conns : list[sqlite3.Connection] = []
+
+        # the last change seen, and the connection poll() uses, PRAGMA
+        # data_version only means something on the same connection
+        self._seq = 0
+        self._data_version = None
+        self._watch : sqlite3.Connection | None = None
+        self._watch_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread, WAL lets the readers run alongside the writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        self._conns.append(conn)
+        return conn
+
+    def load(self):
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if self.shared:
+            self._start_watch() # before reading, so nothing committed after slips through
+
+        # one transaction, so the stations match the change seq read with them
+        with self._transaction() as c:
+            self._seq = c.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            empty = c.execute("SELECT COUNT(*) FROM stations").fetchone()[0] == 0
+            stations = self._read(c) if not empty else None
+
+        if empty:
+            if self.legacy is None:
+                return None
+            stations = self.legacy.load()
+            if stations is not None:
+                with self._transaction() as c:
+                    for s in stations.values():
+                        self._put_station(c, s, programs=True)
+                    self._log(c, None)
+        return stations
+
+    @staticmethod
+    def _read(c: sqlite3.Connection, station_id: int | None = None) -> dict:
+        # the stations (or just station_id) with their programs and overrides
+        where, args = ("", []) if station_id is None else (" WHERE station_id = ?", [station_id])
+
+        overrides = {}
+        for row in c.execute(f"SELECT * FROM overrides{where} ORDER BY station_id, override_id", args):
+            d = dict(row)
+            d["override_enabled"] = bool(d["override_enabled"])
+            overrides.setdefault(row["station_id"], []).append(d)
+        programs = {}
+        for row in c.execute(f"SELECT * FROM programs{where} ORDER BY station_id, program_id", args):
+            programs.setdefault(row["station_id"], []).append(program_from_dict(_program_row(row)))
+
+        stations = {}
+        for row in c.execute(f"SELECT * FROM stations{where} ORDER BY station_id", args):
+            d = dict(row)
+            d["enabled"] = bool(d["enabled"])
+            d["overrides"] = overrides.get(row["station_id"], [])
+            stations[row["station_id"]] = station_from_dict(d, programs.get(row["station_id"], []))
+        return stations
+
+    def load_station(self, station_id: int):
+        # a single station, with its programs
+        return self._read(self._conn(), station_id).get(station_id, None)
+
+    def station_ids(self) -> list[int]:
+        return [x[0] for x in self._conn().execute("SELECT station_id FROM stations ORDER BY station_id")]
+
+    def load_program(self, station_id: int, program_id: int):
+        row = self._conn().execute(
+            "SELECT * FROM programs WHERE station_id = ? AND program_id = ?", (station_id, program_id)
+        ).fetchone()
+        return program_from_dict(_program_row(row)) if row is not None else None
+
+    def _log(self, c: sqlite3.Connection, changes: set[Change] | None):
+        if not self.shared:
+            return
+        rows = [(None, None)] if changes is None else sorted(changes, key=lambda x: (x[0], x[1] or 0))
+        c.executemany(
+            "INSERT INTO changes (writer, station_id, program_id) VALUES (?, ?, ?)",
+            [(self.writer_id, *x) for x in rows]
+        )
+        c.execute(
+            "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (KEEP_CHANGES,)
+        )
+
+    def _start_watch(self):
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._connect()
+            self._data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def poll(self) -> set[Change] | None:
+        # What the other writers changed since the last poll (or the load),
+        # None when it's too much to say and everything should be reloaded
+        if not self.shared:
+            return set()
+
+        with self._watch_lock:
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return set() # nobody else has committed anything
+            self._data_version = version
+
+            lowest = self._watch.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            rows = self._watch.execute(
+                "SELECT seq, writer, station_id, program_id FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)
+            ).fetchall()
+            missed = lowest is not None and lowest > self._seq + 1
+
+            changes = set()
+            for row in rows:
+                self._seq = row["seq"]
+                if row["writer"] == self.writer_id:
+                    continue
+                if row["station_id"] is None:
+                    missed = True
+                changes.add((row["station_id"], row["program_id"]))
+            return None if missed else changes
+
+    def allocate(self, station_id: int | None = None, at_least: int = 1) -> int:
+        # A new station id (or program id of station_id), above any in the
+        # database or handed out before, and at least at_least. It's taken
+        # once this returns, even if it's never saved.
+        key = 0 if station_id is None else station_id
+        with self._transaction() as c:
+            row = c.execute("SELECT next FROM next_ids WHERE station_id = ?", (key,)).fetchone()
+            if station_id is None:
+                highest = c.execute("SELECT COALESCE(MAX(station_id), 0) FROM stations").fetchone()[0]
+            else:
+                highest = c.execute(
+                    "SELECT COALESCE(MAX(program_id), 0) FROM programs WHERE station_id = ?", (station_id,)
+                ).fetchone()[0]
+            new_id = max(row[0] if row is not None else 1, highest + 1, at_least)
+            c.execute(
+                "INSERT INTO next_ids (station_id, next) VALUES (?, ?) "
+                "ON CONFLICT (station_id) DO UPDATE SET next = excluded.next",
+                (key, new_id + 1)
+            )
+        return new_id
+
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return _Transaction(conn)
+
+    @staticmethod
+    def _put_station(c: sqlite3.Connection, s, programs: bool = False):
+        c.execute(_upsert_station, station_to_dict(s, programs=False))
+        # a station only has a handful of overrides, replace the lot
+        c.execute("DELETE FROM overrides WHERE station_id = ?", (s.station_id,))
+        for o in s.overrides:
+            c.execute(_insert_override, override_to_dict(o) | {"station_id": s.station_id})
+        if programs:
+            for p in s.programs.values():
+                c.execute(_upsert_program, program_to_dict(p) | {"station_id": s.station_id})
+
+    def save(self, config, changes: set[Change] | None = None):
+        with self._transaction() as c:
+            self._log(c, changes)
+            if changes is None:
+                c.execute("DELETE FROM stations")
+                for s in config.stations.values():
+                    self._put_station(c, s, programs=True)
+                return
+
+            for (station_id, program_id) in sorted(changes, key=lambda x: (x[0], x[1] is not None, x[1] or 0)):
+                s = config.stations.get(station_id, None)
+                if s is None:
+                    if program_id is None:
+                        c.execute("DELETE FROM stations WHERE station_id = ?", (station_id,))
+                        c.execute("DELETE FROM next_ids WHERE station_id = ?", (station_id,))
+                    continue
+
+                if program_id is None:
+                    self._put_station(c, s)
+                    ids = list(s.programs)
+                    c.execute(
+                        f"DELETE FROM programs WHERE station_id = ? AND program_id NOT IN ({', '.join('?' * len(ids))})",
+                        [station_id, *ids]
+                    )
+                    continue
+
+                p = s.get_program(program_id)
+                if p is None:
+                    c.execute(
+                        "DELETE FROM programs WHERE station_id = ? AND program_id = ?",
+                        (station_id, program_id)
+                    )
+                else:
+                    c.execute(_upsert_program, program_to_dict(p) | {"station_id": station_id})
+        logger.info(f"updated {len(changes) if changes is not None else 'all'} config row(s)")
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._local = threading.local()
+        self._watch = None
+
+class _Transaction():
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,56 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from logging import getLogger
+logger = getLogger()
+
+# Keeps a config on shared storage in step with the other processes using
+# it (uvicorn --workers N). Every `interval` seconds it asks the storage
+# what the others have changed, which is a single PRAGMA when nothing has,
+# and reloads just that. Runs on its own thread so a reload never blocks
+# the event loop.
+
+class ConfigWatcher():
+    def __init__(self, config, interval: float = 0.25):
+        self.config = config
+        self.interval = interval
+
+        self.polls = 0
+        self.reloads = 0 # polls that found something
+        self.reloaded = 0 # stations/programs reloaded
+
+        self._task : asyncio.Task | None = None
+        self._executor : ThreadPoolExecutor | None = None
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-watcher")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                changes = await loop.run_in_executor(self._executor, self.config.sync)
+                self.polls += 1
+                if changes:
+                    self.reloads += 1
+                    self.reloaded += len(changes)
+            except Exception as e:
+                logger.exception(f"unable to sync config: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "polls": self.polls,
+            "reloads": self.reloads,
+            "reloaded": self.reloaded,
+            "conflicts": self.config.conflicts
+        }
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from logging import getLogger
+logger = getLogger()
+
+# Coalesces bursts of config commits into single writes. Commits mark the
+# config dirty, a flush happens once no commit has arrived for `debounce`
+# seconds, or `max_delay` seconds after the first unsaved commit, whichever
+# comes first. Writes run on a dedicated thread so they never block the
+# event loop, stop() always flushes whatever is left.
+
+class ConfigWriter():
+    def __init__(self, config, debounce: float = 0.5, max_delay: float = 5.0):
+        self.config = config
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self.commits = 0
+        self.flushes = 0
+        self.coalesced = 0 # commits that were folded into another commit's write
+
+        self._batch = 0
+        self._first_mark = 0.0
+        self._last_mark = 0.0
+        self._loop : asyncio.AbstractEventLoop | None = None 
+        self._dirty : asyncio.Event | None = None 
+        self._task : asyncio.Task | None = None 
+        self._executor : ThreadPoolExecutor | None = None 
+
+    def mark_dirty(self):
+        # called from whichever thread committed the change
+        self._loop.call_soon_threadsafe(self._on_dirty)
+
+    def _on_dirty(self):
+        now = self._loop.time()
+        if not self._dirty.is_set():
+            self._first_mark = now
+            self._dirty.set()
+        self._last_mark = now
+        self._batch += 1
+        self.commits += 1
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._dirty = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-writer")
+        self._task = asyncio.create_task(self._run())
+        self.config.set_writer(self)
+
+    async def stop(self):
+        self.config.set_writer(None)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass 
+        await self._flush()
+        self._executor.shutdown()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            while True:
+                now = self._loop.time()
+                deadline = min(self._last_mark + self.debounce, self._first_mark + self.max_delay)
+                if now >= deadline:
+                    break
+                await asyncio.sleep(deadline - now)
+
+            self._dirty.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.exception(f"unable to write config: {e}")
+
+    async def _flush(self):
+        batch, self._batch = self._batch, 0
+        await self._loop.run_in_executor(self._executor, self.config.flush)
+        if batch:
+            self.flushes += 1
+            self.coalesced += batch - 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "commits": self.commits,
+            "flushes": self.flushes,
+            "coalesced": self.coalesced,
+            "pending": self._batch
+        }
@@ -0,0 +1,67 @@
+import yaml
+from datetime import timedelta
+
+from .base import Storage, Change
+from .codec import stations_to_list, stations_from_list
+
+from logging import getLogger
+logger = getLogger()
+
+# libyaml when it's there, the pure python versions otherwise
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+class LegacyLoader(SafeLoader):
+    # Older versions pickled the Config object straight into config.yaml.
+    # Only the tags those versions wrote are understood, each is turned
+    # into the plain data the codec expects, nothing gets imported or called
+
+    def _object(self, suffix, node):
+        if not suffix.startswith(("models.", "lib.")):
+            raise yaml.constructor.ConstructorError(None, None, f"unexpected object {suffix}", node.start_mark)
+        return self.construct_mapping(node, deep=True)
+
+    def _apply(self, suffix, node):
+        args = self.construct_sequence(node, deep=True)
+        if suffix == "datetime.timedelta":
+            return timedelta(*args)
+        if suffix.startswith(("models.", "lib.")):
+            return args[0] # enums, saved as their value
+        raise yaml.constructor.ConstructorError(None, None, f"unexpected object {suffix}", node.start_mark)
+
+LegacyLoader.add_multi_constructor("tag:yaml.org,2002:python/object:", LegacyLoader._object)
+LegacyLoader.add_multi_constructor("tag:yaml.org,2002:python/object/apply:", LegacyLoader._apply)
+
+def _from_legacy(c: dict) -> list[dict]:
+    stations = []
+    for s in c["stations"].values():
+        s = dict(s)
+        s["programs"] = list(s.get("programs", {}).values())
+        stations.append(s)
+    return stations
+
+class YamlStorage(Storage):
+    def __init__(self, path: str = "config.yaml"):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "r") as conf:
+                c = yaml.load(conf, Loader=LegacyLoader)
+        except FileNotFoundError:
+            return None
+
+        if c is None:
+            raise Exception("config is none")
+
+        if type(c["stations"]) is dict:
+            return stations_from_list(_from_legacy(c))
+        return stations_from_list(c["stations"])
+
+    def save(self, config, changes: set[Change] | None = None):
+        with open(self.path, "w") as conf:
+            yaml.dump(
+                {"stations": stations_to_list(config.stations)},
+                conf, sort_keys=False, indent=2, Dumper=SafeDumper
+            )
+            logger.info("updated config")
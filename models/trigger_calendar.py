@@ -0,0 +1,80 @@
+import os
+from datetime import date
+
+from lib.dt_helpers import DayOfWeek
+
+# What fires on a given date, compiled once into a bitmask and shared by
+# every program: a bit per Trigger, a bit per DayOfWeek (for the
+# day_of_week trigger). A program keeps the one bit it needs (see
+# trigger_bit) so checking if it fires is a single AND.
+#
+# Holidays and blackouts are folded into the same bits: a holiday fires
+# the week_ends trigger instead of week_days, a blackout date has all of
+# its bits cleared so nothing fires. They come from RETIC_HOLIDAYS and
+# RETIC_BLACKOUTS, comma separated ISO dates.
+
+# keyed on the Trigger values, programs.py imports this module
+TRIGGER_BITS = {
+    "daily": 1 << 0,
+    "even_days": 1 << 1,
+    "odd_days": 1 << 2,
+    "week_days": 1 << 3,
+    "week_ends": 1 << 4,
+}
+DAY_BITS = {DayOfWeek.from_dt(x): 1 << (5 + x) for x in range(7)}
+
+def trigger_bit(trigger: str, week_day: DayOfWeek | None) -> int:
+    # the bit a program with this trigger needs set to fire
+    if trigger == "day_of_week":
+        return DAY_BITS[week_day] if week_day is not None else 0
+    return TRIGGER_BITS[trigger]
+
+class TriggerCalendar():
+    def __init__(
+        self,
+        holidays: set[date] | None = None,
+        blackouts: set[date] | None = None,
+        max_days: int = 1024
+    ):
+        self.holidays = set(holidays or ())
+        self.blackouts = set(blackouts or ())
+        self.max_days = max_days # forecasts ask for a year, keep a bit more than that
+        self._masks : dict[date, int] = {}
+
+    def _compile(self, d: date) -> int:
+        if d in self.blackouts:
+            return 0
+        weekday = d.weekday()
+        weekend = weekday >= 5 or d in self.holidays
+        mask = TRIGGER_BITS["daily"] | DAY_BITS[DayOfWeek.from_dt(weekday)]
+        mask |= TRIGGER_BITS["even_days"] if d.day % 2 == 0 else TRIGGER_BITS["odd_days"]
+        mask |= TRIGGER_BITS["week_ends"] if weekend else TRIGGER_BITS["week_days"]
+        return mask
+
+    def mask(self, d: date) -> int:
+        mask = self._masks.get(d, None)
+        if mask is None:
+            mask = self._compile(d)
+            masks = self._masks if len(self._masks) < self.max_days else {}
+            masks[d] = mask
+            self._masks = masks
+        return mask
+
+    def fires(self, d: date, bit: int) -> bool:
+        return self.mask(d) & bit != 0
+
+def _dates(name: str) -> set[date]:
+    value = os.environ.get(name, "")
+    try:
+        return {date.fromisoformat(x.strip()) for x in value.split(",") if x.strip() != ""}
+    except ValueError as e:
+        raise Exception(f"{name} must be comma separated ISO dates: {e}")
+
+def calendar_from_env() -> TriggerCalendar:
+    return TriggerCalendar(
+        holidays=_dates("RETIC_HOLIDAYS"),
+        blackouts=_dates("RETIC_BLACKOUTS")
+    )
+
+# the calendar every program checks against
+calendar = calendar_from_env()
@@ -0,0 +1,121 @@
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, time
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+from .programs import ProgramModel, ProgramSnapshot, State, disabled_condition
+from . import trigger_calendar
+
+# Every program's start time as seconds of the day, sorted, with the
+# trigger bit it fires on. "What starts in the next hour" is then a bisect
+# to the window and a calendar check for each program starting in it,
+# rather than evaluating every program at many times.
+#
+# Config keeps one next to each published snapshot. A commit only
+# re-indexes the stations/programs it changed, the programs' setters
+# (start time, trigger, week day) and adding or deleting one all mark the
+# change. It is copied rather than changed in place so readers never see
+# it half updated.
+
+DAY = 24 * 60 * 60
+
+class StartIndex(NamedTuple):
+    starts: list[tuple[int, int, int]] # (seconds of the day, station_id, program_id), sorted
+    programs: dict[int, dict[int, tuple[int, int]]] # station_id -> program_id -> (seconds of the day, trigger bit)
+
+    @classmethod
+    def build(cls, stations: dict) -> "StartIndex":
+        programs = {s.station_id: _entries(s) for s in stations.values()}
+        return cls(
+            sorted((x[1][0], station_id, x[0]) for station_id, entries in programs.items() for x in entries.items()),
+            programs
+        )
+
+    def updated(self, stations: dict, changes: set[tuple[int, int | None]]) -> "StartIndex":
+        # re-indexes the stations (program_id None) and programs changed
+        station_ids = {x[0] for x in changes if x[1] is None}
+        changed = {x for x in changes if x[1] is not None and x[0] not in station_ids}
+        if len(station_ids) + len(changed) > len(self.starts) // 64 + 8:
+            return StartIndex.build(stations) # cheaper than placing them one by one
+
+        programs = dict(self.programs)
+        removed, added = [], []
+        for station_id in station_ids:
+            old = programs.pop(station_id, {})
+            removed += [(x[1][0], station_id, x[0]) for x in old.items()]
+            s = stations.get(station_id, None)
+            if s is not None:
+                programs[station_id] = _entries(s)
+                added += [(x[1][0], station_id, x[0]) for x in programs[station_id].items()]
+        for (station_id, program_id) in changed:
+            entries = programs[station_id] = dict(programs.get(station_id, {}))
+            old = entries.pop(program_id, None)
+            if old is not None:
+                removed.append((old[0], station_id, program_id))
+            s = stations.get(station_id, None)
+            p = s.programs.get(program_id, None) if s is not None else None
+            if p is not None:
+                entries[program_id] = _entry(p)
+                added.append((entries[program_id][0], station_id, program_id))
+
+        starts = list(self.starts)
+        for x in removed:
+            del starts[bisect_left(starts, x)]
+        for x in added:
+            insort(starts, x)
+        return StartIndex(starts, programs)
+
+    def between(self, start: datetime, end: datetime):
+        # (when, station_id, program_id) of every start time in [start, end)
+        # whose trigger fires that day, in order
+        day = datetime.combine(start.date(), time.min)
+        while day < end:
+            lo = max(int((start - day).total_seconds()) + (1 if (start - day).microseconds else 0), 0)
+            hi = min(int((end - day).total_seconds()) + (1 if (end - day).microseconds else 0), DAY)
+            mask = trigger_calendar.calendar.mask(day.date())
+            i = bisect_left(self.starts, (lo,))
+            while i < len(self.starts) and self.starts[i][0] < hi:
+                seconds, station_id, program_id = self.starts[i]
+                if mask & self.programs[station_id][program_id][1]:
+                    yield day + timedelta(seconds=seconds), station_id, program_id
+                i += 1
+            day += timedelta(days=1)
+
+def _entry(p: ProgramModel) -> tuple[int, int]:
+    t = p.start_time
+    return (t.hour * 3600 + t.minute * 60 + t.second, trigger_calendar.trigger_bit(p.trigger, p.week_day))
+
+def _entries(s) -> dict[int, tuple[int, int]]:
+    return {p.program_id: _entry(p) for p in s.programs.values()}
+
+def runs(p: ProgramModel, when: datetime) -> bool:
+    # whether the program isn't disabled at when, the state machine's rules
+    return not disabled_condition(ProgramSnapshot(
+        trigger_bit = 0,
+        start_time = p.start_time,
+        duration = p.duration,
+        enabled = p.enabled,
+        enabled_after = p.enabled_after,
+        enabled_before = p.enabled_before,
+        state = State.initial,
+        input_dt = when,
+        last_triggered = None
+    ))
+
+class UpcomingRunModel(BaseModel):
+    station_id: int
+    program_id: int
+    start: datetime
+    end: datetime
+
+def upcoming(index: StartIndex, stations: dict, start: datetime, end: datetime) -> list[UpcomingRunModel]:
+    # the runs of enabled programs on enabled stations starting in [start, end)
+    out = []
+    for when, station_id, program_id in index.between(start, end):
+        s = stations.get(station_id, None)
+        p = s.programs.get(program_id, None) if s is not None else None
+        if p is None or not s.enabled or not runs(p, when):
+            continue
+        out.append(UpcomingRunModel(station_id=station_id, program_id=program_id, start=when, end=when + p.duration))
+    return out
@@ -1,8 +1,15 @@
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
-from models import Program, DayOfWeek, Trigger 
+from models import Program, DayOfWeek, Trigger, Config, Scheduler
+from models.programs import State
+from models.storage import JournalStorage, Storage, ConfigWriter, BinaryStorage, YamlStorage, ShardedStorage, SqliteStorage
+from models.storage.codec import stations_to_list
+import asyncio
 import logging
+import os
 import sys 
+import tempfile
 from time import sleep 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -14,6 +21,45 @@ dates_to_test = [
     in range(4,21)
 ]
 
+class CountingStorage(Storage):
+    # keeps what each save was asked to write, nothing is written
+    def __init__(self):
+        self.saves = []
+
+    def load(self):
+        return None 
+
+    def save(self, config, changes = None):
+        self.saves.append(changes)
+
+def memory_config() -> tuple[Config, CountingStorage]:
+    # the default config, with the save of the defaults already cleared
+    storage = CountingStorage()
+    config = Config(storage=storage)
+    storage.saves.clear()
+    return config, storage
+
+class ApiTestCase(unittest.TestCase):
+    # main.py's app on a fresh default config, run from a temporary
+    # directory so the config and the front end it mounts are its own
+    env : dict[str, str] = {} # set while main.py is imported
+
+    def setUp(self):
+        import importlib
+        from fastapi.testclient import TestClient
+
+        cwd = os.getcwd()
+        d = tempfile.TemporaryDirectory()
+        os.chdir(d.name)
+        self.addCleanup(d.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(os.path.join("front_end", "dist"))
+
+        with mock.patch.dict(os.environ, self.env):
+            self.main = importlib.reload(sys.modules["main"]) if "main" in sys.modules else importlib.import_module("main")
+        self.config = self.main.config
+        self.client = self.enterContext(TestClient(self.main.app))
+
 class DayOfWeekTest(unittest.TestCase):
     def test_day_of_week(self):
         program = Program(
@@ -284,6 +330,1186 @@ class MidnightCrossing(unittest.TestCase):
             logging.info(f"Testing at {test_dt}, state: {program.get_state_h()}")
             self.assertFalse(is_active)
                 
+class NextTransitionCache(unittest.TestCase):
+    def test_matches_uncached(self):
+        start = datetime.fromisoformat("2025-04-04T00:00:00")
+        for trigger in Trigger:
+            kwargs = dict(
+                trigger = trigger,
+                start_time = datetime.fromisoformat("1970-01-01T23:40:00"),
+                duration = timedelta(minutes=45),
+                week_day = DayOfWeek.saturday,
+                enabled = True,
+                enabled_before = start + timedelta(days=1, hours=5),
+                enabled_after = start + timedelta(days=9, hours=3)
+            )
+            cached = Program(**kwargs)
+            uncached = Program(**kwargs)
+
+            runs = 0
+            state_machine = cached._state_machine
+            def counted():
+                nonlocal runs
+                runs += 1
+                state_machine()
+            cached._state_machine = counted
+
+            for minute in range(0, 60 * 24 * 10, 7):
+                dt = start + timedelta(minutes=minute)
+                uncached._next_change = None
+                self.assertEqual(cached.run(dt), uncached.run(dt), f"{trigger} at {dt}")
+                self.assertEqual(cached.last_triggered, uncached.last_triggered)
+
+            self.assertLess(runs, 100)
+
+            cached.set_duration(timedelta(minutes=10))
+            self.assertIsNone(cached.next_change)
+
+class PureEvaluateTest(unittest.TestCase):
+    def test_no_side_effects(self):
+        from models.programs import evaluate
+
+        config, _ = memory_config()
+        station = config.get_station(1)
+        station.set_enabled()
+        p = station.get_program(1)
+        p.set_trigger(Trigger.daily)
+        p.set_enabled()
+        owner = Program(Trigger.daily, p.start_time, p.duration, enabled=True)
+
+        start = datetime.fromisoformat("2025-04-04T00:00:00")
+        for minute in range(0, 60 * 24 * 2, 5):
+            dt = start + timedelta(minutes=minute)
+            before = p.snapshot()
+            self.assertEqual(station.status(dt).program_states[1], evaluate(before, dt).state)
+            self.assertEqual(station.is_active(dt), evaluate(before, dt).state == State.activated)
+            self.assertEqual(p.snapshot(), before)
+
+            # the owner runs the program, evaluating its snapshot agrees
+            for _ in range(8):
+                owner.run(dt)
+                p.run(dt)
+            self.assertEqual(evaluate(owner.snapshot(), dt).state, owner.state)
+            self.assertEqual(p.state, owner.state)
+
+class ConfigSnapshotTest(unittest.TestCase):
+    def test_copy_on_write(self):
+        config, _ = memory_config()
+        before = config.snapshot
+
+        with config.update_config():
+            config.get_station(2).get_program(1).set_name("lawn")
+            config.get_station(2).set_enabled()
+            self.assertIs(config.snapshot, before) # nothing shows until the commit
+        after = config.snapshot
+
+        self.assertEqual(before.stations[2].programs[1].name, "")
+        self.assertFalse(before.stations[2].enabled)
+        self.assertEqual(after.stations[2].programs[1].name, "lawn")
+        self.assertTrue(after.stations[2].enabled)
+        self.assertIs(after.stations[1], before.stations[1])
+        with self.assertRaises(Exception):
+            after.stations[2].enabled = False
+
+        config.delete_station(3)
+        self.assertNotIn(3, config.snapshot.stations)
+        self.assertIn(3, after.stations)
+
+class ConfigVersionTest(unittest.TestCase):
+    def test_changes_since(self):
+        from lib.fastapi_helper import etag_matches
+        from models import Override, OverrideType
+
+        config, _ = memory_config()
+        start = config.version
+        etag = config.published().etag(config.epoch, 1)
+
+        with config.update_config():
+            config.get_station(2).get_program(1).set_name("lawn")
+        with config.update_config():
+            config.get_station(4).add_program()
+        config.delete_station(5)
+        self.assertEqual(config.version, start + 3)
+        self.assertEqual(config.published().etag(config.epoch, 1), etag) # station 1 didn't change
+        self.assertIsNone(config.published().etag(config.epoch, 5))
+
+        changes = config.changes_since(start)
+        self.assertFalse(changes.reset)
+        self.assertEqual([(x.station_id, x.program.program_id, x.program.name) for x in changes.programs], [(2, 1, "lawn"), (4, 2, "")])
+        self.assertEqual(changes.stations, [])
+        self.assertEqual(changes.deleted_stations, [5])
+        self.assertEqual(config.changes_since(config.version).programs, [])
+
+        # too far back, or from the future, is everything
+        self.assertTrue(config.changes_since(config.version + 1).reset)
+        for i in range(1000):
+            with config.update_config():
+                config.get_station(1).get_program(1).set_name(str(i))
+        changes = config.changes_since(start)
+        self.assertTrue(changes.reset)
+        self.assertEqual(sorted(x.station_id for x in changes.stations), [1, 2, 3, 4, 6])
+
+        # an override starting changes the station's etag without a commit
+        now = datetime.now()
+        with config.update_config():
+            config.get_station(3).add_overrides([
+                Override(now + timedelta(hours=1), timedelta(hours=1), True, OverrideType.Off)
+            ])
+        published = config.published()
+        self.assertNotEqual(published.etag(config.epoch, 3), published.etag(config.epoch, 3, now + timedelta(hours=1)))
+        self.assertEqual(published.etag(config.epoch, 3), published.etag(config.epoch, 3, now + timedelta(minutes=59)))
+
+        self.assertTrue(etag_matches('W/"a", "b"', '"a"'))
+        self.assertTrue(etag_matches("*", '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+        self.assertFalse(etag_matches(None, '"a"'))
+
+class OverrideApiTest(ApiTestCase):
+    def test_crud(self):
+        url = "/config/station/1/override"
+        version = self.config.version
+        r = self.client.post(url, json=[
+            {"start_time": "2025-04-04T06:00:00", "duration": 3600, "override_enabled": True, "override_type": "on"},
+            {"start_time": "2099-04-05T06:00:00", "duration": 3600, "override_enabled": True, "override_type": "off"},
+        ])
+        self.assertEqual([x["override_id"] for x in r.json()], [1, 2])
+        changes = self.client.get("/config/changes", params={"since": version}).json()
+        self.assertEqual([x["station_id"] for x in changes["stations"]], [1])
+
+        r = self.client.get(url)
+        self.assertEqual([(x["override_id"], x["override_type"]) for x in r.json()], [(1, "on"), (2, "off")])
+        etag = r.headers["etag"]
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        r = self.client.delete(url, params={"before": "2025-04-05T00:00:00"})
+        self.assertEqual(r.json(), [1])
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 200)
+        self.assertEqual(self.client.delete(url + "/2").status_code, 200)
+        self.assertEqual(self.client.delete(url + "/2").status_code, 404)
+        self.assertEqual(self.client.get(url).json(), [])
+
+        r = self.client.put(url, params={
+            "start_time": "2099-01-01T00:00:00", "duration": "PT1M", "override_type": "off", "enabled": True
+        })
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([x["start_time"] for x in self.client.get(url).json()], ["2099-01-01T00:00:00"])
+
+        self.assertEqual(self.client.get("/config/station/9/override").status_code, 404)
+        self.assertEqual(self.client.post("/config/station/9/override", json=[]).status_code, 404)
+        self.assertEqual(self.client.delete("/config/station/9/override/1").status_code, 404)
+
+class SerializedConfigTest(unittest.TestCase):
+    def test_kept_until_changed(self):
+        import json
+        from models import Override, OverrideType
+        from models.serialized import SerializedConfig
+
+        config, _ = memory_config()
+        serialized = SerializedConfig()
+        now = datetime.now()
+        before = config.published()
+        body = serialized.config(before, now)
+        self.assertEqual(json.loads(body), json.loads(config.snapshot.model_dump_json()))
+        station = serialized.station(before, 1, now)
+        self.assertIs(serialized.config(before, now), body)
+
+        with config.update_config():
+            config.get_station(2).get_program(1).set_name("lawn")
+        after = config.published()
+        self.assertEqual(json.loads(serialized.config(after, now))["stations"]["2"]["programs"]["1"]["name"], "lawn")
+        self.assertIs(serialized.station(after, 1, now), station)
+        self.assertEqual(json.loads(serialized.programs(after, 2))[0]["name"], "lawn")
+        self.assertIsNone(serialized.program(after, 2, 9))
+        self.assertIsNone(serialized.station(after, 9, now))
+
+        # the station's computed override changes when one starts
+        with config.update_config():
+            config.get_station(1).add_overrides([
+                Override(now + timedelta(hours=1), timedelta(hours=1), True, OverrideType.On)
+            ])
+        published = config.published()
+        station = serialized.station(published, 1, now)
+        self.assertIsNotNone(json.loads(station)["override"])
+        self.assertIsNot(serialized.station(published, 1, now + timedelta(hours=1)), station)
+        self.assertIs(serialized.station(published, 1, now), station)
+
+class ListingTest(unittest.TestCase):
+    def test_select(self):
+        from models.listing import Listings, select, station_filters, parse_fields
+        from models import StationModel
+
+        config, _ = memory_config()
+        with config.update_config():
+            for station_id in (2, 3, 5):
+                config.get_station(station_id).set_enabled()
+            config.get_station(3).get_program(1).set_trigger(Trigger.daily)
+        listings = Listings()
+        index = listings.stations(config.snapshot)
+        self.assertIs(listings.stations(config.snapshot), index)
+
+        self.assertEqual(select(index.ids, limit=4), ([1, 2, 3, 4], 4))
+        self.assertEqual(select(index.ids, after=4, limit=4), ([5, 6], None))
+        self.assertEqual(select(index.ids, min_id=2, max_id=4), ([2, 3, 4], None))
+
+        include, exclude = station_filters(index, enabled=True)
+        self.assertEqual(select(index.ids, include, exclude, limit=2), ([2, 3], 3))
+        self.assertEqual(select(index.ids, include, exclude, after=3, limit=2), ([5], None))
+        include, exclude = station_filters(index, listings.active({1: True, 2: True, 9: True}), enabled=False, active=True)
+        self.assertEqual(select(index.ids, include, exclude), ([1], None))
+        include, _ = station_filters(index, trigger=Trigger.daily)
+        self.assertEqual(select(index.ids, include), ([3], None))
+
+        config.delete_station(3)
+        index = listings.stations(config.snapshot)
+        self.assertEqual(select(index.ids, after=2, limit=1), ([4], 4))
+
+        self.assertEqual(parse_fields("station_id, override", StationModel), {"station_id", "override"})
+        with self.assertRaises(ValueError):
+            parse_fields("station_id,nope", StationModel)
+
+class ListingApiTest(ApiTestCase):
+    def next_page(self, r) -> str | None:
+        link = r.headers.get("link", None)
+        if link is None:
+            return None
+        self.assertTrue(link.endswith('; rel="next"'))
+        return link[1:link.index(">")]
+
+    def test_config(self):
+        with self.config.update_config():
+            for station_id in (2, 3, 5):
+                self.config.get_station(station_id).set_enabled()
+            self.config.get_station(3).get_program(1).set_trigger(Trigger.daily)
+
+        r = self.client.get("/config", params={"enabled": True, "limit": 2})
+        self.assertEqual(list(r.json()["stations"]), ["2", "3"])
+        r = self.client.get(self.next_page(r))
+        self.assertEqual(list(r.json()["stations"]), ["5"])
+        self.assertIsNone(self.next_page(r))
+
+        r = self.client.get("/config", params={"enabled": False, "min_id": 2, "max_id": 5})
+        self.assertEqual(list(r.json()["stations"]), ["4"])
+        r = self.client.get("/config", params={"trigger": "daily", "fields": "station_id,enabled"})
+        self.assertEqual(r.json(), {"stations": {"3": {"station_id": 3, "enabled": True}}})
+        self.assertEqual(self.client.get("/config", params={"fields": "station_id,nope"}).status_code, 422)
+        self.assertEqual(self.client.get("/config", params={"limit": 0}).status_code, 422)
+
+    def test_status(self):
+        r = self.client.get("/status/station", params={"min_id": 2, "limit": 2, "fields": "station_id"})
+        self.assertEqual(r.json(), [{"station_id": 2}, {"station_id": 3}])
+        r = self.client.get(self.next_page(r))
+        self.assertEqual(r.json(), [{"station_id": 4}, {"station_id": 5}])
+        r = self.client.get(self.next_page(r))
+        self.assertEqual(r.json(), [{"station_id": 6}])
+        self.assertIsNone(self.next_page(r))
+        self.assertEqual(self.client.get("/status/station", params={"active": True}).json(), [])
+
+    def test_programs(self):
+        with self.config.update_config():
+            s = self.config.get_station(1)
+            s.add_program().set_enabled()
+            s.add_program()
+
+        url = "/config/station/1/program"
+        r = self.client.get(url, params={"enabled": False, "fields": "program_id,enabled"})
+        self.assertEqual(r.json(), [{"program_id": 1, "enabled": False}, {"program_id": 3, "enabled": False}])
+        r = self.client.get(url, params={"limit": 1, "cursor": 1})
+        self.assertEqual([x["program_id"] for x in r.json()], [2])
+        self.assertEqual([x["program_id"] for x in self.client.get(self.next_page(r)).json()], [3])
+        self.assertEqual(self.client.get("/config/station/9/program", params={"limit": 1}).status_code, 404)
+
+class PatchTest(unittest.TestCase):
+    def test_one_commit(self):
+        from models import ProgramPatchModel, StationPatchModel
+
+        config, storage = memory_config()
+
+        patch = ProgramPatchModel.model_validate({
+            "name": "lawn", "trigger": "daily", "start_time": "06:15", "duration": 600,
+            "enabled": True, "week_day": None
+        })
+        with config.update_config():
+            config.get_station(1).get_program(1).patch(patch)
+        p = config.get_station(1).get_program(1)
+        self.assertEqual(
+            (p.name, p.trigger, p.start_time, p.duration, p.enabled, p.week_day, p.description),
+            ("lawn", Trigger.daily, datetime(1970, 1, 1, 6, 15), timedelta(minutes=10), True, None, "")
+        )
+        self.assertIn((1, 1), storage.saves[-1])
+
+        with self.assertRaises(Exception):
+            ProgramPatchModel.model_validate({"name": None})
+
+        s = config.get_station(2)
+        with self.assertRaises(KeyError):
+            s.patch(StationPatchModel.model_validate({"enabled": True, "programs": {"5": {"name": "x"}}}))
+        self.assertFalse(s.enabled)
+
+        with config.update_config():
+            s.patch(StationPatchModel.model_validate({"enabled": True, "programs": {"1": {"name": "beds"}}}))
+        self.assertTrue(s.enabled)
+        self.assertEqual(s.get_program(1).name, "beds")
+        self.assertEqual(storage.saves[-1], {(2, None), (2, 1)})
+
+class PatchApiTest(ApiTestCase):
+    def test_patch(self):
+        url = "/config/station/1"
+        r = self.client.get(url)
+        etag, other = r.headers["etag"], self.client.get("/config/station/2").headers["etag"]
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        r = self.client.patch(url + "/program/1", json={"name": "lawn", "duration": 600, "week_day": None})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.json()["name"], r.json()["duration"], r.json()["week_day"]), ("lawn", "PT10M", None))
+        r = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["programs"]["1"]["name"], "lawn")
+        self.assertNotEqual(r.headers["etag"], etag)
+        self.assertEqual(self.client.get("/config/station/2", headers={"If-None-Match": other}).status_code, 304)
+
+        r = self.client.patch(url, json={"enabled": True, "programs": {"1": {"description": "front"}}})
+        self.assertEqual((r.status_code, r.json()["enabled"]), (200, True))
+        self.assertEqual(self.config.get_station(1).get_program(1).description, "front")
+
+        # nothing is changed unless all of it can be
+        etag = self.client.get(url).headers["etag"]
+        r = self.client.patch(url, json={"enabled": False, "programs": {"9": {"name": "x"}}})
+        self.assertEqual(r.status_code, 404)
+        self.assertTrue(self.config.get_station(1).enabled)
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        self.assertEqual(self.client.patch(url + "/program/1", json={"name": None}).status_code, 422)
+        self.assertEqual(self.client.patch(url + "/program/1", json={"nope": 1}).status_code, 422)
+        self.assertEqual(self.client.patch(url + "/program/9", json={"name": "x"}).status_code, 404)
+        self.assertEqual(self.client.patch("/config/station/9", json={"enabled": True}).status_code, 404)
+
+class BatchTest(unittest.TestCase):
+    def test_all_or_nothing(self):
+        from pydantic import TypeAdapter
+        from models.batch import Operation, BatchError, apply_batch
+
+        ops = TypeAdapter(list[Operation])
+        config, storage = memory_config()
+
+        results = apply_batch(config, ops.validate_python([
+            {"op": "add_station", "station": {"enabled": True}, "programs": [{"name": "am"}, {"name": "pm"}]},
+            {"op": "add_program", "station_id": 1, "program": {"name": "lawn"}},
+            {"op": "delete_program", "station_id": 2, "program_id": 1},
+        ]))
+        self.assertEqual([(x.station_id, x.program_id, x.program_ids) for x in results], [
+            (7, None, [1, 2]), (1, 2, None), (2, 1, None)
+        ])
+        self.assertEqual(len(storage.saves), 1)
+        self.assertEqual(config.get_station(7).get_program(2).name, "pm")
+
+        before = stations_to_list(config.stations)
+        snapshot = config.snapshot
+        with self.assertRaises(BatchError) as e:
+            apply_batch(config, ops.validate_python([
+                {"op": "patch_program", "station_id": 1, "program_id": 1, "patch": {"name": "x"}},
+                {"op": "add_station"},
+                {"op": "delete_station", "station_id": 3},
+                {"op": "patch_station", "station_id": 3, "patch": {"enabled": True}},
+            ]))
+        self.assertEqual(e.exception.index, 3)
+        self.assertEqual(stations_to_list(config.stations), before)
+        self.assertIs(config.snapshot, snapshot)
+        self.assertEqual(len(storage.saves), 1)
+
+        # only the stations it touches are kept to roll back to
+        with self.assertRaises(KeyError):
+            with config.transaction():
+                config.get_station(4).get_program(1).set_name("x")
+                config.get_station(4).set_enabled()
+                config.get_station(5).get_program(1)
+                self.assertEqual(list(config._before), [4])
+                raise KeyError(4)
+        self.assertEqual(stations_to_list(config.stations), before)
+
+        # the restored stations still report their changes
+        with config.update_config():
+            config.get_station(3).set_enabled()
+        self.assertEqual(storage.saves[-1], {(3, None)})
+
+class BatchApiTest(ApiTestCase):
+    def test_batch(self):
+        r = self.client.post("/batch", json=[
+            {"op": "add_station", "station": {"description": "beds"}},
+            {"op": "patch_program", "station_id": 1, "program_id": 1, "patch": {"name": "lawn"}},
+        ])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), [{"station_id": 7, "program_ids": [1]}, {"station_id": 1, "program_id": 1}])
+        self.assertEqual(self.config.get_station(1).get_program(1).name, "lawn")
+
+        r = self.client.get("/config")
+        before, etag = r.json(), r.headers["etag"]
+        r = self.client.post("/batch", json=[
+            {"op": "delete_station", "station_id": 7},
+            {"op": "add_program", "station_id": 2, "program": {"name": "x"}},
+            {"op": "delete_program", "station_id": 3, "program_id": 9},
+        ])
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(r.json()["detail"]["index"], 2)
+        self.assertEqual(self.client.get("/config", headers={"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(self.client.get("/config").json(), before)
+
+        self.assertEqual(self.client.post("/batch", json=[{"op": "nope"}]).status_code, 422)
+
+        # programs patched by id, the new station only has the default one
+        r = self.client.post("/batch", json=[
+            {"op": "patch_station", "station_id": 1, "patch": {"description": "x"}},
+            {"op": "add_station", "station": {"programs": {"9": {"name": "x"}}}},
+        ])
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(r.json()["detail"]["index"], 1)
+        self.assertEqual(self.client.get("/config").json(), before)
+
+class AsyncBatchApiTest(BatchApiTest):
+    # the same answers with the handlers run on the event loop
+    env = {"RETIC_ASYNC_API": "1"}
+
+class SchedulerTest(unittest.TestCase):
+    def test_heap(self):
+        config, storage = memory_config()
+        station = config.get_station(1)
+        station.set_enabled()
+        p = station.get_program(1)
+        p.set_trigger(Trigger.daily)
+        p.set_enabled()
+        p.set_start_time(datetime.fromisoformat("1970-01-01T06:00:00").time())
+        station.set_override(datetime.fromisoformat("2025-04-04T12:00:00"), timedelta(hours=1), "on", True)
+
+        scheduler = Scheduler(config)
+        day = datetime.fromisoformat("2025-04-04T00:00:00")
+        scheduler.refresh(day + timedelta(hours=5))
+        self.assertFalse(scheduler.active[1])
+        self.assertEqual(scheduler.next_wake(), day + timedelta(hours=6))
+
+        storage.saves.clear()
+        scheduler.tick(day + timedelta(hours=6))
+        self.assertTrue(scheduler.active[1])
+        self.assertEqual(scheduler.next_wake(), day + timedelta(hours=6, minutes=30))
+        self.assertEqual(config.snapshot.stations[1].programs[1].last_triggered, day + timedelta(hours=6))
+        self.assertIn((1, 1), storage.saves[-1])
+
+        scheduler.tick(day + timedelta(hours=6, minutes=30))
+        self.assertFalse(scheduler.active[1])
+        self.assertEqual(scheduler.next_wake(), day + timedelta(hours=12))
+
+        scheduler.tick(day + timedelta(hours=12))
+        self.assertTrue(scheduler.statuses[1].override_active)
+        scheduler.tick(day + timedelta(hours=13))
+        self.assertFalse(scheduler.active[1])
+        self.assertEqual(scheduler.next_wake(), day + timedelta(days=1))
+
+    def test_failed_advance(self):
+        config, _ = memory_config()
+        for station_id in (1, 2):
+            station = config.get_station(station_id)
+            station.set_enabled()
+            p = station.get_program(1)
+            p.set_trigger(Trigger.daily)
+            p.set_enabled()
+            p.set_start_time(datetime.fromisoformat("1970-01-01T06:00:00").time())
+
+        scheduler = Scheduler(config)
+        day = datetime.fromisoformat("2025-04-04T00:00:00")
+        scheduler.refresh(day + timedelta(hours=5))
+
+        broken = config.get_station(1).get_program(1)
+        run = broken.run
+        broken.run = lambda now: 1 / 0
+        scheduler._changed |= {(1, 1), (2, 1)}
+        with self.assertLogs(level=logging.ERROR):
+            scheduler.tick(day + timedelta(hours=6))
+        self.assertTrue(scheduler.active[2])
+        self.assertIn((1, 1), scheduler._changed)
+
+        broken.run = run
+        scheduler.tick(day + timedelta(hours=6))
+        self.assertTrue(scheduler.active[1])
+        self.assertEqual(scheduler._changed, set())
+
+class EventStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_deltas(self):
+        from models.events import EventStream
+
+        config, _ = memory_config()
+        station = config.get_station(1)
+        station.set_enabled()
+        p = station.get_program(1)
+        p.set_trigger(Trigger.daily)
+        p.set_enabled()
+        p.set_start_time(datetime.fromisoformat("1970-01-01T06:00:00").time())
+
+        scheduler = Scheduler(config)
+        day = datetime.fromisoformat("2025-04-04T00:00:00")
+        scheduler.refresh(day + timedelta(hours=5))
+        stream = EventStream(scheduler, queue_size=1)
+        stream.start()
+
+        # a new client starts from a reset
+        events = stream.events()
+        seq, kind, data = await anext(events)
+        self.assertEqual((seq, kind, len(data["stations"])), (0, "reset", 6))
+
+        scheduler.tick(day + timedelta(hours=6))
+        scheduler.tick(day + timedelta(hours=6, minutes=30))
+        # more than its queue holds, it catches up from the history
+        received = [await anext(events) for _ in range(4)]
+        self.assertEqual([(x[0], x[1]) for x in received], [(1, "program"), (2, "station"), (3, "program"), (4, "station")])
+        self.assertEqual(received[0][2], {"station_id": 1, "program_id": 1, "state": State.activated})
+        self.assertEqual(received[3][2], {"station_id": 1, "enabled": True, "active": False})
+        await events.aclose()
+
+        # resuming only gets what was missed, a foreign token gets a reset
+        config.delete_station(6)
+        scheduler.refresh(day + timedelta(hours=7))
+        resumed = stream.events(stream.parse_token(stream.token(4)))
+        self.assertEqual(await anext(resumed), (5, "station", {"station_id": 6, "removed": True}))
+        await resumed.aclose()
+        self.assertIsNone(stream.parse_token("elsewhere-4"))
+        self.assertEqual(stream.format((5, "station", {"station_id": 6})), 
+            f"id: {stream.epoch}-5\nevent: station\ndata: {{\"station_id\": 6}}\n\n")
+
+class FleetEvaluatorTest(unittest.TestCase):
+    def test_matches_run(self):
+        try:
+            from models.fleet import FleetEvaluator, State
+        except ImportError:
+            self.skipTest("numpy not installed")
+        from models.fleet import np
+        if np is None:
+            self.skipTest("numpy not installed")
+
+        start = datetime.fromisoformat("2025-04-04T00:00:00")
+        programs = []
+        for i, trigger in enumerate(Trigger):
+            for j, (start_time, minutes) in enumerate([("06:00", 30), ("23:40", 45), ("12:10", 0)]):
+                programs.append((i, Program(
+                    trigger = trigger,
+                    start_time = datetime.fromisoformat(f"1970-01-01T{start_time}:00"),
+                    duration = timedelta(minutes=minutes),
+                    program_id = j,
+                    week_day = DayOfWeek.saturday,
+                    enabled = True,
+                    enabled_before = start + timedelta(days=1, hours=3),
+                    enabled_after = start + timedelta(days=8, hours=9)
+                )))
+        fleet = FleetEvaluator(programs)
+
+        for minute in range(0, 60 * 24 * 10, 5):
+            dt = start + timedelta(minutes=minute)
+            active = fleet.active(dt)
+            states = fleet.states(dt)
+            for n, (station_id, p) in enumerate(programs):
+                state = p.run(dt)
+                self.assertEqual(active[n], state == State.activated, f"{p.trigger} {p.start_time} at {dt}")
+                self.assertEqual(states[(station_id, p.program_id)] == State.disabled, state == State.disabled)
+
+class ForecastTest(unittest.TestCase):
+    def test_matches_run(self):
+        from models.forecast import program_intervals
+
+        start = datetime.fromisoformat("2025-04-04T00:00:00")
+        end = start + timedelta(days=12)
+        for trigger in Trigger:
+            for start_time, minutes in [("06:00", 30), ("23:40", 45)]:
+                p = Program(
+                    trigger = trigger,
+                    start_time = datetime.fromisoformat(f"1970-01-01T{start_time}:00"),
+                    duration = timedelta(minutes=minutes),
+                    week_day = DayOfWeek.wednesday,
+                    enabled = True,
+                    enabled_before = start + timedelta(days=1, hours=3),
+                    enabled_after = start + timedelta(days=10, hours=9)
+                )
+                intervals = program_intervals(p, start, end)
+                for minute in range(0, 60 * 24 * 12, 5):
+                    dt = start + timedelta(minutes=minute)
+                    expected = p.is_active(dt)
+                    self.assertEqual(any(s <= dt < e for s, e in intervals), expected, f"{trigger} {start_time} at {dt}")
+
+    def test_override(self):
+        from models.forecast import station_intervals
+
+        config, _ = memory_config()
+        with config.update_config():
+            s = config.get_station(1)
+            s.set_enabled()
+            p = s.get_program(1)
+            p.set_enabled()
+            p.set_trigger(Trigger.daily)
+            s.set_override(datetime.fromisoformat("2025-04-05T07:50:00"), timedelta(days=1), "off", True)
+
+        day = datetime.fromisoformat("2025-04-04T00:00:00")
+        self.assertEqual(station_intervals(config.snapshot.stations[1], day, day + timedelta(days=3)), [
+            (day + timedelta(hours=8), day + timedelta(hours=8, minutes=30)),
+            (day + timedelta(days=2, hours=8), day + timedelta(days=2, hours=8, minutes=30)),
+        ])
+
+class UpcomingTest(unittest.TestCase):
+    def test_start_index(self):
+        from models.upcoming import StartIndex, upcoming
+        from lib.dt_helpers import DayOfWeek
+
+        config, _ = memory_config()
+        with config.update_config():
+            for station_id in (1, 2, 3):
+                config.get_station(station_id).set_enabled()
+            p = config.get_station(1).get_program(1)
+            p.set_trigger(Trigger.daily)
+            p.set_start_time(datetime(1970, 1, 1, 23, 50).time())
+            p.set_enabled()
+            p = config.get_station(2).add_program()
+            p.set_trigger(Trigger.day_of_week)
+            p.set_week_day(DayOfWeek.saturday)
+            p.set_start_time(datetime(1970, 1, 1, 0, 10).time())
+            p.set_enabled()
+            p = config.get_station(3).get_program(1)
+            p.set_trigger(Trigger.daily) # not enabled
+
+        def check():
+            published = config.published()
+            self.assertEqual(published.starts, StartIndex.build(published.snapshot.stations))
+            return published
+
+        # friday night into saturday
+        published = check()
+        start = datetime(2025, 4, 4, 23, 0)
+        runs = upcoming(published.starts, published.snapshot.stations, start, start + timedelta(hours=2))
+        self.assertEqual([(x.station_id, x.program_id, x.start) for x in runs], [
+            (1, 1, datetime(2025, 4, 4, 23, 50)), (2, 2, datetime(2025, 4, 5, 0, 10))
+        ])
+        runs = upcoming(published.starts, published.snapshot.stations, start + timedelta(minutes=50), start + timedelta(minutes=70))
+        self.assertEqual([x.station_id for x in runs], [1])
+
+        with config.update_config():
+            config.get_station(1).get_program(1).set_start_time(datetime(1970, 1, 1, 6, 0).time())
+            config.get_station(2).delete_program(2)
+            config.get_station(3).get_program(1).set_enabled()
+        published = check()
+        runs = upcoming(published.starts, published.snapshot.stations, start, start + timedelta(hours=2))
+        self.assertEqual([x.station_id for x in runs], [])
+        runs = upcoming(published.starts, published.snapshot.stations, start, start + timedelta(hours=10))
+        self.assertEqual([(x.station_id, x.start) for x in runs], [(1, datetime(2025, 4, 5, 6, 0)), (3, datetime(2025, 4, 5, 8, 0))])
+
+        config.delete_station(1)
+        check()
+
+class UpcomingApiTest(ApiTestCase):
+    def test_window(self):
+        start = (datetime.now() + timedelta(minutes=10)).replace(microsecond=0)
+        with self.config.update_config():
+            for station_id in (1, 2):
+                p = self.config.get_station(station_id).get_program(1)
+                p.set_trigger(Trigger.daily)
+                p.set_start_time(start.time())
+                p.set_enabled()
+            self.config.get_station(1).set_enabled() # not station 2
+
+        r = self.client.get("/status/upcoming", params={"window": 30})
+        self.assertEqual(r.json(), [{
+            "station_id": 1, "program_id": 1,
+            "start": start.isoformat(), "end": (start + timedelta(minutes=30)).isoformat()
+        }])
+        self.assertEqual(self.client.get("/status/upcoming", params={"window": 5}).json(), [])
+        self.assertEqual(self.client.get("/status/upcoming", params={"window": 0}).status_code, 422)
+        self.assertEqual(self.client.get("/status/upcoming", params={"window": 7 * 24 * 60 + 1}).status_code, 422)
+
+class ForecastApiTest(ApiTestCase):
+    def test_unlocked(self):
+        import threading
+
+        with self.config.update_config():
+            s = self.config.get_station(1)
+            s.set_enabled()
+            s.get_program(1).set_enabled()
+            s.get_program(1).set_trigger(Trigger.daily)
+
+        day = datetime.fromisoformat("2025-04-04T00:00:00")
+        params = {"start": day.isoformat(), "end": (day + timedelta(days=366)).isoformat()}
+        r = self.client.get("/forecast", params=params | {"station_id": 1})
+        self.assertEqual(len(r.json()["1"]), 366)
+        self.assertEqual(r.json()["1"][0], [(day + timedelta(hours=8)).isoformat(), (day + timedelta(hours=8, minutes=30)).isoformat()])
+        self.assertEqual(self.client.get("/forecast", params=params | {"station_id": 99}).status_code, 404)
+
+        # the handler doesn't wait on a writer holding the lock
+        locked, done = threading.Event(), threading.Event()
+        def writer():
+            with self.config.lock:
+                locked.set()
+                done.wait(5)
+        t = threading.Thread(target=writer)
+        t.start()
+        locked.wait()
+        try:
+            started = datetime.now()
+            self.main.get_forecast(day, day + timedelta(days=366))
+            self.assertLess(datetime.now() - started, timedelta(seconds=4))
+        finally:
+            done.set()
+            t.join()
+
+class TriggerCalendarTest(unittest.TestCase):
+    def test_bits(self):
+        from models.trigger_calendar import TriggerCalendar, trigger_bit
+
+        calendar = TriggerCalendar()
+        d = datetime(2025, 1, 1)
+        for _ in range(60):
+            weekend = d.weekday() >= 5
+            expected = {
+                Trigger.daily: True,
+                Trigger.even_days: d.day % 2 == 0,
+                Trigger.odd_days: d.day % 2 == 1,
+                Trigger.week_days: not weekend,
+                Trigger.week_ends: weekend,
+            }
+            for trigger, fires in expected.items():
+                self.assertEqual(calendar.fires(d.date(), trigger_bit(trigger, None)), fires)
+            for day in DayOfWeek:
+                self.assertEqual(
+                    calendar.fires(d.date(), trigger_bit(Trigger.day_of_week, day)),
+                    day == DayOfWeek.from_dt(d.weekday())
+                )
+            d += timedelta(days=1)
+
+    def test_blackout(self):
+        from models import trigger_calendar
+        from models.forecast import program_intervals
+
+        friday = datetime(2025, 4, 4)
+        p = Program(Trigger.week_days, datetime(1970, 1, 1, 8), timedelta(minutes=30), enabled=True)
+        default = trigger_calendar.calendar
+        env = {"RETIC_HOLIDAYS": "2025-04-04", "RETIC_BLACKOUTS": " 2025-04-07,"}
+        with mock.patch.dict(os.environ, env):
+            trigger_calendar.calendar = trigger_calendar.calendar_from_env()
+        try:
+            self.assertEqual(p.run(friday + timedelta(hours=8, minutes=10)), State.initial)
+            self.assertEqual(program_intervals(p, friday, friday + timedelta(days=5)), [
+                (friday + timedelta(days=4, hours=8), friday + timedelta(days=4, hours=8, minutes=30))
+            ])
+        finally:
+            trigger_calendar.calendar = default
+        self.assertEqual(len(program_intervals(p, friday, friday + timedelta(days=5))), 3)
+
+
+class RegistryTest(unittest.TestCase):
+    def test_allocate(self):
+        from lib.registry import Registry
+
+        r = Registry({1: "a", 2: "b", 5: "e"})
+        self.assertEqual(r.allocate(), 3)
+        r[3] = "c"
+        r[4] = "d"
+        self.assertEqual(r.allocate(), 6)
+        del r[2]
+        r.pop(4)
+        self.assertEqual(r.allocate(), 2)
+        r[r.allocate()] = "b"
+        self.assertEqual(r.allocate(), 4)
+        r[1_000_000] = "z"
+        r[4] = "d"
+        self.assertEqual(r.allocate(), 6)
+        r.clear()
+        self.assertEqual(r.allocate(), 1)
+
+    def test_config_ids(self):
+        config, _ = memory_config()
+        with config.update_config():
+            config.delete_station(4)
+            s = config.get_station(1)
+            s.add_program()
+        self.assertEqual(config.add_station().station_id, 4)
+        self.assertEqual(config.add_station().station_id, 7)
+
+        self.assertEqual(list(s.programs), [1, 2])
+        with config.update_config():
+            s.delete_program(1)
+        self.assertEqual(s.add_program().program_id, 1)
+
+class OverrideScheduleTest(unittest.TestCase):
+    def test_overlap(self):
+        config, _ = memory_config()
+        s = config.get_station(1)
+        day = datetime(2025, 4, 4)
+        on, off, late = s.add_overrides([
+            {"start_time": day + timedelta(hours=6), "duration": timedelta(hours=4), 
+             "override_enabled": True, "override_type": "on"},
+            {"start_time": day + timedelta(hours=7), "duration": timedelta(hours=1), 
+             "override_enabled": True, "override_type": "off"},
+            {"start_time": day + timedelta(days=1), "duration": timedelta(hours=1), 
+             "override_enabled": True, "override_type": "on"},
+        ])
+        self.assertEqual([on.override_id, off.override_id, late.override_id], [1, 2, 3])
+
+        # the latest to start wins where they overlap
+        self.assertEqual(s.overrides.at(day + timedelta(hours=6, minutes=30)), on)
+        self.assertEqual(s.overrides.at(day + timedelta(hours=7, minutes=30)), off)
+        self.assertEqual(s.overrides.at(day + timedelta(hours=9)), on)
+        self.assertIsNone(s.overrides.at(day + timedelta(hours=11)))
+        self.assertEqual(s.overrides.next_boundary(day + timedelta(hours=7)), day + timedelta(hours=8))
+        self.assertEqual(s.overrides.next_boundary(day + timedelta(hours=10)), day + timedelta(days=1))
+        self.assertEqual(
+            [(x[0], x[2]) for x in s.overrides.segments(day, day + timedelta(days=2))],
+            [(day + timedelta(hours=6), on), (day + timedelta(hours=7), off), 
+             (day + timedelta(hours=8), on), (day + timedelta(days=1), late)]
+        )
+
+        self.assertEqual(s.expire_overrides(day + timedelta(hours=12)), [1, 2])
+        self.assertEqual([x.override_id for x in s.overrides], [3])
+        self.assertTrue(s.delete_override(3))
+        self.assertFalse(s.delete_override(3))
+        self.assertIsNone(s.overrides.at(day + timedelta(days=1)))
+
+
+class JournalStorageTest(unittest.TestCase):
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "journal")
+            config = Config(storage=JournalStorage(path, compact_after=4))
+
+            with config.update_config():
+                config.get_station(1).get_program(1).set_name("lawn")
+                config.get_station(2).set_enabled()
+            config.add_station()
+            config.delete_station(3)
+            config.get_station(1).add_program()
+            with config.update_config():
+                config.get_station(1).get_program(1).set_duration(timedelta(minutes=5))
+            config.close()
+
+            config = Config(storage=JournalStorage(path))
+            self.assertEqual(sorted(config.stations), [1, 2, 4, 5, 6, 7])
+            self.assertEqual(config.get_station(1).get_program(1).name, "lawn")
+            self.assertEqual(config.get_station(1).get_program(1).duration, timedelta(minutes=5))
+            self.assertEqual(sorted(config.get_station(1).programs), [1, 2])
+            self.assertTrue(config.get_station(2).enabled)
+            config.close()
+
+class ConfigWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesce(self):
+        config, storage = memory_config()
+
+        writer = ConfigWriter(config, debounce=0.05, max_delay=1)
+        await writer.start()
+        for name in ("a", "b", "c"):
+            with config.update_config():
+                config.get_station(1).get_program(1).set_name(name)
+        with config.update_config():
+            config.get_station(2).set_enabled()
+        
+        await asyncio.sleep(0.2)
+        self.assertEqual(storage.saves, [{(1, 1), (2, None)}])
+        self.assertEqual(writer.coalesced, 3)
+
+        with config.update_config():
+            config.get_station(3).set_enabled()
+        await writer.stop()
+        self.assertEqual(storage.saves[-1], {(3, None)})
+        self.assertEqual(writer.flushes, 2)
+
+    async def test_unlocked_save(self):
+        import threading
+
+        saving, done = threading.Event(), threading.Event()
+        class SlowStorage(CountingStorage):
+            def save(self, config, changes = None):
+                if changes is not None:
+                    saving.set()
+                    done.wait(5)
+                super().save(config, [(x, config.stations[x[0]].enabled) for x in sorted(changes or [])])
+
+        storage = SlowStorage()
+        config = Config(storage=storage)
+        writer = ConfigWriter(config, debounce=0, max_delay=0)
+        await writer.start()
+        with config.update_config():
+            config.get_station(2).set_enabled()
+        await asyncio.to_thread(saving.wait, 5)
+
+        # the config isn't locked while the storage writes, and the copy it
+        # was given doesn't see the next commit
+        self.assertTrue(config.lock.acquire(timeout=1))
+        config.lock.release()
+        with config.update_config():
+            config.get_station(2).set_disabled()
+        done.set()
+        await writer.stop()
+        self.assertEqual(storage.saves[-2:], [[((2, None), True)], [((2, None), False)]])
+
+class SnapshotFormatTest(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            config = Config(storage=YamlStorage(os.path.join(d, "config.yaml")))
+            with config.update_config():
+                config.get_station(1).get_program(1).set_name("lawn")
+                config.get_station(1).get_program(1).set_week_day(None)
+                config.get_station(2).set_override(
+                    datetime(2025, 4, 4, 6, 0), timedelta(hours=1), "off", True
+                )
+                config.get_station(2).add_overrides([
+                    {"start_time": datetime(2025, 4, 4, 6, 30), "duration": timedelta(hours=2), 
+                     "override_enabled": False, "override_type": "on"}
+                ])
+            expected = stations_to_list(config.stations)
+
+            for storage in (
+                YamlStorage(os.path.join(d, "config.yaml")), 
+                BinaryStorage(os.path.join(d, "config.bin"))
+            ):
+                storage.save(config)
+                self.assertEqual(stations_to_list(storage.load()), expected)
+
+    def test_migrate(self):
+        with tempfile.TemporaryDirectory() as d:
+            legacy = YamlStorage(os.path.join(d, "config.yaml"))
+            config = Config(storage=legacy)
+            with config.update_config():
+                config.get_station(1).get_program(1).set_name("lawn")
+            expected = stations_to_list(config.stations)
+
+            path = os.path.join(d, "config.bin")
+            self.assertEqual(stations_to_list(BinaryStorage(path, legacy=legacy).load()), expected)
+            os.remove(legacy.path)
+            self.assertEqual(stations_to_list(BinaryStorage(path, legacy=legacy).load()), expected)
+
+    def test_unsafe_yaml(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "config.yaml")
+            with open(path, "w") as f:
+                f.write("!!python/object/apply:os.system ['echo unsafe']\n")
+            with self.assertRaises(Exception):
+                YamlStorage(path).load()
+
+class ShardedStorageTest(unittest.TestCase):
+    def test_dirty_shards(self):
+        with tempfile.TemporaryDirectory() as d:
+            storage = ShardedStorage(d, shard_size=2)
+            config = Config(storage=storage)
+            self.assertEqual(storage._shards(), [f"stations-{x:06}.yaml" for x in range(3)])
+
+            written = []
+            write_shards = storage._write_shards
+            storage._write_shards = lambda stations, shards: (written.append(shards), write_shards(stations, shards))
+
+            with config.update_config():
+                config.get_station(4).get_program(1).set_name("lawn")
+            config.delete_station(5)
+            config.delete_station(6)
+            self.assertEqual(written, [{1}, {2}, {2}])
+            self.assertEqual(len(storage._shards()), 2)
+
+            config = Config(storage=ShardedStorage(d, shard_size=2))
+            self.assertEqual(sorted(config.stations), [1, 2, 3, 4])
+            self.assertEqual(config.get_station(4).get_program(1).name, "lawn")
+
+class SqliteStorageTest(unittest.TestCase):
+    def test_rows(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "config.db")
+            config = Config(storage=SqliteStorage(path))
+            with config.update_config():
+                p = config.get_station(2).get_program(1)
+                p.set_enabled()
+                p.set_trigger(Trigger.daily)
+                config.get_station(2).set_override(datetime(2025, 4, 4, 6, 0), timedelta(hours=1), "on", True)
+                config.get_station(2).add_overrides([
+                    {"start_time": datetime(2025, 4, 5, 6, 0), "duration": timedelta(hours=1), 
+                     "override_enabled": True, "override_type": "off"}
+                ])
+            config.get_station(2).add_program()
+            config.delete_station(6)
+            with config.update_config():
+                config.get_station(1).delete_program(1)
+            expected = stations_to_list(config.stations)
+            config.close()
+
+            storage = SqliteStorage(path)
+            self.assertEqual(stations_to_list(Config(storage=storage).stations), expected)
+            self.assertEqual([x.program_id for x in storage.load_station(2).programs.values()], [1, 2])
+            self.assertIsNone(storage.load_program(1, 1))
+            storage.close()
+
+    def test_shared(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "config.db")
+            a = Config(storage=SqliteStorage(path, shared=True))
+            b = Config(storage=SqliteStorage(path, shared=True))
+            self.assertEqual(b.sync(), set())
+
+            untouched = b.get_station(1)
+            with a.update_config():
+                a.get_station(2).get_program(1).set_name("lawn")
+                a.get_station(3).set_enabled()
+            a.delete_station(6)
+            with a.update_config():
+                a.get_station(4).add_program()
+
+            seen = []
+            b.subscribe(seen.append)
+            self.assertEqual(b.sync(), {(2, 1), (3, None), (6, None), (4, 2)})
+            self.assertEqual(seen, [{(2, 1), (3, None), (6, None), (4, 2)}])
+            self.assertEqual(b.get_station(2).get_program(1).name, "lawn")
+            self.assertTrue(b.get_station(3).enabled)
+            self.assertIsNone(b.get_station(6))
+            self.assertEqual(list(b.get_station(4).programs), [1, 2])
+            self.assertIs(b.get_station(1), untouched)
+            self.assertEqual(stations_to_list(b.stations), stations_to_list(a.stations))
+            self.assertEqual(b.snapshot.stations[2].programs[1].name, "lawn")
+
+            # its own writes don't come back, the other side picks them up
+            with b.update_config():
+                b.get_station(1).set_enabled()
+            self.assertEqual(b.sync(), set())
+            self.assertEqual(a.sync(), {(1, None)})
+            self.assertTrue(a.get_station(1).enabled)
+            a.close()
+            b.close()
+
+    def test_shared_ids(self):
+        from types import SimpleNamespace
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "config.db")
+            a = Config(storage=SqliteStorage(path, shared=True))
+            b = Config(storage=SqliteStorage(path, shared=True))
+            for c in (a, b):
+                c.set_writer(SimpleNamespace(mark_dirty=lambda: None)) # flushed by hand
+
+            # new ids come from the database, nothing written yet
+            sa, sb = a.add_station(), b.add_station()
+            self.assertEqual((sa.station_id, sb.station_id), (7, 8))
+            pa, pb = a.get_station(1).add_program(), b.get_station(1).add_program()
+            self.assertEqual((pa.program_id, pb.program_id), (2, 3))
+            with a.update_config():
+                sa.update_description("from A")
+            with b.update_config():
+                sb.update_description("from B")
+            a.flush()
+            b.flush()
+            a.sync()
+            b.sync()
+            for c in (a, b):
+                self.assertEqual({x: c.get_station(x).description for x in (7, 8)}, {7: "from A", 8: "from B"})
+                self.assertEqual(list(c.get_station(1).programs), [1, 2, 3])
+
+            # both change station 2, a's is written first and b's is dropped
+            with a.update_config():
+                a.get_station(2).update_description("a")
+            with b.update_config():
+                b.get_station(2).update_description("b")
+                b.get_station(3).update_description("b")
+            a.flush()
+            self.assertEqual(b.sync(), {(2, None)})
+            self.assertEqual(b.conflicts, 1)
+            self.assertEqual(b.get_station(2).description, "a")
+            b.flush()
+            self.assertEqual(a.sync(), {(3, None)})
+            self.assertEqual(stations_to_list(a.stations), stations_to_list(b.stations))
+            self.assertEqual(a.conflicts, 0)
+            a.close()
+            b.close()
+
+
+class AsyncRouterTest(unittest.TestCase):
+    def test_handlers(self):
+        from fastapi import FastAPI, APIRouter
+        from fastapi.routing import APIRoute
+        from fastapi.testclient import TestClient
+        from lib.fastapi_helper import async_router
+
+        api = APIRouter()
+        names = {}
+
+        @api.get("/name/{n}", response_model=str)
+        def get_name(n: int):
+            return names.get(n, "")
+
+        @api.put("/name/{n}")
+        def set_name(n: int, name: str):
+            names[n] = name
+
+        app = FastAPI()
+        app.include_router(async_router(api, asyncio.Lock()))
+        self.assertTrue(all(asyncio.iscoroutinefunction(x.endpoint) for x in app.routes if isinstance(x, APIRoute)))
+
+        with TestClient(app) as client:
+            self.assertEqual(client.put("/name/1", params={"name": "lawn"}).status_code, 200)
+            self.assertEqual(client.get("/name/1").json(), "lawn")
+            self.assertEqual(client.get("/name/x").status_code, 422)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_source(self):
+        import json
+        from lib.fastapi_helper import ResponseCache
+        from models import StationSummaryModel
+
+        config, _ = memory_config()
+        scheduler = Scheduler(config)
+        scheduler.refresh()
+        cache = ResponseCache()
+
+        def get():
+            statuses = scheduler.statuses
+            return json.loads(cache.response("s", statuses, list[StationSummaryModel], list(statuses.values())).body)
+
+        first = get()
+        self.assertEqual(get(), first)
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 1, "misses": 1})
+
+        # a commit the scheduler has picked up is a new answer
+        with config.update_config():
+            config.get_station(2).set_enabled()
+        scheduler._changed.add((2, None))
+        scheduler.tick()
+        self.assertTrue(get()[1]["enabled"])
+        self.assertEqual(cache.stats()["misses"], 2)
+
+
+class StaticFilesTest(unittest.TestCase):
+    def test_precompressed(self):
+        import gzip
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from lib.fastapi_helper import PrecompressedStaticFiles
+
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, "assets"))
+            script = b"console.log('retic');" * 100
+            for name, body in [
+                ("index.html", b"<html></html>"),
+                ("assets/index-Bx3_z9Qa.js", script),
+                ("assets/index-Bx3_z9Qa.js.gz", gzip.compress(script)),
+                ("assets/index-Bx3_z9Qa.js.br", b"not really brotli"),
+            ]:
+                with open(os.path.join(d, name), "wb") as f:
+                    f.write(body)
+
+            app = FastAPI()
+            app.mount("/", PrecompressedStaticFiles(directory=d, html=True))
+            with TestClient(app) as client:
+                url = "/assets/index-Bx3_z9Qa.js"
+                r = client.get(url, headers={"Accept-Encoding": "gzip, br;q=0"})
+                self.assertEqual((r.headers["content-encoding"], r.content), ("gzip", script))
+                self.assertEqual(r.headers["content-type"].split(";")[0], "text/javascript")
+                self.assertEqual(r.headers["cache-control"], "public, max-age=31536000, immutable")
+                self.assertEqual(r.headers["vary"], "Accept-Encoding")
+
+                self.assertEqual(client.get(url, headers={"Accept-Encoding": "br, gzip"}).headers["content-encoding"], "br")
+                r = client.get(url, headers={"Accept-Encoding": "identity"})
+                self.assertEqual((r.headers.get("content-encoding"), r.content), (None, script))
+
+                etag = r.headers["etag"]
+                self.assertEqual(client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code, 304)
+                r = client.get(url, headers={"Accept-Encoding": "identity", "Range": "bytes=0-6"})
+                self.assertEqual((r.status_code, r.content), (206, b"console"))
+
+                r = client.get("/", headers={"Accept-Encoding": "gzip"})
+                self.assertEqual((r.headers["cache-control"], r.headers.get("content-encoding")), ("no-cache", None))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)